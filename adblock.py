@@ -0,0 +1,325 @@
+import glob
+import logging
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from cosmetic import CosmeticIndex, load_cosmetic
+from filterlist import (ALL_TYPES, DEFAULT_TYPES, FIRST_PARTY, RESOURCE_TYPES, THIRD_PARTY, TOKEN_RE, host_suffixes,
+                        key_hash, load_filter_list)
+
+DEFAULT_BLOCKED_DOMAINS = (
+    "doubleclick.net", "adservice.google.com", "googlesyndication.com",
+    "ads.yahoo.com", "adnxs.com", "adsfacebook.com"
+)
+FILTER_LISTS = 'filters/*.txt'
+CACHE_DIR = 'adblock_cache'
+
+
+def url_host(url):
+    """Return the lower-cased host of a URL, or '' if it has none."""
+    try:
+        host = urlsplit(url).hostname
+    except ValueError:
+        return ''
+    return (host or '').rstrip('.')
+
+
+def is_third_party(host, page_host):
+    """Rough registrable-domain comparison: the last two labels must agree."""
+    if not page_host:
+        return None
+    return host.split('.')[-2:] != page_host.split('.')[-2:]
+
+
+class DomainMatcher:
+    """Hashed suffix lookup of blocked domains.
+
+    A host matches when it equals a listed domain or is a subdomain of one,
+    so checking a host costs one set lookup per label instead of a scan of
+    every rule.
+    """
+
+    def __init__(self, domains=()):
+        self.domains = set()
+        for domain in domains:
+            self.add(domain)
+
+    def add(self, domain):
+        domain = domain.strip().lower().strip('.')
+        if domain:
+            self.domains.add(domain)
+
+    def match(self, host):
+        """Return the listed domain covering host, or None."""
+        if host in self.domains:
+            return host
+        dot = host.find('.')
+        while dot != -1:
+            suffix = host[dot + 1:]
+            if suffix in self.domains:
+                return suffix
+            dot = host.find('.', dot + 1)
+        return None
+
+    def __contains__(self, host):
+        return self.match(host) is not None
+
+    def __len__(self):
+        return len(self.domains)
+
+
+class DecisionCache:
+    """Bounded LRU with hit/miss counters, for HostDecisions and per-token rule lookups."""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class HostDecision:
+    """What the ||domain rules say about one request's (host, type, party) combination.
+
+    blocked/excepted come from rules that look only at the host; path_rules
+    are the remaining ||domain rules for the host, which still have to be
+    matched against each URL.
+    """
+
+    __slots__ = ("blocked", "excepted", "path_rules")
+
+    def __init__(self, blocked, excepted, path_rules):
+        self.blocked = blocked
+        self.excepted = excepted
+        self.path_rules = path_rules
+
+
+class RuleSet:
+    """The built-in domains plus any compiled filter lists, matched together.
+
+    The host part of a decision, from the built-in domains and the
+    ||domain rules of the host and its parents, is worked out once per
+    (host, type, party) and kept in the DecisionCache. Each request then
+    only matches its URL against the host's path rules and the token rules
+    for the tokens in it; the rules per token are looked up through the
+    Bloom filters once and cached, since the same tokens come up in
+    request after request. A URL none of whose tokens has rules (when no
+    list has untokenized rules) is decided by the host part alone. Each RuleSet
+    carries its own cache, so swapping in a reloaded RuleSet also drops
+    every decision made under the old rules.
+    """
+
+    def __init__(self, domains=(), indexes=(), cache_size=4096):
+        self.domains = DomainMatcher(domains)
+        self.indexes = list(indexes)
+        self.token_indexes = [index for index in self.indexes if index.has_token_rules]
+        # Rules without a token must be tried on every URL, so they are decoded once here
+        self.untokenized = tuple(rule for index in self.token_indexes for rule in index.untokenized_rules())
+        self.cache = DecisionCache(cache_size)
+        self.token_cache = DecisionCache(cache_size * 4)  # token -> the token rules keyed by it
+        self.bloom_checks = 0
+        self.bloom_skips = 0
+
+    def _domain_rules(self, host):
+        for suffix in host_suffixes(host):
+            h = key_hash(suffix)
+            for index in self.indexes:
+                self.bloom_checks += 1
+                if h in index.domain_bloom:
+                    yield from index.domain_rules(suffix, h)
+                else:
+                    self.bloom_skips += 1
+
+    def _token_rules(self, url):
+        """The token rules that could match url: those whose token it contains, and the untokenized ones."""
+        rules = list(self.untokenized)
+        for token in set(TOKEN_RE.findall(url.lower())):
+            token_rules = self.token_cache.get(token)
+            if token_rules is None:
+                token_rules = []
+                h = key_hash(token)
+                for index in self.token_indexes:
+                    self.bloom_checks += 1
+                    if h in index.token_bloom:
+                        token_rules.extend(index.token_rules(h))
+                    else:
+                        self.bloom_skips += 1
+                token_rules = tuple(token_rules)
+                self.token_cache.put(token, token_rules)
+            rules.extend(token_rules)
+        return rules
+
+    def _host_decision(self, host, types, third_party):
+        blocked = self.domains.match(host) is not None
+        excepted = False
+        path_rules = []
+        for rule in self._domain_rules(host):
+            if not rule.is_host_level:
+                path_rules.append(rule)
+            elif rule.applies_to(types, third_party, None):
+                if rule.is_exception:
+                    excepted = True
+                else:
+                    blocked = True
+        return HostDecision(blocked, excepted, tuple(path_rules))
+
+    def match(self, url, resource_type=None, first_party_url=None):
+        """Return True if the request should be blocked."""
+        host = url_host(url)
+        if not host:
+            return False
+        types = RESOURCE_TYPES.get(resource_type, DEFAULT_TYPES)
+        page_host = url_host(first_party_url) if first_party_url else ''
+        third_party = is_third_party(host, page_host)
+
+        key = (host, types, third_party)
+        decision = self.cache.get(key)
+        if decision is None:
+            decision = self._host_decision(host, types, third_party)
+            self.cache.put(key, decision)
+        if decision.excepted:
+            return False
+        token_rules = self._token_rules(url) if self.token_indexes else ()
+        if not decision.path_rules and not token_rules:
+            return decision.blocked  # nothing looks past the host for this URL
+
+        lowered = url.lower()
+        host_end = lowered.find(host, lowered.find('://') + 3) + len(host)
+        rest = url[host_end:]
+
+        def matching(rules, exception):
+            return any(
+                rule.is_exception == exception
+                and rule.applies_to(types, third_party, page_host)
+                and rule.matches(url, rest)
+                for rule in rules
+            )
+
+        blocked = decision.blocked or matching(decision.path_rules, False) or matching(token_rules, False)
+        if not blocked:
+            return False
+        return not (matching(decision.path_rules, True) or matching(token_rules, True))
+
+    def blocks_host(self, host):
+        """True if every request to host is blocked, top-level pages included.
+
+        For callers that see only the host, like the proxy's CONNECT tunnels,
+        which must not refuse a host match() would let a page load from.
+        Host level rules without a party restriction count only if between
+        them they cover every type, documents included: a plain ||host^
+        needs a ||host^$document beside it, or is written ||host^$all. The
+        built-in domains block documents in match() too. Any host level
+        exception keeps the host open.
+        """
+        blocked = ALL_TYPES if self.domains.match(host) is not None else 0  # types blocked outright
+        for rule in self._domain_rules(host):
+            if not rule.is_host_level:
+                continue
+            if rule.is_exception:
+                return False
+            if not rule.flags & (THIRD_PARTY | FIRST_PARTY):
+                blocked |= rule.types
+        return blocked & ALL_TYPES == ALL_TYPES
+
+    def stats(self):
+        return {
+            'rules': len(self),
+            'cache_entries': len(self.cache.entries),
+            'cache_hits': self.cache.hits,
+            'cache_misses': self.cache.misses,
+            'cache_hit_rate': self.cache.hit_rate,
+            'token_cache_hit_rate': self.token_cache.hit_rate,
+            'bloom_checks': self.bloom_checks,
+            'bloom_skips': self.bloom_skips,
+        }
+
+    def __len__(self):
+        return len(self.domains) + sum(index.rule_count for index in self.indexes)
+
+
+class AdBlocker:
+    """Holds the current RuleSet snapshot.
+
+    A RuleSet is never modified once built. reload() builds a new one and
+    rebinds self.rules in a single assignment, so intercept_request (which
+    runs on Qt's IO thread) reads either the old or the new rules without
+    any locking. Reloads themselves are serialised so they cannot finish
+    out of order. With read_only set, lists are used only if their compiled
+    cache in cache_dir is current, so the blocker never writes a file.
+    """
+
+    def __init__(self, domains=DEFAULT_BLOCKED_DOMAINS, filter_lists=FILTER_LISTS, cache_dir=CACHE_DIR, load=True,
+                 block_log=None, read_only=False):
+        self.domains = tuple(domains)
+        self.read_only = read_only
+        self.block_log = block_log  # gets every blocked request, see blocklog.BlockLog
+        self.filter_lists = filter_lists
+        self.cache_dir = cache_dir
+        self._reload_lock = threading.Lock()
+        # With load=False only the built-in domains apply until reload() is called
+        self.rules = self.build_rules() if load else RuleSet(self.domains, [])
+        self.cosmetic = self.build_cosmetic() if load else CosmeticIndex()
+
+    def build_rules(self):
+        indexes = []
+        for path in sorted(glob.glob(self.filter_lists)):
+            index = load_filter_list(path, self.cache_dir, write_cache=not self.read_only)
+            if index is None:
+                logging.getLogger('adblock').warning('skipping %s: not compiled yet', path)
+            else:
+                indexes.append(index)
+        return RuleSet(self.domains, indexes)
+
+    def build_cosmetic(self):
+        """Element hiding rules from every filter list, merged into one CosmeticIndex."""
+        index = CosmeticIndex()
+        for path in sorted(glob.glob(self.filter_lists)):
+            cosmetic = load_cosmetic(path, self.cache_dir, write_cache=not self.read_only)
+            if cosmetic is not None:
+                index.update(cosmetic)
+        return index
+
+    def reload(self):
+        with self._reload_lock:
+            self.rules = self.build_rules()
+            self.cosmetic = self.build_cosmetic()
+
+    def stats(self):
+        """Decision cache and Bloom filter counters for the current rules."""
+        return self.rules.stats()
+
+    def intercept_request(self, url, resource_type=None, first_party_url=None):
+        rules = self.rules  # one snapshot per request
+        if rules.match(url, resource_type, first_party_url):
+            if self.block_log is not None:
+                self.block_log.record(url, resource_type, first_party_url)
+            return True  # Indicates the request should be blocked
+        return False  # Indicates the request can proceed
+
+    def intercept_host(self, url):
+        """Like intercept_request, for requests whose type and page are unknown; only whole-host rules apply."""
+        if self.rules.blocks_host(url_host(url)):
+            if self.block_log is not None:
+                self.block_log.record(url)
+            return True
+        return False
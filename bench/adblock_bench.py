@@ -0,0 +1,229 @@
+"""Ad-block scaling benchmark: rule-set size against decision cost.
+
+    python bench/adblock_bench.py [--sizes 1000,10000,100000,500000] [--urls 1000000]
+                                  [--matcher NAME ...] [--output results.json]
+
+For every (matcher, size) pair a child process generates a filter list of
+that many rules and a deterministic corpus of synthetic request URLs. Like
+a real list such as EasyList, most rules are ||domain^ rules, and the rest
+are generic token rules (/adbanner123/*), path rules on otherwise clean
+hosts (||cdn12.example.net/ads/) and exceptions to those. Without the
+last three every URL on a clean host would be decided by its host alone,
+which flatters the decision cache. It then loads the rules and replays the whole corpus through the
+matcher. It reports:
+
+- rule-load time, cold (compiling the list) and warm (index already cached)
+- compiled index size on disk and RSS growth from loading the rules
+- decisions per second over the whole corpus
+- per-decision latency p50/p99 (includes ~0.1 us of timer overhead)
+
+Matchers are registered in MATCHERS. Each entry turns a filter list into a
+match(url, resource_type, first_party_url) callable, so the numbers for
+different implementations come from the same rules and URLs.
+"""
+import argparse
+import contextlib
+import glob
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from stats import environment, summarize  # noqa: E402
+
+SIZES = (1000, 10000, 100000, 500000)
+URLS = 1000000
+SEED = 20240601
+BLOCKED_SHARE = 0.1  # fraction of requests that go to a listed domain
+GENERIC_SHARE = 0.1  # of the rules, generic /adbanner<n>/ rules
+PATH_SHARE = 0.05  # of the rules, ||host/ads/ rules on clean hosts, one in ten with an @@ exception
+AD_PATH_SHARE = 0.05  # of the requests, to an ad path on a clean host
+SITES = 5000
+TLDS = ('com', 'net', 'org', 'io', 'co', 'de')
+TYPES = ('script', 'image', 'image', 'stylesheet', 'xmlhttprequest', 'subdocument', 'font', 'media')
+
+
+def rss():
+    with open('/proc/self/status', 'r') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def rule_domains(size, rng):
+    return [f'ad{rng.randrange(36 ** 6):06x}{i}.{rng.choice(TLDS)}' for i in range(size)]
+
+
+def clean_host(rng):
+    return f'cdn{int(SITES * rng.random() ** 3)}.example.net'
+
+
+def write_filter_list(path, domains, size):
+    """Write size rules, ||domain^ ones and the rest; return the listed domains and the generic ad paths."""
+    ad_paths = [f'/adbanner{n}/' for n in range(int(size * GENERIC_SHARE))]
+    domains = domains[:size - len(ad_paths) - int(size * PATH_SHARE)]
+    with open(path, 'w') as f:
+        f.write('[Adblock Plus 2.0]\n')
+        for domain in domains:
+            f.write(f'||{domain}^\n')
+        for ad_path in ad_paths:
+            f.write(ad_path + '*\n')  # a bare /.../ would be a regex rule
+        for n in range(int(size * PATH_SHARE)):
+            host = f'cdn{n}.example.net'
+            f.write(f'@@||{host}/ads/ok/\n' if n % 10 == 9 else f'||{host}/ads/\n')
+    return domains, ad_paths
+
+
+def url_corpus(count, domains, ad_paths, rng):
+    """Synthetic (url, resource_type, first_party_url) requests.
+
+    Hosts are skewed so a few sites get most requests, as in real browsing.
+    BLOCKED_SHARE of requests go to (subdomains of) listed domains and
+    AD_PATH_SHARE to ad paths, generic or host-specific, on clean hosts.
+    """
+    corpus = []
+    for i in range(count):
+        page = f'https://site{int(SITES * rng.random() ** 3)}.example.org/'
+        path = f'/assets/{rng.randrange(1000)}/'
+        roll = rng.random()
+        if roll < BLOCKED_SHARE:
+            host = rng.choice(('', 'cdn.', 'static.')) + domains[int(len(domains) * rng.random() ** 2)]
+        else:
+            host = clean_host(rng)
+            if roll < BLOCKED_SHARE + AD_PATH_SHARE:
+                path = rng.choice(ad_paths) if ad_paths and rng.random() < 0.5 else rng.choice(('/ads/', '/ads/ok/'))
+        url = f'https://{host}{path}item{i % 97}.js?v={rng.randrange(100)}'
+        corpus.append((url, rng.choice(TYPES), page))
+    return corpus
+
+
+def load_adblocker(list_path, cache_dir, cache_size=None):
+    from adblock import AdBlocker
+    blocker = AdBlocker(domains=(), filter_lists=list_path, cache_dir=cache_dir)
+    if cache_size is not None:
+        blocker.rules.cache.maxsize = cache_size
+    return blocker.intercept_request, blocker.stats
+
+
+def load_domain_set(list_path, cache_dir):
+    """The pre-filter-list matcher: every rule domain in one hashed suffix set; other rules are ignored."""
+    from adblock import AdBlocker
+    with open(list_path, 'r') as f:
+        domains = [line[2:-1] for line in (line.strip() for line in f) if line.startswith('||') and line.endswith('^')]
+    blocker = AdBlocker(domains=domains, filter_lists=os.path.join(cache_dir, 'none', '*.txt'), cache_dir=cache_dir)
+    return blocker.intercept_request, blocker.stats
+
+
+MATCHERS = {
+    'adblock': load_adblocker,
+    'adblock-nocache': lambda list_path, cache_dir: load_adblocker(list_path, cache_dir, cache_size=0),
+    'domain-set': load_domain_set,
+}
+
+
+def run_case(matcher, size, count, workdir, result_path):
+    """Child process: measure one matcher on one rule-set size."""
+    rng = random.Random(SEED + size)
+    domains = rule_domains(size, rng)
+    list_path = os.path.join(workdir, 'rules.txt')
+    cache_dir = os.path.join(workdir, 'cache')
+    domains, ad_paths = write_filter_list(list_path, domains, size)
+    corpus = url_corpus(count, domains, ad_paths, rng)
+    del domains
+    load = MATCHERS[matcher]
+    import adblock  # noqa: F401  (keep the import out of the cold load time)
+
+    start = time.perf_counter()
+    load(list_path, cache_dir)
+    cold_load = time.perf_counter() - start
+
+    rss_before = rss()
+    start = time.perf_counter()
+    match, stats = load(list_path, cache_dir)
+    warm_load = time.perf_counter() - start
+    rss_loaded = rss()
+
+    latencies = array('q', bytes(8 * len(corpus)))
+    blocked = 0
+    clock = time.perf_counter_ns
+    # Older versions of intercept_request print each blocked URL; keep that out of the output
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        for i, (url, resource_type, first_party_url) in enumerate(corpus):
+            t = clock()
+            if match(url, resource_type, first_party_url):
+                blocked += 1
+            latencies[i] = clock() - t
+        elapsed = time.perf_counter() - start
+
+    result = {
+        'matcher': matcher,
+        'rules': size,
+        'urls': len(corpus),
+        'cold_load_s': round(cold_load, 4),
+        'warm_load_s': round(warm_load, 4),
+        'index_bytes': sum(os.path.getsize(p) for p in glob.glob(os.path.join(cache_dir, '*'))),
+        'rss_load_mb': round((rss_loaded - rss_before) / 2**20, 2),
+        'rss_after_replay_mb': round((rss() - rss_before) / 2**20, 2),
+        'decisions_per_s': round(len(corpus) / elapsed),
+        'decision_us': summarize(latencies, scale=1e-3),
+        'blocked': blocked,
+        'matcher_stats': stats(),
+    }
+    with open(result_path, 'w') as f:
+        json.dump(result, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)), help='comma-separated rule counts')
+    parser.add_argument('--urls', type=int, default=URLS, help=f'URLs replayed per case (default {URLS})')
+    parser.add_argument('--matcher', action='append', choices=sorted(MATCHERS),
+                        help='matcher to measure (repeatable); default all')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    parser.add_argument('--child', nargs=2, metavar=('MATCHER', 'SIZE'), help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_case(args.child[0], int(args.child[1]), args.urls, args.workdir, args.result)
+        return
+
+    results = {'environment': environment(), 'seed': SEED, 'urls': args.urls, 'cases': []}
+    for matcher in args.matcher or list(MATCHERS):
+        for size in (int(s) for s in args.sizes.split(',')):
+            # A fresh process per case keeps RSS and cache effects from leaking between cases
+            with tempfile.TemporaryDirectory(prefix=f'adblock-bench-{size}-') as workdir:
+                result_path = os.path.join(workdir, 'result.json')
+                try:
+                    subprocess.run([sys.executable, os.path.abspath(__file__), '--child', matcher, str(size),
+                                    '--urls', str(args.urls), '--workdir', workdir, '--result', result_path],
+                                   check=True)
+                    with open(result_path, 'r') as f:
+                        result = json.load(f)
+                except (subprocess.SubprocessError, OSError, ValueError) as e:
+                    result = {'matcher': matcher, 'rules': size, 'error': str(e)}
+            results['cases'].append(result)
+            print(f"{matcher} {size}: {result.get('decisions_per_s')} decisions/s, "
+                  f"p99 {result.get('decision_us', {}).get('p99')} us", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""Repeat-visit benchmark for the HTTP cache settings in webprofile.py.
+
+    python bench/cache_bench.py [--output results.json] [--variant NAME ...]
+
+Each variant writes its web_* settings into a fresh temporary directory
+and drives the real Browser there with QT_QPA_PLATFORM=offscreen, twice:
+
+1. a cold visit to a fixture page whose images are cacheable, then
+   --repeats repeat visits, each after a detour through about:blank
+2. after a restart, one visit, then Clear Cache and one more visit
+
+Every visit records its load time (loadStarted -> loadFinished), how many
+requests reached the fixture server and how many bytes the disk cache
+holds afterwards. The fixture delays each first-party response, so a
+visit the cache does not answer is visibly slower.
+
+Results are written as JSON together with the git commit, so runs from
+different versions can be diffed.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from fixture import FixtureServer  # noqa: E402
+from stats import environment, summarize  # noqa: E402
+
+TMPFS = '/dev/shm'
+VARIANTS = {
+    'disk': {'web_cache_type': 'disk'},
+    'disk_tmpfs': {'web_cache_type': 'disk', 'tmpfs': True},
+    'disk_1mb': {'web_cache_type': 'disk', 'web_cache_mb': 1},
+    'memory': {'web_cache_type': 'memory'},
+    'none': {'web_cache_type': 'none'},
+}
+PAGE = {'assets': 30, 'cache': 3600, 'kb': 64, 'delay': 20}
+SETTLE_S = 2.5  # Chromium writes and clears the disk cache in the background
+TIMEOUT_S = 180
+
+
+def wait_until(predicate, timeout):
+    from PyQt5.QtCore import QEventLoop, QTimer
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            raise TimeoutError('benchmark variant timed out')
+        loop = QEventLoop()
+        QTimer.singleShot(20, loop.quit)
+        loop.exec_()
+
+
+def settle(seconds):
+    end = time.perf_counter() + seconds
+    wait_until(lambda: time.perf_counter() >= end, seconds + 1)
+
+
+def load(view, url):
+    """Load url in view and return (seconds from loadStarted to loadFinished, ok)."""
+    from PyQt5.QtCore import QUrl
+    started = [time.perf_counter()]
+    done = []
+
+    def load_started():
+        started[0] = time.perf_counter()
+
+    def load_finished(ok):
+        done.append((time.perf_counter() - started[0], ok))
+    view.loadStarted.connect(load_started)
+    view.loadFinished.connect(load_finished)
+    view.load(QUrl(url))
+    wait_until(lambda: done, TIMEOUT_S)
+    view.loadStarted.disconnect(load_started)
+    view.loadFinished.disconnect(load_finished)
+    return done[0]
+
+
+def run_variant(phase, port, workdir, result_path, repeats):
+    """Child process: one browser session of a variant, written to result_path."""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    if hasattr(os, 'geteuid') and os.geteuid() == 0:
+        os.environ.setdefault('QTWEBENGINE_DISABLE_SANDBOX', '1')  # Chromium refuses to sandbox as root
+    os.chdir(workdir)
+    from PyQt5.QtWidgets import QApplication
+    import v5
+    from webprofile import cache_usage
+
+    app = QApplication([sys.argv[0]])
+    server = FixtureServer(port=port).__enter__()  # same port each run, so cache keys match
+    url = server.url(0, **PAGE)
+    window = v5.Browser()
+    window.open_urls(['about:blank'])  # instead of the home page
+    window.show()
+    wait_until(lambda: window.profile is not None and window.tabs.count(), TIMEOUT_S)
+    view = window.tabs.currentWidget()
+
+    def visit():
+        hits = server.hits
+        seconds, ok = load(view, url)
+        settle(SETTLE_S)
+        result = {'load_ms': round(seconds * 1000, 1), 'ok': ok, 'fixture_requests': server.hits - hits,
+                  'cache_bytes': cache_usage(window.web_profile)}
+        load(view, 'about:blank')
+        return result
+
+    if phase == 'visits':
+        cold = visit()
+        repeat = [visit() for _ in range(repeats)]
+        result = {
+            'cold': cold,
+            'repeat_load_ms': summarize([r['load_ms'] for r in repeat], scale=1, digits=1),
+            'repeat_fixture_requests': summarize([r['fixture_requests'] for r in repeat], scale=1, digits=1),
+            'failed_loads': sum(1 for r in [cold] + repeat if not r['ok']),
+            'cache_bytes': repeat[-1]['cache_bytes'] if repeat else cold['cache_bytes'],
+        }
+    else:
+        after_restart = visit()
+        before = cache_usage(window.web_profile)
+        window.clear_cache()
+        settle(SETTLE_S)
+        cleared = cache_usage(window.web_profile)
+        result = {'after_restart': after_restart, 'cache_bytes_before_clear': before,
+                  'cache_bytes_after_clear': cleared, 'after_clear': visit()}
+    with open(result_path, 'w') as f:
+        json.dump(result, f)
+    window.close()
+    server.__exit__()
+    app.quit()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def bench_variant(name, repeats):
+    """Both runs of a variant, each in its own child process."""
+    params = dict(VARIANTS[name])
+    with tempfile.TemporaryDirectory(prefix=f'bench-cache-{name}-') as workdir:
+        cache_dir = os.path.join(workdir, 'cache')
+        if params.pop('tmpfs', False):
+            if not os.path.isdir(TMPFS):
+                return {'error': f'{TMPFS} does not exist'}
+            cache_dir = tempfile.mkdtemp(prefix='bench-cache-', dir=TMPFS)
+        settings = dict(params, web_cache_path=cache_dir, web_storage_path=os.path.join(workdir, 'storage'))
+        with open(os.path.join(workdir, 'settings.json'), 'w') as f:
+            json.dump(settings, f)
+        home = os.path.join(workdir, 'home')
+        env = dict(os.environ, HOME=home, XDG_DATA_HOME=os.path.join(home, '.local', 'share'),
+                   XDG_CACHE_HOME=os.path.join(home, '.cache'), XDG_CONFIG_HOME=os.path.join(home, '.config'),
+                   PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])))
+        port = free_port()
+        result = {'settings': params}
+        try:
+            for phase in ('visits', 'restart'):
+                result_path = os.path.join(workdir, f'{phase}.json')
+                # Keep anything the browser prints out of our JSON output
+                subprocess.run([sys.executable, os.path.abspath(__file__), '--child', phase, '--port', str(port),
+                                '--workdir', workdir, '--result', result_path, '--repeats', str(repeats)],
+                               env=env, stdout=subprocess.DEVNULL, timeout=TIMEOUT_S * 2, check=True)
+                with open(result_path, 'r') as f:
+                    result[phase] = json.load(f)
+                for path in glob.glob(os.path.join(workdir, 'profile.db*')):
+                    os.remove(path)  # so the restart does not restore the saved session
+        except (subprocess.SubprocessError, OSError, ValueError) as e:
+            result['error'] = str(e)
+        finally:
+            if not cache_dir.startswith(workdir):
+                shutil.rmtree(cache_dir, ignore_errors=True)
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--variant', action='append', choices=sorted(VARIANTS),
+                        help='run only this variant (repeatable); default all')
+    parser.add_argument('--repeats', type=int, default=10, help='repeat visits per variant (default 10)')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    parser.add_argument('--child', choices=('visits', 'restart'), help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_variant(args.child, args.port, args.workdir, args.result, args.repeats)
+        return
+
+    results = {'environment': environment(), 'page': PAGE, 'repeats': args.repeats, 'variants': {}}
+    for name in args.variant or list(VARIANTS):
+        result = results['variants'][name] = bench_variant(name, args.repeats)
+        print(f'{name}: {json.dumps(result)}', file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
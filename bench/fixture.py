@@ -0,0 +1,105 @@
+"""Local HTTP server serving synthetic pages for the benchmarks.
+
+Pages are generated from the path, so nothing needs to exist on disk:
+
+    /page/<n>?assets=20&ads=50&trackers=10
+
+returns an HTML page with that many first-party images, ad scripts and
+images on ads.localhost, and tracking pixels on tracker.localhost.
+Responses are no-store unless the page asks for cache=<max-age seconds>;
+kb=<n> pads every first-party image to n KiB and delay=<ms> holds each
+first-party response back, as a distant server would. All three carry
+over to the page's images.
+Chromium resolves every *.localhost name to the loopback address, so the
+"third-party" requests reach this same server under another host name.
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+AD_HOSTS = ('ads.localhost', 'tracker.localhost')
+
+# Filter list installed for the benchmarks; blocks both ad hosts
+FILTER_LIST = """[Adblock Plus 2.0]
+! Benchmark fixture rules
+||ads.localhost^
+||tracker.localhost^$third-party
+/banner/*$image
+"""
+
+# 1x1 transparent GIF
+PIXEL = (b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00'
+         b',\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;')
+
+
+def page_html(n, port, assets, ads, trackers, query=''):
+    parts = [f'<!DOCTYPE html><html><head><title>Fixture {n}</title></head><body><h1>Page {n}</h1>']
+    for i in range(assets):
+        parts.append(f'<img src="/static/{n}/{i}.gif{query}" width="1" height="1">')
+    for i in range(ads):
+        parts.append(f'<script src="http://ads.localhost:{port}/serve/{n}/{i}.js"></script>')
+        parts.append(f'<img src="http://ads.localhost:{port}/banner/{n}/{i}.gif">')
+    for i in range(trackers):
+        parts.append(f'<img src="http://tracker.localhost:{port}/pixel.gif?p={n}&i={i}">')
+    parts.append('<p>' + 'Lorem ipsum dolor sit amet. ' * 200 + '</p></body></html>')
+    return ''.join(parts).encode('utf-8')
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        self.server.hits += 1
+        params = {k: int(v[0]) for k, v in parse_qs(parts.query).items()}
+        if params.get('delay') and not parts.path.startswith(('/serve/', '/banner/', '/pixel')):
+            time.sleep(params['delay'] / 1000)
+        if parts.path.startswith('/page/'):
+            carried = '&'.join(f'{k}={params[k]}' for k in ('cache', 'kb', 'delay') if k in params)
+            body = page_html(parts.path.rsplit('/', 1)[1], self.server.server_port,
+                             params.get('assets', 20), params.get('ads', 0), params.get('trackers', 0),
+                             '?' + carried if carried else '')
+            content_type = 'text/html; charset=utf-8'
+        elif parts.path.endswith('.js'):
+            body, content_type = b'void 0;', 'application/javascript'
+        else:
+            # Bytes after the GIF trailer are ignored by decoders
+            body, content_type = PIXEL + b'\0' * (params.get('kb', 0) * 1024), 'image/gif'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', f"max-age={params['cache']}" if params.get('cache') else 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer:
+    """ThreadingHTTPServer on an ephemeral port, run on a daemon thread."""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.httpd = ThreadingHTTPServer((host, port), FixtureHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.hits = 0
+        self.port = self.httpd.server_port
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, n, assets=20, ads=0, trackers=0, cache=0, kb=0, delay=0):
+        url = f'http://localhost:{self.port}/page/{n}?assets={assets}&ads={ads}&trackers={trackers}'
+        for name, value in (('cache', cache), ('kb', kb), ('delay', delay)):
+            if value:
+                url += f'&{name}={value}'
+        return url
+
+    @property
+    def hits(self):
+        return self.httpd.hits
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,196 @@
+"""Headless page-load benchmark for the Browser window in v5.py.
+
+    python bench/pageload.py [--output results.json] [--scenario NAME ...]
+
+Each scenario starts the real Browser in its own process with
+QT_QPA_PLATFORM=offscreen, inside a fresh temporary directory (so
+profile.db and the compiled filter cache start cold), and loads pages from
+the local fixture server in fixture.py. Per scenario it records:
+
+- page-load latency, loadStarted -> loadFinished, and from tab creation
+- startup time, Browser() -> first loadFinished
+- every request seen by the ad blocker, how many were blocked and how long
+  each decision took
+- RSS of the browser and all of its child processes once loading is done
+
+Results are written as JSON together with the git commit, so runs from
+different versions can be diffed.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from fixture import FILTER_LIST, FixtureServer  # noqa: E402
+from stats import environment, process_tree_rss, summarize  # noqa: E402
+
+SCENARIOS = {
+    'cold_start': {'tabs': 1, 'assets': 20, 'ads': 0, 'trackers': 0},
+    'tabs_50': {'tabs': 50, 'assets': 20, 'ads': 5, 'trackers': 5},
+    'ad_heavy': {'tabs': 5, 'assets': 20, 'ads': 150, 'trackers': 50},
+}
+TIMEOUT_S = 180
+
+
+def write_filters(workdir, filler_rules):
+    """Fixture rules plus filler domains, so decisions run against a realistically sized list."""
+    os.makedirs(os.path.join(workdir, 'filters'))
+    with open(os.path.join(workdir, 'filters', 'bench.txt'), 'w') as f:
+        f.write(FILTER_LIST)
+        for i in range(filler_rules):
+            f.write(f'||filler{i}.example^\n')
+
+
+class Recorder:
+    """Times every ad-block decision and the load of every tab the window opens."""
+
+    def __init__(self, window):
+        from PyQt5.QtWebEngineWidgets import QWebEngineView
+        self.view_class = QWebEngineView
+        self.window = window
+        self.loads = []
+        self.decisions = []
+        self.blocked = 0
+        self.tracked = set()
+        intercept = window.ad_blocker.intercept_request
+
+        def timed(url, resource_type=None, first_party_url=None):
+            start = time.perf_counter()
+            blocked = intercept(url, resource_type, first_party_url)
+            self.decisions.append(time.perf_counter() - start)
+            if blocked:
+                self.blocked += 1  # only ever called from Qt's IO thread
+            return blocked
+        window.ad_blocker.intercept_request = timed
+        window.tabs.currentChanged.connect(self.track)
+
+    def track(self, index):
+        view = self.window.tabs.widget(index)
+        if not isinstance(view, self.view_class) or view in self.tracked:
+            return
+        self.tracked.add(view)
+        opened = time.perf_counter()
+        started = [opened]
+
+        def load_started():
+            started[0] = time.perf_counter()
+
+        def load_finished(ok):
+            view.loadFinished.disconnect(load_finished)
+            now = time.perf_counter()
+            self.loads.append({'latency': now - started[0], 'since_open': now - opened, 'ok': ok})
+        view.loadStarted.connect(load_started)
+        view.loadFinished.connect(load_finished)
+
+
+def wait_until(predicate, timeout):
+    from PyQt5.QtCore import QEventLoop, QTimer
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            raise TimeoutError('benchmark scenario timed out')
+        loop = QEventLoop()
+        QTimer.singleShot(20, loop.quit)
+        loop.exec_()
+
+
+def run_scenario(name, port, workdir, result_path):
+    """Child process: drive one Browser through a scenario and write its result."""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    if hasattr(os, 'geteuid') and os.geteuid() == 0:
+        os.environ.setdefault('QTWEBENGINE_DISABLE_SANDBOX', '1')  # Chromium refuses to sandbox as root
+    os.chdir(workdir)
+    from PyQt5.QtCore import QUrl
+    from PyQt5.QtWidgets import QApplication
+    import v5
+
+    params = SCENARIOS[name]
+
+    def url(n):
+        return (f"http://localhost:{port}/page/{n}?assets={params['assets']}"
+                f"&ads={params['ads']}&trackers={params['trackers']}")
+
+    app = QApplication([sys.argv[0]])
+    started = time.perf_counter()
+    window = v5.Browser()
+    recorder = Recorder(window)
+    window.open_urls([url(0)])  # opened as the first tab once startup finishes
+    window.showMaximized()
+    wait_until(lambda: recorder.loads, TIMEOUT_S)
+    first_load = time.perf_counter() - started
+    for n in range(1, params['tabs']):
+        window.create_new_tab(QUrl(url(n)), f'Fixture {n}')
+    wait_until(lambda: len(recorder.loads) >= params['tabs'], TIMEOUT_S)
+
+    result = {
+        'params': params,
+        'startup_to_first_load_ms': round(first_load * 1000, 1),
+        'load_latency_ms': summarize([load['latency'] for load in recorder.loads]),
+        'open_to_load_ms': summarize([load['since_open'] for load in recorder.loads]),
+        'failed_loads': sum(1 for load in recorder.loads if not load['ok']),
+        'intercepted_requests': len(recorder.decisions),
+        'blocked_requests': recorder.blocked,
+        'decision_us': summarize(recorder.decisions, scale=1e6),
+        'rss_mb': round(process_tree_rss(os.getpid()) / 2**20, 1),
+    }
+    with open(result_path, 'w') as f:
+        json.dump(result, f)
+    window.close()
+    app.quit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='run only this scenario (repeatable); default all')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    parser.add_argument('--filler-rules', type=int, default=10000,
+                        help='extra domain rules in the filter list (default 10000)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_scenario(args.child, args.port, args.workdir, args.result)
+        return
+
+    results = {'environment': environment(), 'filler_rules': args.filler_rules, 'scenarios': {}}
+    with FixtureServer() as server:
+        for name in args.scenario or list(SCENARIOS):
+            with tempfile.TemporaryDirectory(prefix=f'bench-{name}-') as workdir:
+                write_filters(workdir, args.filler_rules)
+                result_path = os.path.join(workdir, 'result.json')
+                hits = server.hits
+                env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])))
+                try:
+                    # Keep anything the browser prints out of our JSON output
+                    subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name,
+                                    '--port', str(server.port), '--workdir', workdir, '--result', result_path],
+                                   env=env, stdout=subprocess.DEVNULL, timeout=TIMEOUT_S * 2, check=True)
+                    with open(result_path, 'r') as f:
+                        result = json.load(f)
+                    result['fixture_requests_served'] = server.hits - hits
+                except (subprocess.SubprocessError, OSError, ValueError) as e:
+                    result = {'error': str(e)}
+                results['scenarios'][name] = result
+                print(f'{name}: {json.dumps(result)}', file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
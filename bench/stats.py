@@ -0,0 +1,67 @@
+"""Small helpers shared by the benchmark scripts."""
+import os
+import platform
+import subprocess
+
+
+def percentile(sorted_samples, p):
+    if not sorted_samples:
+        return None
+    k = min(len(sorted_samples) - 1, max(0, round(p / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[k]
+
+
+def summarize(samples, scale=1000.0, digits=3):
+    """count/mean/p50/p99/max of samples in seconds, reported in ms by default."""
+    samples = sorted(samples)
+    if not samples:
+        return {'count': 0}
+
+    def scaled(value):
+        return round(value * scale, digits)
+    return {
+        'count': len(samples),
+        'mean': scaled(sum(samples) / len(samples)),
+        'p50': scaled(percentile(samples, 50)),
+        'p99': scaled(percentile(samples, 99)),
+        'max': scaled(samples[-1]),
+    }
+
+
+def process_tree_rss(pid):
+    """RSS in bytes of a process and all of its descendants, from /proc."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f'/proc/{current}/status', 'r') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+        stack.extend(children.get(current, ()))
+    return total
+
+
+def environment():
+    """Where and on what a result was produced, so runs can be compared."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'machine': platform.machine(),
+            'system': platform.system()}
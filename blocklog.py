@@ -0,0 +1,176 @@
+import json
+import os
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from adblock import url_host
+
+BLOCK_LOG = 'blocklog.jsonl'
+MAX_LOG_BYTES = 5 * 2**20
+LOG_BACKUPS = 3
+
+# Rough transfer size of a blocked request by resource type, for the bytes-saved estimate
+ESTIMATED_BYTES = {
+    'script': 25000, 'image': 12000, 'stylesheet': 10000, 'subdocument': 40000, 'font': 30000,
+    'media': 200000, 'object': 50000, 'xmlhttprequest': 3000, 'ping': 500, 'websocket': 1000,
+}
+DEFAULT_ESTIMATE = 5000
+
+
+class BlockLog:
+    """Blocked-request counters and a rotating JSONL log, kept off the request path.
+
+    record() runs on Qt's IO thread for every blocked request and only
+    puts it on a queue. A background thread folds the queued requests into
+    per-page and per-domain counters every flush_interval seconds and
+    appends them to path, one JSON object per line. When the file grows
+    past max_bytes it is rotated to path.1 ... path.<backups>. The counter
+    getters fold the queue too but never touch the file, so the GUI thread
+    can call them.
+
+    Pages are opaque keys, one per tab navigation: counters exist only for
+    keys between open_page() and forget_page(), so a tab starts from zero
+    on every navigation. Interceptors only know a request's first-party
+    URL, so a blocked request is counted for the most recently opened page
+    on that host (or a subdomain of it, as Qt may report only the site).
+    The log on disk names the blocked request only, never the page it was
+    blocked on.
+    """
+
+    def __init__(self, path=BLOCK_LOG, flush_interval=1.0, max_bytes=MAX_LOG_BYTES, backups=LOG_BACKUPS):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.pending = queue.SimpleQueue()
+        self.lock = threading.Lock()  # counters and unwritten
+        self.write_lock = threading.Lock()  # the file; taken before lock when both are needed
+        self.unwritten = []  # log lines folded but not yet written
+        self.by_page = {}  # page key -> [blocked requests, estimated bytes]
+        self.page_hosts = OrderedDict()  # page key -> host, most recently opened last
+        self.by_domain = Counter()
+        self.blocked = 0
+        self.bytes_saved = 0
+        self.file = None
+
+        self.stopped = threading.Event()
+        self.writer = threading.Thread(target=self._run, name='blocklog-writer', daemon=True)
+        self.writer.start()
+
+    def record(self, url, resource_type=None, first_party_url=None):
+        self.pending.put((time.time(), url, resource_type, first_party_url))
+
+    def open_page(self, page, host):
+        """Start counting for page, which shows host; for an open page, just update its host."""
+        with self.lock:
+            self.by_page.setdefault(page, [0, 0])
+            self.page_hosts[page] = host
+            self.page_hosts.move_to_end(page)
+
+    def forget_page(self, page):
+        """Stop counting for page; requests it still had pending are only counted in the totals."""
+        with self.lock:
+            self.by_page.pop(page, None)
+            self.page_hosts.pop(page, None)
+
+    def _page_for(self, first_party_host):
+        if not first_party_host:
+            return None
+        for page, host in reversed(self.page_hosts.items()):
+            if host == first_party_host or host.endswith('.' + first_party_host):
+                return page
+        return None
+
+    def _fold(self):
+        """Count the queued requests and keep their log lines for the next write."""
+        with self.lock:
+            batch = []
+            while True:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            lines = self.unwritten
+            pages = {}  # first-party URL -> page key, for this batch
+            for when, url, resource_type, first_party_url in batch:
+                if first_party_url not in pages:
+                    pages[first_party_url] = self._page_for(url_host(first_party_url) if first_party_url else '')
+                page = pages[first_party_url]
+                host = url_host(url)
+                size = ESTIMATED_BYTES.get(resource_type, DEFAULT_ESTIMATE)
+                counts = self.by_page.get(page)
+                if counts is not None:
+                    counts[0] += 1
+                    counts[1] += size
+                self.by_domain[host] += 1
+                self.blocked += 1
+                self.bytes_saved += size
+                lines.append(json.dumps({'time': round(when, 3), 'url': url, 'host': host,
+                                         'type': resource_type}) + '\n')
+
+    def flush(self):
+        self._fold()
+        with self.write_lock:
+            with self.lock:
+                lines, self.unwritten = self.unwritten, []
+            if lines and self.path:
+                self._write(''.join(lines))
+
+    def _write(self, text):
+        if self.file is None:
+            self.file = open(self.path, 'a', encoding='utf-8')
+        self.file.write(text)
+        self.file.flush()
+        if self.file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self.file.close()
+        self.file = None
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{n}'):
+                os.replace(f'{self.path}.{n}', f'{self.path}.{n + 1}')
+        if self.backups:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+
+    def page_stats(self, page):
+        """(blocked requests, estimated bytes saved) since page was opened."""
+        self._fold()
+        with self.lock:
+            return tuple(self.by_page.get(page, (0, 0)))
+
+    def top_domains(self, n=10):
+        self._fold()
+        with self.lock:
+            return self.by_domain.most_common(n)
+
+    def clear(self):
+        """Delete the log file and its backups, e.g. along with the browsing history; counters are kept."""
+        self.flush()
+        with self.write_lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            if self.path:
+                for path in [self.path] + [f'{self.path}.{n}' for n in range(1, self.backups + 1)]:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+
+    def _run(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self.stopped.set()
+        self.writer.join()
+        self.flush()
+        with self.write_lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
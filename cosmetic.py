@@ -0,0 +1,193 @@
+"""Element hiding (cosmetic) rules from Adblock Plus style filter lists.
+
+Supported:
+
+    ##.ad-banner                   hide everywhere
+    example.com,example.org##.ad   hide on these domains and their subdomains
+    ~example.com##.ad              hide everywhere except example.com
+    example.com#@#.ad              don't hide .ad on example.com
+
+Extended syntax (#?#, #$#) is skipped. Each list is compiled once into a
+JSON cache next to its network index and rebuilt when the list changes.
+"""
+import json
+import os
+
+from filterlist import file_digest, host_suffixes
+
+COSMETIC_VERSION = 1
+HIDE_CSS = " { display: none !important; }"
+
+
+def parse_cosmetic(line):
+    """Parse one line into (domains, selector, is_exception), or None if it is not a hiding rule.
+
+    domains is a list of (domain, negated) pairs; empty means every site.
+    """
+    line = line.strip()
+    if not line or line.startswith("!"):
+        return None
+    for separator, exception in (("#@#", True), ("##", False)):
+        i = line.find(separator)
+        if i != -1:
+            break
+    else:
+        return None
+    selector = line[i + len(separator):].strip()
+    if not selector or "#?#" in line or "#$#" in line or selector.startswith("+js("):
+        return None
+    domains = []
+    for domain in line[:i].lower().split(","):
+        domain = domain.strip()
+        if domain:
+            domains.append((domain.lstrip("~"), domain.startswith("~")))
+    return domains, selector, exception
+
+
+class CosmeticIndex:
+    """Hiding selectors indexed by domain.
+
+    generic selectors apply everywhere, hide[domain] only on that domain
+    and its subdomains, and unhide[domain] switches selectors off there.
+    stylesheet(host) walks the host's suffixes, so a host that appears
+    in neither table costs a few dictionary misses.
+    """
+
+    def __init__(self, generic=(), hide=None, unhide=None):
+        self.generic = set(generic)
+        self.hide = {domain: set(selectors) for domain, selectors in (hide or {}).items()}
+        self.unhide = {domain: set(selectors) for domain, selectors in (unhide or {}).items()}
+        self._generic_css = None
+
+    def add(self, domains, selector, exception):
+        self._generic_css = None
+        if exception:
+            for domain, negated in domains or [("", False)]:
+                if domain and not negated:
+                    self.unhide.setdefault(domain, set()).add(selector)
+            return
+        included = [domain for domain, negated in domains if not negated]
+        for domain, negated in domains:
+            if negated:
+                self.unhide.setdefault(domain, set()).add(selector)
+        if included:
+            for domain in included:
+                self.hide.setdefault(domain, set()).add(selector)
+        else:
+            self.generic.add(selector)
+
+    def update(self, other):
+        self._generic_css = None
+        self.generic |= other.generic
+        for table, other_table in ((self.hide, other.hide), (self.unhide, other.unhide)):
+            for domain, selectors in other_table.items():
+                table.setdefault(domain, set()).update(selectors)
+
+    def selectors(self, host, generic=True):
+        """Selectors to hide on host; generic ones are included only if generic is True."""
+        hide = set()
+        unhide = set()
+        for suffix in host_suffixes(host):
+            hide |= self.hide.get(suffix, set())
+            unhide |= self.unhide.get(suffix, set())
+        if generic:
+            hide |= self.generic
+        return hide - unhide
+
+    def stylesheet(self, host, generic=True):
+        return css(self.selectors(host, generic))
+
+    def has_rules(self, host):
+        """Whether any domain rule or exception applies on host, i.e. its stylesheet isn't just the generic one."""
+        return any(suffix in self.hide or suffix in self.unhide for suffix in host_suffixes(host))
+
+    def generic_stylesheet(self):
+        """The stylesheet of every host without domain rules, built once per index."""
+        if self._generic_css is None:
+            self._generic_css = css(self.generic)
+        return self._generic_css
+
+    def to_json(self):
+        return {
+            "generic": sorted(self.generic),
+            "hide": {domain: sorted(s) for domain, s in self.hide.items()},
+            "unhide": {domain: sorted(s) for domain, s in self.unhide.items()},
+        }
+
+    def __len__(self):
+        return len(self.generic) + sum(map(len, self.hide.values()))
+
+
+def css(selectors):
+    # One rule per selector, so a selector the engine doesn't understand only drops itself
+    return "\n".join(selector + HIDE_CSS for selector in sorted(selectors))
+
+
+def compile_cosmetic(source_path):
+    index = CosmeticIndex()
+    with open(source_path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            rule = parse_cosmetic(line)
+            if rule is not None:
+                index.add(*rule)
+    return index
+
+
+def cosmetic_path_for(source_path, cache_dir):
+    return os.path.join(cache_dir, os.path.basename(source_path) + ".cosmetic.json")
+
+
+def load_cosmetic(source_path, cache_dir, write_cache=True):
+    """The CosmeticIndex for source_path, from the cache unless the list changed.
+
+    With write_cache=False a missing or outdated cache gives None.
+    """
+    cache_path = cosmetic_path_for(source_path, cache_dir)
+    digest = file_digest(source_path).hex()
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("version") == COSMETIC_VERSION and cached.get("sha256") == digest:
+            return CosmeticIndex(cached["generic"], cached["hide"], cached["unhide"])
+    except (OSError, ValueError, KeyError):
+        pass
+    if not write_cache:
+        return None
+    index = compile_cosmetic(source_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(dict(index.to_json(), version=COSMETIC_VERSION, sha256=digest), f)
+    os.replace(tmp_path, cache_path)
+    return index
+
+
+def page_script(index, host):
+    """Source that adopts the stylesheet for a page on host at document creation, or None if nothing is hidden.
+
+    Subframes run it too; a frame on another host gets only the generic
+    selectors.
+    """
+    generic = index.generic_stylesheet()
+    text = index.stylesheet(host) if index.has_rules(host) else generic
+    if not text and not generic:
+        return None
+    return """
+(function (host, css, generic) {
+    var text = location.hostname === host && css !== null ? css : generic;
+    if (!text) {
+        return;
+    }
+    try {
+        var sheet = new CSSStyleSheet();
+        sheet.replaceSync(text);
+        document.adoptedStyleSheets = document.adoptedStyleSheets.concat([sheet]);
+    } catch (e) {
+        document.addEventListener('DOMContentLoaded', function () {
+            var style = document.createElement('style');
+            style.textContent = text;
+            document.head.appendChild(style);
+        });
+    }
+})(%s, %s, %s);
+""" % (json.dumps(host), "null" if text is generic else json.dumps(text), json.dumps(generic))
@@ -0,0 +1,288 @@
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit
+
+from routing import url_opener
+
+log = logging.getLogger('downloads')
+
+CHUNK_SIZE = 64 * 1024
+MIN_SEGMENT = 1 << 20  # don't split below 1 MB per connection
+SAVE_INTERVAL_S = 1.0  # how often the segment map is written while downloading
+TIMEOUT_S = 30
+
+
+def download_path(directory, filename, url):
+    """A free path for filename in directory, or the one an interrupted download of url left behind."""
+    base, ext = os.path.splitext(filename or 'download')
+    n = 0
+    while True:
+        path = os.path.join(directory, f'{base} ({n}){ext}' if n else base + ext)
+        try:
+            with open(path + '.part.json', encoding='utf-8') as f:
+                if json.load(f).get('url') == url:
+                    return path
+        except (OSError, ValueError):
+            pass
+        if not os.path.exists(path) and not os.path.exists(path + '.part'):
+            return path
+        n += 1
+
+
+class TokenBucket:
+    """Shared bandwidth limit; consume() blocks until n bytes may be transferred.
+
+    rate is in bytes per second, 0 for unlimited. The bucket holds at most
+    one second's worth, so idle time can't be saved up into a burst; larger
+    requests are taken out in pieces of at most that size.
+    """
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n, cancelled=None):
+        """Wait until n bytes may be transferred, or until the cancelled Event is set."""
+        if not self.rate:
+            return
+        while n > 0:
+            piece = min(n, self.rate)
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= piece:
+                    self.tokens -= piece
+                    n -= piece
+                    continue
+                wait = min((piece - self.tokens) / self.rate, 0.25)
+            if cancelled is None:
+                time.sleep(wait)
+            elif cancelled.wait(wait):
+                return
+
+
+class CookieJar:
+    """Cookies mirrored from the browser profile, so downloads it takes over stay logged in."""
+
+    def __init__(self):
+        self.cookies = {}  # (domain, path, name) -> (value, secure)
+        self.lock = threading.Lock()
+
+    def set(self, domain, path, name, value, secure=False):
+        with self.lock:
+            self.cookies[(domain.lstrip('.').lower(), path or '/', name)] = (value, secure)
+
+    def remove(self, domain, path, name):
+        with self.lock:
+            self.cookies.pop((domain.lstrip('.').lower(), path or '/', name), None)
+
+    def header(self, url):
+        parts = urlsplit(url)
+        host = (parts.hostname or '').lower()
+        path = parts.path or '/'
+        cookie = SimpleCookie()
+        with self.lock:
+            for (domain, cookie_path, name), (value, secure) in self.cookies.items():
+                if ((host == domain or host.endswith('.' + domain)) and path.startswith(cookie_path)
+                        and (parts.scheme == 'https' or not secure)):
+                    cookie[name] = value
+        return '; '.join(f'{morsel.key}={morsel.coded_value}' for morsel in cookie.values())
+
+
+class Download:
+    """One file fetched as several HTTP Range segments into a preallocated .part file.
+
+    The segment map ([start, end, done] per segment) is saved next to the
+    .part file while the download runs. If the process dies, a later
+    download of the same URL to the same path resumes from it, as long as
+    the server still reports the same size and validator.
+    """
+
+    def __init__(self, url, path, headers=None, opener=None):
+        self.url = url
+        self.opener = opener or url_opener()
+        self.path = path
+        self.part_path = path + '.part'
+        self.map_path = path + '.part.json'
+        self.headers = dict(headers or {})
+        self.size = None
+        self.validator = None
+        self.segments = []
+        self.state = 'queued'  # queued, running, paused, finished, failed
+        self.error = None
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+
+    @property
+    def received(self):
+        return sum(done for _, _, done in self.segments)
+
+    def request(self, headers=None):
+        return urllib.request.Request(self.url, headers=dict(self.headers, **(headers or {})))
+
+    def probe(self):
+        """Learn size, Range support and validator with a one-byte range request."""
+        with self.opener.open(self.request({'Range': 'bytes=0-0'}), timeout=TIMEOUT_S) as response:
+            response.read()
+            self.validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+            content_range = response.headers.get('Content-Range', '')
+            if response.status == 206 and '/' in content_range and not content_range.endswith('/*'):
+                self.size = int(content_range.rsplit('/', 1)[1])
+                return True
+            length = response.headers.get('Content-Length')
+            self.size = int(length) if length else None
+            return False
+
+    def plan(self, segments, ranged):
+        """Load a matching saved segment map, or split the file into new segments."""
+        try:
+            with open(self.map_path, encoding='utf-8') as f:
+                saved = json.load(f)
+            if (ranged and saved['url'] == self.url and saved['size'] == self.size
+                    and saved['validator'] == self.validator and os.path.getsize(self.part_path) == self.size):
+                self.segments = [list(segment) for segment in saved['segments']]
+                log.info('resuming %s at %d of %d bytes', self.path, self.received, self.size)
+                return
+        except (OSError, ValueError, KeyError):
+            pass
+        if not ranged or not self.size:
+            self.segments = [[0, (self.size or 0) - 1, 0]]
+            open(self.part_path, 'wb').close()
+            return
+        count = max(1, min(segments, self.size // MIN_SEGMENT))
+        step = -(-self.size // count)
+        self.segments = [[start, min(start + step, self.size) - 1, 0] for start in range(0, self.size, step)]
+        with open(self.part_path, 'wb') as f:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(f.fileno(), 0, self.size)
+            else:
+                f.truncate(self.size)
+
+    def save_map(self):
+        with self.lock:
+            data = {'url': self.url, 'size': self.size, 'validator': self.validator, 'segments': self.segments}
+        tmp_path = self.map_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.map_path)
+
+    def fetch_segment(self, segment, bucket):
+        start, end, done = segment
+        if self.size and start + done > end:
+            return
+        ranged = bool(self.size) and (len(self.segments) > 1 or done > 0)
+        headers = {'Range': f'bytes={start + done}-{end}'} if ranged else {}
+        with self.opener.open(self.request(headers), timeout=TIMEOUT_S) as response, \
+                open(self.part_path, 'r+b') as out:
+            if ranged and response.status != 206:
+                raise IOError(f'server ignored Range for {self.url}')
+            out.seek(start + done)
+            while not self.cancelled.is_set():
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                bucket.consume(len(chunk), self.cancelled)
+                out.write(chunk)
+                with self.lock:
+                    segment[2] += len(chunk)
+
+    def cancel(self):
+        """Stop after the current chunks; the segment map is kept so the download can resume."""
+        self.cancelled.set()
+
+
+class DownloadManager:
+    """Queue of Downloads with global limits on concurrency and bandwidth.
+
+    At most max_active downloads run at once, each with up to
+    max_segments connections. All of them draw from one TokenBucket, so
+    with a bandwidth limit set, downloads leave room for page loads.
+    With proxy_url, the local CachingProxy, downloads take the same
+    per-site routes as the pages they came from. on_progress and
+    on_finished are called from worker threads.
+    """
+
+    def __init__(self, max_active=3, max_segments=4, bandwidth=0, on_progress=None, on_finished=None,
+                 proxy_url=None):
+        self.max_segments = max_segments
+        self.opener = url_opener(proxy_url)
+        self.bucket = TokenBucket(bandwidth)
+        self.on_progress = on_progress
+        self.on_finished = on_finished
+        self.downloads = []
+        self.executor = ThreadPoolExecutor(max_workers=max_active, thread_name_prefix='download')
+
+    def add(self, url, path, headers=None):
+        download = Download(url, path, headers, self.opener)
+        self.downloads.append(download)
+        self.executor.submit(self.run, download)
+        return download
+
+    def resume_interrupted(self, directory, headers=None):
+        """Queue every download whose segment map was left in directory by an earlier run."""
+        for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else ():
+            if name.endswith('.part.json'):
+                try:
+                    with open(os.path.join(directory, name), encoding='utf-8') as f:
+                        url = json.load(f)['url']
+                except (OSError, ValueError, KeyError):
+                    continue
+                self.add(url, os.path.join(directory, name[:-len('.part.json')]), headers)
+
+    def resume(self, download):
+        """Queue a paused or failed download again; it continues from its segment map."""
+        download.cancelled.clear()
+        download.state = 'queued'
+        self.executor.submit(self.run, download)
+
+    def run(self, download):
+        if download.cancelled.is_set():
+            download.state = 'paused'
+            return
+        download.state = 'running'
+        try:
+            ranged = download.probe()
+            download.plan(self.max_segments, ranged)
+            download.save_map()
+            with ThreadPoolExecutor(max_workers=len(download.segments)) as segments:
+                futures = [segments.submit(download.fetch_segment, segment, self.bucket)
+                           for segment in download.segments]
+                while not all(future.done() for future in futures):
+                    time.sleep(SAVE_INTERVAL_S)
+                    download.save_map()
+                    if self.on_progress is not None:
+                        self.on_progress(download)
+                for future in futures:
+                    future.result()
+            download.save_map()
+            if download.cancelled.is_set():
+                download.state = 'paused'
+                return
+            if download.size and download.received < download.size:
+                raise IOError(f'connection closed at {download.received} of {download.size} bytes')
+            os.replace(download.part_path, download.path)
+            os.remove(download.map_path)
+            download.state = 'finished'
+            log.info('downloaded %s (%d bytes, %d segments)', download.path, download.received, len(download.segments))
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            download.state = 'failed'
+            download.error = str(e)
+            log.warning('download of %s failed: %s', download.url, e)
+        finally:
+            if self.on_finished is not None:
+                self.on_finished(download)
+
+    def close(self):
+        for download in self.downloads:
+            download.cancel()
+        self.executor.shutdown(wait=True)
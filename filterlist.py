@@ -0,0 +1,511 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+from bisect import bisect_left
+
+# Resource types understood in filter options, as bits of a rule's type mask
+RESOURCE_TYPES = {
+    "other": 1 << 0,
+    "script": 1 << 1,
+    "image": 1 << 2,
+    "stylesheet": 1 << 3,
+    "object": 1 << 4,
+    "xmlhttprequest": 1 << 5,
+    "subdocument": 1 << 6,
+    "ping": 1 << 7,
+    "media": 1 << 8,
+    "font": 1 << 9,
+    "websocket": 1 << 10,
+    "document": 1 << 11,
+}
+ALL_TYPES = sum(RESOURCE_TYPES.values())
+# Rules without a type option apply to everything but top-level documents
+DEFAULT_TYPES = ALL_TYPES & ~RESOURCE_TYPES["document"]
+TYPE_ALIASES = {"xhr": "xmlhttprequest", "css": "stylesheet", "frame": "subdocument", "doc": "document"}
+
+EXCEPTION = 1 << 0
+THIRD_PARTY = 1 << 1
+FIRST_PARTY = 1 << 2
+MATCH_CASE = 1 << 3
+REGEX = 1 << 4
+DOMAIN_ANCHOR = 1 << 5
+
+MAGIC = b"ABPIDX01"
+INDEX_VERSION = 3
+# magic, version, source sha256, rules, domain keys, token keys, strings, domain/token bloom bytes, reserved
+HEADER = struct.Struct("<8sI32sIIIIIII")
+RECORD = struct.Struct("<8I")  # flags, types, key, pattern and domain option as (offset, length) pairs
+
+# Each list is compiled into SHARDS index files, split by rule key hash, so an
+# update only recompiles the shards whose rules changed
+SHARDS = 16
+
+TOKEN_RE = re.compile(r"[a-z0-9%]+")
+OPTIONS_RE = re.compile(r"\$([^$/]+)$")
+
+
+def key_hash(key):
+    """Stable 64-bit hash used for both domain and token keys."""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.digest()
+
+
+class Rule:
+    """One network filter from an Adblock Plus style list."""
+
+    __slots__ = ("flags", "types", "key", "pattern", "domains", "_regex", "_domain_sets")
+
+    def __init__(self, flags, types, key, pattern, domains=""):
+        self.flags = flags
+        self.types = types
+        self.key = key  # host for ||domain rules, best token (or '') otherwise
+        self.pattern = pattern  # the part after the host for ||domain rules
+        self.domains = domains  # raw $domain= option
+        self._regex = None
+        self._domain_sets = None
+
+    @property
+    def is_exception(self):
+        return bool(self.flags & EXCEPTION)
+
+    @property
+    def is_host_level(self):
+        """True for ||host^ style rules whose outcome depends only on the host, type and party."""
+        return bool(self.flags & DOMAIN_ANCHOR) and self.pattern in ("", "^") and not self.domains
+
+    def regex(self):
+        if self._regex is None:
+            if self.flags & REGEX:
+                source = self.pattern
+            else:
+                source = pattern_to_regex(self.pattern, self.flags & DOMAIN_ANCHOR)
+            self._regex = re.compile(source, 0 if self.flags & MATCH_CASE else re.IGNORECASE)
+        return self._regex
+
+    def applies_to(self, types, third_party, page_host):
+        if not self.types & types:
+            return False
+        if third_party is not None:
+            if self.flags & THIRD_PARTY and not third_party:
+                return False
+            if self.flags & FIRST_PARTY and third_party:
+                return False
+        if self.domains:
+            if self._domain_sets is None:
+                include = {d for d in self.domains.split("|") if d and not d.startswith("~")}
+                exclude = {d[1:] for d in self.domains.split("|") if d.startswith("~")}
+                self._domain_sets = (include, exclude)
+            include, exclude = self._domain_sets
+            suffixes = tuple(host_suffixes(page_host)) if page_host else ()
+            if any(s in exclude for s in suffixes):
+                return False
+            if include and not any(s in include for s in suffixes):
+                return False
+        return True
+
+    def matches(self, url, rest):
+        """Match against the whole URL, or the part after the host for ||domain rules."""
+        if self.flags & DOMAIN_ANCHOR:
+            return not self.pattern or self.regex().match(rest) is not None
+        return self.regex().search(url) is not None
+
+
+def host_suffixes(host):
+    """Yield host and each parent domain, most specific first."""
+    yield host
+    dot = host.find(".")
+    while dot != -1:
+        yield host[dot + 1:]
+        dot = host.find(".", dot + 1)
+
+
+def pattern_to_regex(pattern, anchored_rest=False):
+    start = ""
+    end = ""
+    if pattern.startswith("|") and not anchored_rest:
+        start = "^"
+        pattern = pattern[1:]
+    if pattern.endswith("|"):
+        end = "$"
+        pattern = pattern[:-1]
+    body = re.escape(pattern).replace(r"\*", ".*").replace(r"\^", r"(?:[^\w.%-]|$)")
+    return start + body + end
+
+
+def safe_token(pattern, left_anchored, right_anchored):
+    """Pick the longest token that must appear whole in every matching URL."""
+    best = ""
+    lowered = pattern.lower()
+    for m in TOKEN_RE.finditer(lowered):
+        before = lowered[m.start() - 1] if m.start() else None
+        after = lowered[m.end()] if m.end() < len(lowered) else None
+        if before == "*" or after == "*":
+            continue
+        if before is None and not left_anchored:
+            continue
+        if after is None and not right_anchored:
+            continue
+        if len(m.group()) > len(best):
+            best = m.group()
+    return best
+
+
+def parse_filter(line):
+    """Parse one filter list line into a Rule, or None if it is not a supported network filter."""
+    line = line.strip()
+    if not line or line.startswith(("!", "[")):
+        return None
+    if "##" in line or "#@#" in line or "#?#" in line or "#$#" in line:
+        return None  # element hiding rule
+
+    flags = 0
+    if line.startswith("@@"):
+        flags |= EXCEPTION
+        line = line[2:]
+
+    types = 0
+    negated_types = 0
+    domains = ""
+    m = OPTIONS_RE.search(line)
+    if m and not (line.startswith("/") and line.endswith("/")):
+        line = line[:m.start()]
+        for option in m.group(1).split(","):
+            option = option.strip().lower()
+            negated = option.startswith("~")
+            name = option.lstrip("~")
+            name = TYPE_ALIASES.get(name, name)
+            if name in ("third-party", "3p"):
+                flags |= FIRST_PARTY if negated else THIRD_PARTY
+            elif name in ("first-party", "1p"):
+                flags |= THIRD_PARTY if negated else FIRST_PARTY
+            elif name == "match-case":
+                flags |= MATCH_CASE
+            elif name.startswith("domain="):
+                domains = option[len("domain="):]
+            elif name == "all" and not negated:
+                types |= ALL_TYPES
+            elif name in RESOURCE_TYPES:
+                if negated:
+                    negated_types |= RESOURCE_TYPES[name]
+                else:
+                    types |= RESOURCE_TYPES[name]
+            else:
+                return None  # popup, csp, redirect, ... are not network blocking rules we can honour
+    if not types:
+        types = DEFAULT_TYPES & ~negated_types if negated_types else DEFAULT_TYPES
+
+    if len(line) > 1 and line.startswith("/") and line.endswith("/"):
+        return Rule(flags | REGEX, types, "", line[1:-1], domains)
+
+    if line.startswith("||"):
+        body = line[2:]
+        end = len(body)
+        for i, ch in enumerate(body):
+            if ch in "/^*?|:":
+                end = i
+                break
+        host = body[:end].lower().strip(".")
+        if host and "*" not in host:
+            return Rule(flags | DOMAIN_ANCHOR, types, host, body[end:], domains)
+        line = body  # wildcard host, fall back to a generic pattern
+    if not line.strip("*"):
+        if not domains:
+            return None  # would match every request
+        line = "*"
+
+    left = line.startswith("|")
+    right = line.endswith("|") and len(line) > 1
+    key = safe_token(line.strip("|"), left, right)
+    return Rule(flags, types, key, line, domains)
+
+
+class BloomFilter:
+    """Bit array probed at K positions derived from a key's 64-bit hash."""
+
+    K = 7
+    BITS_PER_KEY = 10
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.size = len(bits) * 8
+
+    @classmethod
+    def build(cls, hashes):
+        bits = bytearray(max(8, (len(hashes) * cls.BITS_PER_KEY + 7) // 8))
+        bloom = cls(bits)
+        for h in hashes:
+            for pos in bloom._positions(h):
+                bits[pos >> 3] |= 1 << (pos & 7)
+        return bloom
+
+    def _positions(self, h):
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        return ((h1 + i * h2) % self.size for i in range(self.K))
+
+    def __contains__(self, h):
+        bits = self.bits
+        for pos in self._positions(h):
+            if not bits[pos >> 3] >> (pos & 7) & 1:
+                return False
+        return True
+
+
+def parse_filters(lines):
+    for line in lines:
+        rule = parse_filter(line)
+        if rule is not None:
+            yield rule
+
+
+def write_index(rules, digest, index_path):
+    """Write rules as a binary index; digest identifies what they were compiled from."""
+    strings = bytearray()
+    offsets = {}
+
+    def intern(text):
+        if text not in offsets:
+            data = text.encode()
+            offsets[text] = (len(strings), len(data))
+            strings.extend(data)
+        return offsets[text]
+
+    records = bytearray()
+    domain_keys = []
+    token_keys = []
+    for i, rule in enumerate(rules):
+        key = intern(rule.key)
+        pattern = intern(rule.pattern)
+        domains = intern(rule.domains)
+        records += RECORD.pack(rule.flags, rule.types, *key, *pattern, *domains)
+        if rule.flags & DOMAIN_ANCHOR:
+            domain_keys.append((key_hash(rule.key), i))
+        else:
+            token_keys.append((key_hash(rule.key) if rule.key else 0, i))
+    domain_keys.sort()
+    token_keys.sort()
+    domain_bloom = BloomFilter.build({h for h, _ in domain_keys}).bits
+    token_bloom = BloomFilter.build({h for h, _ in token_keys if h}).bits
+
+    tmp_path = index_path + ".tmp"
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    with open(tmp_path, "wb") as out:
+        out.write(HEADER.pack(MAGIC, INDEX_VERSION, digest, len(rules), len(domain_keys), len(token_keys), len(strings),
+                              len(domain_bloom), len(token_bloom), 0))
+        for table in (domain_keys, token_keys):
+            out.write(struct.pack(f"<{len(table)}Q", *(h for h, _ in table)))
+            out.write(struct.pack(f"<{len(table)}I", *(i for _, i in table)))
+            if len(table) % 2:
+                out.write(b"\0" * 4)  # keep the next hash array 8-byte aligned
+        out.write(records)
+        out.write(strings)
+        out.write(domain_bloom)
+        out.write(token_bloom)
+    os.replace(tmp_path, index_path)
+
+
+class CompiledIndex:
+    """Read-only view of a compiled filter list backed by mmap.
+
+    Nothing is decoded up front: lookups binary-search the sorted key hashes
+    in the mapped file and decode only the rules that are candidates.
+    """
+
+    def __init__(self, index_path):
+        self.path = index_path
+        with open(index_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.digest, n_rules, n_domain, n_token, n_strings,
+         n_domain_bloom, n_token_bloom, _) = HEADER.unpack_from(self._mm)
+        if magic != MAGIC or version != INDEX_VERSION:
+            self._mm.close()
+            raise ValueError(f"{index_path} is not a version {INDEX_VERSION} filter index")
+        view = self._view = memoryview(self._mm)
+        offset = HEADER.size
+        tables = []
+        for count in (n_domain, n_token):
+            hashes = view[offset:offset + 8 * count].cast("Q")
+            offset += 8 * count
+            ids = view[offset:offset + 4 * count].cast("I")
+            offset += 4 * count + (4 if count % 2 else 0)
+            tables.append((hashes, ids))
+        (self._domain_hashes, self._domain_ids), (self._token_hashes, self._token_ids) = tables
+        self._records = offset
+        self._strings = offset + RECORD.size * n_rules
+        offset = self._strings + n_strings
+        self.domain_bloom = BloomFilter(view[offset:offset + n_domain_bloom])
+        offset += n_domain_bloom
+        self.token_bloom = BloomFilter(view[offset:offset + n_token_bloom])
+        self.rule_count = n_rules
+        self._rules = {}
+
+    def _rule(self, i):
+        rule = self._rules.get(i)
+        if rule is None:
+            flags, types, k_off, k_len, p_off, p_len, d_off, d_len = RECORD.unpack_from(self._mm, self._records + RECORD.size * i)
+            base = self._strings
+            rule = Rule(
+                flags, types,
+                self._mm[base + k_off:base + k_off + k_len].decode(),
+                self._mm[base + p_off:base + p_off + p_len].decode(),
+                self._mm[base + d_off:base + d_off + d_len].decode(),
+            )
+            self._rules[i] = rule
+        return rule
+
+    def _lookup(self, hashes, ids, h):
+        i = bisect_left(hashes, h)
+        while i < len(hashes) and hashes[i] == h:
+            yield self._rule(ids[i])
+            i += 1
+
+    def domain_rules(self, host, h):
+        """Rules anchored to host exactly (callers walk the suffixes); h is key_hash(host)."""
+        for rule in self._lookup(self._domain_hashes, self._domain_ids, h):
+            if rule.key == host:
+                yield rule
+
+    def token_rules(self, h):
+        return self._lookup(self._token_hashes, self._token_ids, h)
+
+    def untokenized_rules(self):
+        return self._lookup(self._token_hashes, self._token_ids, 0)
+
+    @property
+    def has_token_rules(self):
+        """Whether any rule has to be matched against URLs rather than looked up by host."""
+        return len(self._token_hashes) > 0
+
+    def close(self):
+        for name in ("_domain_hashes", "_domain_ids", "_token_hashes", "_token_ids"):
+            getattr(self, name).release()
+        self.domain_bloom.bits.release()
+        self.token_bloom.bits.release()
+        self._view.release()
+        self._mm.close()
+
+
+class ShardedBloom:
+    """The Bloom filters of all shards, each consulted only for its own hashes."""
+
+    def __init__(self, blooms):
+        self.blooms = blooms
+
+    def __contains__(self, h):
+        return h in self.blooms[h % len(self.blooms)]
+
+
+class ShardedIndex:
+    """A filter list compiled into several CompiledIndex shards.
+
+    A rule lives in the shard picked by its key hash, and lookups go
+    through the same hash, so each lookup still searches one index.
+    Rules without a key all land in shard 0.
+    """
+
+    def __init__(self, paths):
+        self.shards = []
+        try:
+            for path in paths:
+                self.shards.append(CompiledIndex(path))
+        except Exception:
+            self.close()
+            raise
+        self.domain_bloom = ShardedBloom([shard.domain_bloom for shard in self.shards])
+        self.token_bloom = ShardedBloom([shard.token_bloom for shard in self.shards])
+        self.rule_count = sum(shard.rule_count for shard in self.shards)
+
+    def domain_rules(self, host, h):
+        return self.shards[h % len(self.shards)].domain_rules(host, h)
+
+    def token_rules(self, h):
+        return self.shards[h % len(self.shards)].token_rules(h)
+
+    def untokenized_rules(self):
+        return self.shards[0].untokenized_rules()
+
+    @property
+    def has_token_rules(self):
+        return any(shard.has_token_rules for shard in self.shards)
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+def shard_of(rule):
+    return (key_hash(rule.key) if rule.key else 0) % SHARDS
+
+
+def shard_paths(source_path, cache_dir):
+    base = os.path.join(cache_dir, os.path.basename(source_path))
+    return [f"{base}.{i:02d}.idx" for i in range(SHARDS)]
+
+
+def manifest_path_for(source_path, cache_dir):
+    return os.path.join(cache_dir, os.path.basename(source_path) + ".manifest")
+
+
+def compile_shards(source_path, paths):
+    """Recompile the shards whose rules differ from what is on disk; return how many were rebuilt.
+
+    A shard's digest is the SHA-256 of its sorted rule lines, so reordering
+    a list or changing rules that hash to other shards leaves it alone.
+    """
+    buckets = [[] for _ in paths]
+    with open(source_path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            rule = parse_filter(line)
+            if rule is not None:
+                buckets[shard_of(rule)].append((line.strip(), rule))
+    rebuilt = 0
+    for path, bucket in zip(paths, buckets):
+        bucket.sort(key=lambda item: item[0])
+        digest = hashlib.sha256("\n".join(line for line, _ in bucket).encode()).digest()
+        try:
+            index = CompiledIndex(path)
+            unchanged = index.digest == digest
+            index.close()
+        except (OSError, ValueError, struct.error):
+            unchanged = False
+        if not unchanged:
+            write_index([rule for _, rule in bucket], digest, path)
+            rebuilt += 1
+    return rebuilt
+
+
+def load_filter_list(source_path, cache_dir, write_cache=True):
+    """Open the sharded index for source_path, recompiling only the shards that changed.
+
+    A manifest records the SHA-256 of the list the shards were built from;
+    while it matches, the shards are mapped without reading the list. With
+    write_cache=False nothing is compiled and None is returned instead.
+    """
+    paths = shard_paths(source_path, cache_dir)
+    manifest_path = manifest_path_for(source_path, cache_dir)
+    digest = file_digest(source_path).hex()
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest == {"sha256": digest, "version": INDEX_VERSION, "shards": SHARDS}:
+            return ShardedIndex(paths)
+    except (OSError, ValueError, struct.error):
+        pass
+    if not write_cache:
+        return None
+    compile_shards(source_path, paths)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"sha256": digest, "version": INDEX_VERSION, "shards": SHARDS}, f)
+    os.replace(tmp_path, manifest_path)
+    return ShardedIndex(paths)
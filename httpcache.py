@@ -0,0 +1,280 @@
+import email.utils
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_DIR = 'proxy_cache'
+MAX_CACHE_BYTES = 256 * 2**20
+MAX_ENTRY_BYTES = 8 * 2**20  # larger responses are passed through without being stored
+HEURISTIC_MAX_S = 24 * 3600  # cap on the freshness guessed from Last-Modified
+STEM_LOCKS = 64  # stores and deletes of one response are serialized on one of these
+CACHEABLE_STATUS = {200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501}
+
+
+def header(headers, name, default=''):
+    """First value of a header in a list of (name, value) pairs, matched case-insensitively."""
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return default
+
+
+def cache_control(headers):
+    """Cache-Control directives as a dict; directives without an argument map to ''."""
+    directives = {}
+    for key, value in headers:
+        if key.lower() == 'cache-control':
+            for part in value.split(','):
+                name, _, argument = part.strip().partition('=')
+                if name:
+                    directives[name.lower()] = argument.strip('"')
+        elif key.lower() == 'pragma' and 'no-cache' in value.lower():
+            directives.setdefault('no-cache', '')
+    return directives
+
+
+def http_date(value):
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def seconds(value):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def storable(method, status, request_headers, response_headers):
+    """Whether a shared cache may keep this response (RFC 9111, section 3)."""
+    if method != 'GET' or status not in CACHEABLE_STATUS:
+        return False
+    request_cc = cache_control(request_headers)
+    response_cc = cache_control(response_headers)
+    if 'no-store' in request_cc or 'no-store' in response_cc or 'private' in response_cc:
+        return False
+    if header(response_headers, 'vary').strip() == '*':
+        return False
+    if header(request_headers, 'authorization') and not {'public', 's-maxage', 'must-revalidate'} & set(response_cc):
+        return False
+    # The cache is shared by every profile, so nothing that sets a cookie is kept
+    if header(response_headers, 'set-cookie'):
+        return False
+    return bool({'max-age', 's-maxage', 'public'} & set(response_cc)
+                or header(response_headers, 'expires') or header(response_headers, 'etag')
+                or header(response_headers, 'last-modified'))
+
+
+class CacheEntry:
+    """Status, headers and Vary selection of one stored response; the body is in a file beside it."""
+
+    __slots__ = ('key', 'status', 'reason', 'headers', 'vary', 'stored')
+
+    def __init__(self, key, status, reason, headers, vary=(), stored=None):
+        self.key = key
+        self.status = status
+        self.reason = reason
+        self.headers = [tuple(h) for h in headers]
+        self.vary = [tuple(v) for v in vary]  # (request header, value it had when stored)
+        self.stored = stored or time.time()
+
+    @classmethod
+    def for_response(cls, key, status, reason, request_headers, response_headers):
+        names = [name.strip() for name in header(response_headers, 'vary').split(',') if name.strip()]
+        return cls(key, status, reason, response_headers, [(name, header(request_headers, name)) for name in names])
+
+    def matches(self, request_headers):
+        return all(header(request_headers, name) == value for name, value in self.vary)
+
+    def freshness_lifetime(self):
+        cc = cache_control(self.headers)
+        for name in ('s-maxage', 'max-age'):
+            if seconds(cc.get(name)) is not None:
+                return seconds(cc[name])
+        date = http_date(header(self.headers, 'date')) or self.stored
+        expires = header(self.headers, 'expires')
+        if expires:
+            expires = http_date(expires)
+            return max(0, expires - date) if expires else 0
+        last_modified = http_date(header(self.headers, 'last-modified'))
+        if last_modified:
+            return min(HEURISTIC_MAX_S, max(0, date - last_modified) / 10)
+        return 0
+
+    def age(self, now=None):
+        date = http_date(header(self.headers, 'date')) or self.stored
+        initial = max(self.stored - date, seconds(header(self.headers, 'age')) or 0, 0)
+        return initial + (now or time.time()) - self.stored
+
+    def is_fresh(self, now=None):
+        if 'no-cache' in cache_control(self.headers):
+            return False
+        return self.age(now) < self.freshness_lifetime()
+
+    def validators(self):
+        """Conditional request headers that revalidate this entry."""
+        conditions = []
+        if header(self.headers, 'etag'):
+            conditions.append(('If-None-Match', header(self.headers, 'etag')))
+        if header(self.headers, 'last-modified'):
+            conditions.append(('If-Modified-Since', header(self.headers, 'last-modified')))
+        return conditions
+
+    def refresh(self, response_headers):
+        """Take the headers of a 304 for this entry (RFC 9111, section 4.3.4)."""
+        updated = {name.lower() for name, _ in response_headers if name.lower() != 'content-length'}
+        self.headers = [h for h in self.headers if h[0].lower() not in updated]
+        self.headers += [h for h in response_headers if h[0].lower() != 'content-length']
+        self.stored = time.time()
+
+    def to_json(self):
+        return {'key': self.key, 'status': self.status, 'reason': self.reason, 'headers': self.headers,
+                'vary': self.vary, 'stored': self.stored}
+
+
+class HttpCache:
+    """Responses kept in directory as <sha256 of URL>.json and .body files.
+
+    Only the file names, their sizes and the access order are held in
+    memory, rebuilt from the directory at load(). Once the total passes
+    max_bytes the least recently used responses are deleted. Each URL has
+    a single entry, so a response with a different Vary selection replaces
+    the stored one. A read_only cache serves what is already on disk and
+    never writes or deletes anything. Methods do file I/O and are meant to
+    be called from worker threads.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, read_only=False):
+        self.dir = directory
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.lru = OrderedDict()  # file stem -> bytes on disk
+        self.total = 0
+        self.lock = threading.Lock()
+        self.stem_locks = [threading.Lock() for _ in range(STEM_LOCKS)]
+
+    def _path(self, stem, suffix):
+        return os.path.join(self.dir, stem + suffix)
+
+    def _stem_lock(self, stem):
+        return self.stem_locks[hash(stem) % len(self.stem_locks)]
+
+    def _write_temp(self, stem, data):
+        """Write data to a new temporary file in the cache directory and return its path."""
+        fd, tmp_path = tempfile.mkstemp(prefix=stem + '.', suffix='.tmp', dir=self.dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path
+
+    def load(self):
+        if not self.read_only:
+            os.makedirs(self.dir, exist_ok=True)
+        elif not os.path.isdir(self.dir):
+            return
+        found = []
+        for entry in os.scandir(self.dir):
+            stem, ext = os.path.splitext(entry.name)
+            if ext == '.json':
+                try:
+                    size = entry.stat().st_size + os.path.getsize(self._path(stem, '.body'))
+                except OSError:
+                    self._delete(stem)
+                    continue
+                found.append((entry.stat().st_mtime, stem, size))
+            elif ext == '.tmp' and not self.read_only:
+                os.remove(entry.path)  # left by an interrupted store
+        with self.lock:
+            self.lru.clear()
+            for _, stem, size in sorted(found):
+                self.lru[stem] = size
+            self.total = sum(self.lru.values())
+        self.evict()
+
+    def lookup(self, key, request_headers):
+        """The stored entry for key that fits these request headers, or None."""
+        stem = hashlib.sha256(key.encode()).hexdigest()
+        with self.lock:
+            if stem not in self.lru:
+                return None
+            self.lru.move_to_end(stem)
+        try:
+            with open(self._path(stem, '.json'), encoding='utf-8') as f:
+                entry = CacheEntry(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            self.remove(key)
+            return None
+        return entry if entry.key == key and entry.matches(request_headers) else None
+
+    def read_body(self, entry):
+        with open(self._path(hashlib.sha256(entry.key.encode()).hexdigest(), '.body'), 'rb') as f:
+            return f.read()
+
+    def store(self, entry, body=None):
+        """Write entry, and its body unless body is None (a refreshed entry keeps its old body)."""
+        if self.read_only:
+            return
+        stem = hashlib.sha256(entry.key.encode()).hexdigest()
+        # Unique temp names, so concurrent stores of one URL never write into each other's files;
+        # the lock keeps the body and headers that get renamed into place from the same response
+        body_path = self._write_temp(stem, body) if body is not None else None
+        json_path = self._write_temp(stem, json.dumps(entry.to_json()).encode('utf-8'))
+        with self._stem_lock(stem):
+            if body_path is not None:
+                os.replace(body_path, self._path(stem, '.body'))
+            os.replace(json_path, self._path(stem, '.json'))
+            try:
+                size = os.path.getsize(self._path(stem, '.json')) + os.path.getsize(self._path(stem, '.body'))
+            except OSError:
+                return
+        with self.lock:
+            self.total += size - self.lru.pop(stem, 0)
+            self.lru[stem] = size
+        self.evict()
+
+    def remove(self, key):
+        stem = hashlib.sha256(key.encode()).hexdigest()
+        with self.lock:
+            self.total -= self.lru.pop(stem, 0)
+        self._delete(stem)
+
+    def _delete(self, stem):
+        if self.read_only:
+            return
+        with self._stem_lock(stem):
+            for suffix in ('.json', '.body'):
+                try:
+                    os.remove(self._path(stem, suffix))
+                except FileNotFoundError:
+                    pass
+
+    def evict(self):
+        while True:
+            with self.lock:
+                if self.total <= self.max_bytes or not self.lru:
+                    return
+                stem, size = self.lru.popitem(last=False)
+                self.total -= size
+            self._delete(stem)
+
+    def purge(self):
+        """Delete every stored response, including any on disk that load() has not reached yet."""
+        with self.lock:
+            stems = set(self.lru)
+            self.lru.clear()
+            self.total = 0
+        if os.path.isdir(self.dir):
+            stems.update(os.path.splitext(entry.name)[0] for entry in os.scandir(self.dir)
+                         if entry.name.endswith('.json'))
+        for stem in stems:
+            self._delete(stem)
@@ -0,0 +1,230 @@
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+
+from PyQt5.QtCore import QModelIndex, QObject, Qt, pyqtSignal
+from PyQt5.QtGui import QStandardItem, QStandardItemModel
+from PyQt5.QtWidgets import QCompleter
+
+HALF_LIFE = 30 * 24 * 3600  # a visit counts half as much after a month
+BOOKMARK_BONUS = 10.0
+MAX_SUGGESTIONS = 8
+
+
+def normalize(url):
+    """Key used for prefix matching: no scheme, no leading www., lower case."""
+    url = url.strip().lower()
+    for scheme in ('https://', 'http://'):
+        if url.startswith(scheme):
+            url = url[len(scheme):]
+            break
+    if url.startswith('www.'):
+        url = url[4:]
+    return url
+
+
+def frecency(visit_count, last_visit, now=None):
+    age = max(0.0, (now or time.time()) - last_visit)
+    return visit_count * 0.5 ** (age / HALF_LIFE)
+
+
+class FrecencyIndex:
+    """Prefix index over history and bookmark URLs ranked by frecency.
+
+    Keys live in one sorted list with parallel arrays of row references and
+    scores, so a prefix is a bisect range. The sorted entries are cut into
+    blocks of BLOCK, and a segment tree over the blocks keeps the top
+    entries of every node. A query scans at most the two partial blocks at
+    the ends of its range and merges the top lists of O(log n) nodes for
+    the rest, however many keys share the prefix.
+    """
+
+    BLOCK = 64
+
+    def __init__(self, entries, limit=MAX_SUGGESTIONS):
+        entries = sorted(entries, key=itemgetter(0))  # (key, ref, score)
+        keys, refs, scores = zip(*entries) if entries else ((), (), ())
+        self.limit = limit
+        self.keys = list(keys)
+        self.refs = array('q', refs)
+        self.scores = array('d', scores)
+        blocks = -(-len(self.keys) // self.BLOCK)
+        self.leaves = 1
+        while self.leaves < blocks:
+            self.leaves *= 2
+        self.tree = [()] * (2 * self.leaves)  # node -> indices of its best entries
+        for block in range(blocks):
+            start = block * self.BLOCK
+            self.tree[self.leaves + block] = self._best(range(start, min(start + self.BLOCK, len(self.keys))))
+        for node in range(self.leaves - 1, 0, -1):
+            self.tree[node] = self._best(self.tree[2 * node] + self.tree[2 * node + 1])
+
+    def _best(self, candidates):
+        return tuple(heapq.nlargest(self.limit, candidates, key=self.scores.__getitem__))
+
+    def _range_best(self, lo, hi):
+        """The best entries with indices in [lo, hi)."""
+        first, last = lo // self.BLOCK, hi // self.BLOCK
+        if first == last:
+            return self._best(range(lo, hi))
+        candidates = list(range(lo, (first + 1) * self.BLOCK))
+        candidates += range(last * self.BLOCK, hi)
+        left, right = first + 1 + self.leaves, last + self.leaves  # whole blocks [first + 1, last)
+        while left < right:
+            if left & 1:
+                candidates += self.tree[left]
+                left += 1
+            if right & 1:
+                right -= 1
+                candidates += self.tree[right]
+            left //= 2
+            right //= 2
+        return self._best(candidates)
+
+    def query(self, prefix):
+        """Return [(score, ref)] for the best entries whose key starts with prefix."""
+        if not prefix:
+            return []
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + '\uffff', lo)
+        return [(self.scores[i], self.refs[i]) for i in self._range_best(lo, hi)]
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def build_index(profile):
+    """Read every visited URL and bookmark from the ProfileStore into a FrecencyIndex.
+
+    History rows are referenced by urls.id, bookmarks by -bookmarks.id.
+    """
+    conn = profile.open_reader()
+    now = time.time()
+    try:
+        bookmarked = {url for (url,) in conn.execute('SELECT url FROM bookmarks WHERE is_folder = 0')}
+
+        def entries():
+            for row_id, url, visit_count, last_visit in conn.execute(
+                    'SELECT id, url, visit_count, last_visit FROM urls WHERE visit_count > 0'):
+                score = frecency(visit_count, last_visit, now)
+                if url in bookmarked:
+                    score += BOOKMARK_BONUS
+                    bookmarked.discard(url)
+                yield normalize(url), row_id, score
+            for row_id, url in conn.execute('SELECT id, url FROM bookmarks WHERE is_folder = 0'):
+                if url in bookmarked:
+                    yield normalize(url), -row_id, BOOKMARK_BONUS
+
+        return FrecencyIndex(entries())
+    finally:
+        conn.close()
+
+
+class OmniboxCompleter(QObject):
+    """Drop-down suggestions for the URL bar, computed off the GUI thread.
+
+    Each keystroke bumps a generation counter and queues a query on a single
+    worker thread. Queries whose generation is already stale when they reach
+    the worker are skipped, and results that arrive after a newer keystroke
+    are dropped.
+    """
+
+    results_ready = pyqtSignal(int, list)
+    url_chosen = pyqtSignal(str)
+
+    def __init__(self, url_bar, profile, parent=None):
+        super(OmniboxCompleter, self).__init__(parent)
+        self.url_bar = url_bar
+        self.profile = profile
+        self.generation = 0
+        self.index = None
+        self.recent = {}  # visits since the index was built: key -> [score, url]
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        self.model = QStandardItemModel(self)
+        self.completer = QCompleter(self.model, self)
+        self.completer.setWidget(url_bar)
+        self.completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.completer.activated[QModelIndex].connect(self.on_activated)
+
+        url_bar.textEdited.connect(self.on_text_edited)
+        self.results_ready.connect(self.show_results)
+        self.executor.submit(self.rebuild)
+
+    def rebuild(self):
+        self.index = build_index(self.profile)
+        self.recent = {}
+
+    def note_visit(self, url):
+        entry = self.recent.setdefault(normalize(url), [0.0, url])
+        entry[0] += 1.0
+
+    def on_text_edited(self, text):
+        self.generation += 1
+        self.executor.submit(self.run_query, self.generation, text)
+
+    def run_query(self, generation, text):
+        if generation != self.generation:
+            return  # a newer keystroke is already queued
+        prefix = normalize(text)
+        suggestions = []
+        if prefix:
+            suggestions = self.lookup(prefix)
+        self.results_ready.emit(generation, suggestions)
+
+    def lookup(self, prefix):
+        merged = {}
+        if self.index is not None:
+            ranked = self.index.query(prefix)
+            for url, title, score in self.resolve(ranked):
+                merged[url] = (score, title)
+        for key, (score, url) in list(self.recent.items()):
+            if key.startswith(prefix):
+                old_score, title = merged.get(url, (0.0, ''))
+                merged[url] = (old_score + score, title)
+        best = heapq.nlargest(MAX_SUGGESTIONS, merged.items(), key=lambda item: item[1][0])
+        return [(url, title) for url, (score, title) in best]
+
+    def resolve(self, ranked):
+        """(url, title, score) for each ranked reference, with one query per table."""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = self.profile.open_reader()
+        rows = {}
+        for table, ids, sign in (('urls', [ref for _, ref in ranked if ref > 0], 1),
+                                 ('bookmarks', [-ref for _, ref in ranked if ref < 0], -1)):
+            if ids:
+                query = f'SELECT id, url, title FROM {table} WHERE id IN ({",".join("?" * len(ids))})'
+                for row_id, url, title in conn.execute(query, ids).fetchall():
+                    rows[sign * row_id] = (url, title)
+        for score, ref in ranked:
+            if ref in rows:
+                url, title = rows[ref]
+                yield url, title or '', score
+
+    def show_results(self, generation, suggestions):
+        if generation != self.generation:
+            return
+        self.model.clear()
+        for url, title in suggestions:
+            item = QStandardItem(f"{url}  —  {title}" if title else url)
+            item.setData(url, Qt.UserRole)
+            self.model.appendRow(item)
+        if suggestions:
+            self.completer.complete()
+        else:
+            self.completer.popup().hide()
+
+    def on_activated(self, index):
+        url = index.data(Qt.UserRole)
+        if url:
+            self.url_bar.setText(url)
+            self.url_chosen.emit(url)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,123 @@
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, Qt, QTimer
+from PyQt5.QtWidgets import QApplication, QStyle
+
+from profile_store import PAGE_SIZE
+
+
+class PagedListModel(QAbstractListModel):
+    """List model that pulls rows from the profile store one page at a time.
+
+    Views call canFetchMore/fetchMore as the user scrolls, so opening a
+    panel costs one page whatever the size of the store, and filtering
+    resets the model to the first page of an indexed query.
+    """
+
+    def __init__(self, parent=None):
+        super(PagedListModel, self).__init__(parent)
+        self.rows = []
+        self.exhausted = False
+        self.query = ''
+
+    def fetch_page(self, after, limit):
+        raise NotImplementedError
+
+    def cursor(self, row):
+        raise NotImplementedError
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.exhausted:
+            return
+        page = self.fetch_page(self.cursor(self.rows[-1]) if self.rows else None, PAGE_SIZE)
+        if len(page) < PAGE_SIZE:
+            self.exhausted = True
+        if page:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+            self.rows.extend(page)
+            self.endInsertRows()
+
+    def refresh(self):
+        self.beginResetModel()
+        self.rows = []
+        self.exhausted = False
+        self.endResetModel()
+
+    def set_filter(self, text):
+        self.query = text.strip()
+        self.refresh()
+
+    def row_at(self, index):
+        return self.rows[index.row()] if index.isValid() else None
+
+
+class HistoryModel(PagedListModel):
+    def __init__(self, history, parent=None):
+        super(HistoryModel, self).__init__(parent)
+        self.history = history
+
+    def fetch_page(self, after, limit):
+        return self.history.page(self.query, after, limit)
+
+    def cursor(self, row):
+        row_id, url, title, last_visit = row
+        return (last_visit, row_id)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row_id, url, title, last_visit = self.rows[index.row()]
+        if role == Qt.DisplayRole:
+            return f"{title} - {url}" if title else url
+        if role == Qt.ToolTipRole:
+            return url
+        return None
+
+    def url_at(self, index):
+        row = self.row_at(index)
+        return row[1] if row else None
+
+
+class BookmarkModel(PagedListModel):
+    """One folder of bookmarks at a time, or search results from every folder."""
+
+    def __init__(self, bookmarks, parent=None):
+        super(BookmarkModel, self).__init__(parent)
+        self.bookmarks = bookmarks
+        self.folder_id = None
+
+    def fetch_page(self, after, limit):
+        return self.bookmarks.page(self.folder_id, self.query, after, limit)
+
+    def cursor(self, bm):
+        return (bm.position, bm.id)
+
+    def open_folder(self, folder_id):
+        self.folder_id = folder_id
+        self.refresh()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        bm = self.rows[index.row()]
+        if role == Qt.DisplayRole:
+            return bm.title if bm.is_folder else f"{bm.title} - {bm.url}"
+        if role == Qt.DecorationRole and bm.is_folder:
+            return QApplication.style().standardIcon(QStyle.SP_DirIcon)
+        if role == Qt.ToolTipRole:
+            return bm.url or bm.title
+        return None
+
+
+def connect_filter(line_edit, model, delay=150):
+    """Re-query the model shortly after the user stops typing in line_edit."""
+    timer = QTimer(line_edit)
+    timer.setSingleShot(True)
+    timer.setInterval(delay)
+    timer.timeout.connect(lambda: model.set_filter(line_edit.text()))
+    line_edit.textChanged.connect(timer.start)
+    return timer
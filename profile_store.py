@@ -0,0 +1,484 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from itertools import islice
+
+PROFILE_DB = 'profile.db'
+# Incognito windows share one database that lives only as long as a connection to it is open
+MEMORY_PROFILE = 'file:incognito?mode=memory&cache=shared'
+LEGACY_HISTORY = 'history.json'
+LEGACY_BOOKMARKS = 'bookmarks.json'
+LEGACY_BOOKMARKS_TXT = 'bookmarks.txt'
+LEGACY_MAC_ADDRESS = 'mac_address.json'
+
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    title TEXT,
+    visit_count INTEGER NOT NULL DEFAULT 0,
+    last_visit REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS urls_last_visit ON urls (last_visit);
+CREATE TABLE IF NOT EXISTS visits (
+    id INTEGER PRIMARY KEY,
+    url_id INTEGER NOT NULL REFERENCES urls (id) ON DELETE CASCADE,
+    visit_time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS visits_url ON visits (url_id);
+CREATE INDEX IF NOT EXISTS visits_time ON visits (visit_time);
+CREATE TABLE IF NOT EXISTS bookmarks (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    url TEXT NOT NULL,
+    added REAL NOT NULL,
+    parent_id INTEGER REFERENCES bookmarks (id) ON DELETE CASCADE,
+    is_folder INTEGER NOT NULL DEFAULT 0,
+    position INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS bookmarks_url ON bookmarks (url);
+CREATE INDEX IF NOT EXISTS bookmarks_parent ON bookmarks (parent_id, position);
+CREATE TABLE IF NOT EXISTS session_tabs (
+    position INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    title TEXT,
+    state BLOB,
+    scroll_x REAL NOT NULL DEFAULT 0,
+    scroll_y REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Trigram full-text indexes so the history and bookmark panels can filter
+# on any substring without scanning. Skipped when this SQLite build has no
+# FTS5 trigram tokenizer; searches then fall back to LIKE.
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE {table}_fts USING fts5 (url, title, content='{table}', content_rowid='id', tokenize='trigram');
+CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN
+    INSERT INTO {table}_fts (rowid, url, title) VALUES (new.id, new.url, coalesce(new.title, ''));
+END;
+CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN
+    INSERT INTO {table}_fts ({table}_fts, rowid, url, title) VALUES ('delete', old.id, old.url, coalesce(old.title, ''));
+END;
+CREATE TRIGGER {table}_fts_update AFTER UPDATE OF url, title ON {table}
+WHEN old.url IS NOT new.url OR old.title IS NOT new.title BEGIN
+    INSERT INTO {table}_fts ({table}_fts, rowid, url, title) VALUES ('delete', old.id, old.url, coalesce(old.title, ''));
+    INSERT INTO {table}_fts (rowid, url, title) VALUES (new.id, new.url, coalesce(new.title, ''));
+END;
+INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild');
+"""
+FTS_MIN_QUERY = 3  # trigram index needs at least one full trigram
+
+BATCH_SIZE = 1000
+PAGE_SIZE = 200
+VISIT_RETENTION = 90 * 24 * 3600  # raw visits older than this are dropped; per-URL counts are kept
+
+
+def connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False, uri=True)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA foreign_keys=ON')
+    return conn
+
+
+class Rows(list):
+    """Rows already fetched, with the cursor methods callers use."""
+
+    def fetchall(self):
+        return list(self)
+
+    def fetchone(self):
+        return self[0] if self else None
+
+
+class LockedReader:
+    """Queries on the writer's connection under the profile lock.
+
+    Used for the in-memory profile: shared-cache databases lock whole
+    tables instead of using WAL, so a separate reader connection fails
+    with "database table is locked" whenever its query overlaps a history
+    flush. Each query is fetched completely before the lock is released.
+    """
+
+    def __init__(self, conn, lock):
+        self.conn = conn
+        self.lock = lock
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            return Rows(self.conn.execute(sql, params).fetchall())
+
+    def close(self):
+        pass  # the connection belongs to the writer
+
+
+def batches(rows, size=BATCH_SIZE):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_json_array(path, chunk_size=1 << 16):
+    """Yield the items of a top-level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    with open(path, 'r') as f:
+        buf = f.read(chunk_size).lstrip()
+        if not buf.startswith('['):
+            return
+        buf = buf[1:]
+        eof = False
+        while True:
+            if not eof and len(buf) < chunk_size:
+                more = f.read(chunk_size)
+                eof = not more
+                buf += more
+            buf = buf.lstrip().lstrip(',').lstrip()
+            if not buf or buf.startswith(']'):
+                return
+            try:
+                item, end = decoder.raw_decode(buf)
+            except ValueError:
+                if eof:
+                    return  # truncated file: keep what was read
+                more = f.read(chunk_size)
+                eof = not more
+                buf += more
+                continue
+            yield item
+            buf = buf[end:]
+
+
+class HistoryStore:
+    """Browsing history, written in batches off the GUI thread.
+
+    record_visit only appends to an in-memory list. A background thread
+    writes the pending visits every flush_interval seconds, bumping the
+    visit count of each URL's single urls row and appending to the visits
+    log; every few flushes compact() prunes old raw visits.
+    """
+
+    def __init__(self, profile, flush_interval=2.0, compact_every=30):
+        self.profile = profile
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every
+        self.pending = []
+        self.flushes = 0
+
+        self.stopped = threading.Event()
+        self.writer = threading.Thread(target=self._run, name='history-writer', daemon=True)
+        self.writer.start()
+
+    def record_visit(self, url, title=None):
+        self.pending.append((url, title, time.time()))
+
+    def flush(self):
+        profile = self.profile
+        with profile.lock:
+            batch, self.pending = self.pending, []
+            if batch:
+                with profile.conn:
+                    profile.add_visits(batch)
+            self.flushes += 1
+        if self.compact_every and self.flushes % self.compact_every == 0:
+            self.compact()
+
+    def compact(self, retention=VISIT_RETENTION):
+        """Drop raw visits past the retention window; urls keeps the aggregated counts."""
+        with self.profile.lock, self.profile.conn:
+            self.profile.conn.execute('DELETE FROM visits WHERE visit_time < ?', (time.time() - retention,))
+
+    def page(self, query='', after=None, limit=PAGE_SIZE):
+        """One page of (id, url, title, last_visit) rows, most recent first.
+
+        after is the (last_visit, id) of the last row of the previous page,
+        so each page is a short range scan of the last_visit index.
+        """
+        if after is None:
+            self.flush()
+        conditions = ['u.visit_count > 0']
+        params = []
+        if query:
+            conditions.append(self.profile.search_clause('urls', 'u', query, params))
+        if after is not None:
+            conditions.append('(u.last_visit, u.id) < (?, ?)')
+            params.extend(after)
+        params.append(limit)
+        return self.profile.reader.execute(
+            'SELECT u.id, u.url, u.title, u.last_visit FROM urls u WHERE ' + ' AND '.join(conditions) +
+            ' ORDER BY u.last_visit DESC, u.id DESC LIMIT ?', params).fetchall()
+
+    def clear(self):
+        """Delete every visited URL and title; the urls_fts triggers drop them from the search index too."""
+        with self.profile.lock, self.profile.conn:
+            self.pending = []
+            self.profile.conn.execute('DELETE FROM visits')
+            self.profile.conn.execute('DELETE FROM urls')
+
+    def _run(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self.stopped.set()
+        self.writer.join()
+        self.flush()
+
+
+class Bookmark:
+    __slots__ = ('id', 'title', 'url', 'parent_id', 'is_folder', 'position')
+
+    def __init__(self, id, title, url, parent_id, is_folder, position):
+        self.id = id
+        self.title = title
+        self.url = url
+        self.parent_id = parent_id
+        self.is_folder = bool(is_folder)
+        self.position = position
+
+
+class BookmarkStore:
+    """Bookmarks keyed by row id and indexed by URL and folder.
+
+    Every lookup goes through an index (bookmarks_url, bookmarks_parent)
+    and every edit touches only the affected row.
+    """
+
+    COLUMNS = 'id, title, url, parent_id, is_folder, position'
+
+    def __init__(self, profile):
+        self.profile = profile
+
+    def _query(self, sql, params=()):
+        return [Bookmark(*row) for row in self.profile.reader.execute(sql, params)]
+
+    def __iter__(self):
+        """Yield every bookmark (not folders) in folder order."""
+        for row in self.profile.reader.execute(
+                f'SELECT {self.COLUMNS} FROM bookmarks WHERE is_folder = 0 ORDER BY parent_id, position, id'):
+            yield Bookmark(*row)
+
+    def children(self, parent_id=None):
+        """Folders and bookmarks directly inside parent_id (None is the top level)."""
+        return self._query(
+            f'SELECT {self.COLUMNS} FROM bookmarks WHERE parent_id IS ? ORDER BY position, id', (parent_id,))
+
+    def page(self, parent_id=None, query='', after=None, limit=PAGE_SIZE):
+        """One page of a folder's children, or of bookmarks anywhere matching query.
+
+        after is the (position, id) of the last row of the previous page.
+        """
+        params = []
+        if query:
+            conditions = ['b.is_folder = 0', self.profile.search_clause('bookmarks', 'b', query, params)]
+        else:
+            conditions = ['b.parent_id IS ?']
+            params.append(parent_id)
+        if after is not None:
+            conditions.append('(b.position, b.id) > (?, ?)')
+            params.extend(after)
+        params.append(limit)
+        columns = ', '.join('b.' + c for c in self.COLUMNS.split(', '))
+        return self._query(
+            f'SELECT {columns} FROM bookmarks b WHERE ' + ' AND '.join(conditions) +
+            ' ORDER BY b.position, b.id LIMIT ?', params)
+
+    def get(self, bookmark_id):
+        found = self._query(f'SELECT {self.COLUMNS} FROM bookmarks WHERE id = ?', (bookmark_id,))
+        return found[0] if found else None
+
+    def find_by_url(self, url):
+        found = self._query(f'SELECT {self.COLUMNS} FROM bookmarks WHERE url = ? AND is_folder = 0 LIMIT 1', (url,))
+        return found[0] if found else None
+
+    def contains(self, url):
+        return self.profile.reader.execute(
+            'SELECT 1 FROM bookmarks WHERE url = ? AND is_folder = 0', (url,)).fetchone() is not None
+
+    def _insert(self, title, url, parent_id, is_folder):
+        with self.profile.lock, self.profile.conn:
+            cursor = self.profile.conn.execute(
+                'INSERT INTO bookmarks (title, url, added, parent_id, is_folder, position) '
+                'SELECT ?, ?, ?, ?, ?, coalesce(max(position) + 1, 0) FROM bookmarks WHERE parent_id IS ?',
+                (title, url, time.time(), parent_id, int(is_folder), parent_id),
+            )
+            return cursor.lastrowid
+
+    def add(self, title, url, parent_id=None):
+        """Add a bookmark and return its id."""
+        return self._insert(title, url, parent_id, False)
+
+    def add_folder(self, title, parent_id=None):
+        return self._insert(title, '', parent_id, True)
+
+    def update(self, bookmark_id, title, url):
+        with self.profile.lock, self.profile.conn:
+            self.profile.conn.execute('UPDATE bookmarks SET title = ?, url = ? WHERE id = ?', (title, url, bookmark_id))
+
+    def move(self, bookmark_id, parent_id):
+        with self.profile.lock, self.profile.conn:
+            self.profile.conn.execute(
+                'UPDATE bookmarks SET parent_id = ?, '
+                'position = (SELECT coalesce(max(position) + 1, 0) FROM bookmarks WHERE parent_id IS ?) WHERE id = ?',
+                (parent_id, parent_id, bookmark_id),
+            )
+
+    def remove(self, bookmark_id):
+        """Remove a bookmark, or a folder together with everything in it."""
+        with self.profile.lock, self.profile.conn:
+            self.profile.conn.execute('DELETE FROM bookmarks WHERE id = ?', (bookmark_id,))
+
+
+class ProfileStore:
+    """One SQLite database for history, bookmarks, session tabs and settings.
+
+    Nothing is loaded into memory up front: opening the profile costs the
+    same whether history holds a hundred entries or a million, and callers
+    page through query results instead of holding Python lists.
+    """
+
+    def __init__(self, path=PROFILE_DB, flush_interval=2.0):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = connect(path)
+        self.create_schema()
+        self.reader = self.open_reader()  # GUI-thread queries
+        if not self.in_memory:
+            self.migrate_legacy_files()
+        self.history = HistoryStore(self, flush_interval)
+        self.bookmarks = BookmarkStore(self)
+
+    @property
+    def in_memory(self):
+        return 'mode=memory' in self.path
+
+    def open_reader(self):
+        """A connection for queries outside the writer's lock; under WAL they never wait for the writer."""
+        if self.in_memory:
+            return LockedReader(self.conn, self.lock)
+        return connect(self.path)
+
+    def create_schema(self):
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+            return
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+            for table in ('urls', 'bookmarks'):
+                try:
+                    self.conn.executescript(FTS_SCHEMA.format(table=table))
+                except sqlite3.OperationalError:
+                    break  # no FTS5 or no trigram tokenizer in this SQLite build
+            self.conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def has_fts(self, table):
+        return self.reader.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table + '_fts',)).fetchone() is not None
+
+    def search_clause(self, table, alias, text, params):
+        """SQL condition matching text anywhere in url or title, appending its parameters to params."""
+        if len(text) >= FTS_MIN_QUERY and self.has_fts(table):
+            params.append('"' + text.replace('"', '""') + '"')
+            return f'{alias}.id IN (SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH ?)'
+        pattern = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        params.extend((pattern, pattern))
+        return f"({alias}.url LIKE ? ESCAPE '\\' OR {alias}.title LIKE ? ESCAPE '\\')"
+
+    def add_visits(self, visits):
+        """Insert (url, title, time) visits; the caller holds the lock and transaction."""
+        for batch in batches(visits):
+            self.conn.executemany(
+                'INSERT INTO urls (url, title, visit_count, last_visit) VALUES (?, ?, 1, ?) '
+                'ON CONFLICT (url) DO UPDATE SET visit_count = visit_count + 1, '
+                'last_visit = max(last_visit, excluded.last_visit), title = coalesce(excluded.title, title)',
+                batch,
+            )
+            self.conn.executemany(
+                'INSERT INTO visits (url_id, visit_time) SELECT id, ? FROM urls WHERE url = ?',
+                ((visit_time, url) for url, _, visit_time in batch),
+            )
+
+    def save_session(self, tabs, current=0):
+        """Replace the saved session with (url, title, state, scroll_x, scroll_y) tuples."""
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM session_tabs')
+            self.conn.executemany(
+                'INSERT INTO session_tabs (position, url, title, state, scroll_x, scroll_y) VALUES (?, ?, ?, ?, ?, ?)',
+                ((position,) + tuple(tab) for position, tab in enumerate(tabs)),
+            )
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('session_current', ?)", (str(current),))
+
+    def load_session(self):
+        """Return the saved tabs as (url, title, state, scroll_x, scroll_y) and the index of the current one."""
+        tabs = self.reader.execute(
+            'SELECT url, title, state, scroll_x, scroll_y FROM session_tabs ORDER BY position').fetchall()
+        return tabs, int(self.get_meta('session_current', 0))
+
+    def get_meta(self, key, default=None):
+        row = self.reader.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def migrate_legacy_files(self):
+        """Stream the old JSON/TXT files into the database, once per file."""
+        now = time.time()
+        migrations = (
+            (LEGACY_HISTORY, self._import_history),
+            (LEGACY_BOOKMARKS, self._import_bookmarks_json),
+            (LEGACY_BOOKMARKS_TXT, self._import_bookmarks_txt),
+            (LEGACY_MAC_ADDRESS, self._import_mac_address),
+        )
+        for path, migrate in migrations:
+            if not os.path.exists(path):
+                continue
+            key = f'imported:{path}'
+            if self.conn.execute('SELECT 1 FROM meta WHERE key = ?', (key,)).fetchone():
+                continue
+            with self.lock, self.conn:
+                migrate(path)
+                self.conn.execute('INSERT INTO meta (key, value) VALUES (?, ?)', (key, str(now)))
+
+    def _import_history(self, path):
+        now = time.time()
+        self.add_visits((url, None, now) for url in iter_json_array(path) if isinstance(url, str))
+
+    def _import_bookmarks_json(self, path):
+        self._add_bookmarks(
+            (bm.get('title') or bm['url'], bm['url'])
+            for bm in iter_json_array(path) if isinstance(bm, dict) and bm.get('url')
+        )
+
+    def _import_bookmarks_txt(self, path):
+        with open(path, 'r') as f:
+            self._add_bookmarks((url, url) for url in (line.strip() for line in f) if url)
+
+    def _import_mac_address(self, path):
+        with open(path, 'r') as f:
+            mac = json.load(f).get('mac_address')
+        if mac:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('mac_address', ?)", (mac,))
+
+    def _add_bookmarks(self, bookmarks):
+        for batch in batches(bookmarks):
+            self.conn.executemany(
+                'INSERT INTO bookmarks (title, url, added) SELECT ?1, ?2, ?3 '
+                'WHERE NOT EXISTS (SELECT 1 FROM bookmarks WHERE url = ?2)',
+                [(title, url, time.time()) for title, url in batch],
+            )
+
+    def close(self):
+        self.history.close()
+        self.history.compact()
+        self.reader.close()
+        self.conn.close()
@@ -0,0 +1,455 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+from httpcache import CACHE_DIR, MAX_CACHE_BYTES, MAX_ENTRY_BYTES, CacheEntry, HttpCache, cache_control, header, storable
+from routing import RouteTable
+
+log = logging.getLogger('proxy')
+
+CHUNK_SIZE = 64 * 1024
+MAX_HEAD_BYTES = 64 * 1024
+TIMEOUT_S = 30
+CLIENT_IDLE_S = 120
+POOL_PER_HOST = 6
+POOL_IDLE_S = 60
+HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-connection', 'proxy-authenticate', 'proxy-authorization',
+              'te', 'trailer', 'transfer-encoding', 'upgrade', 'expect'}
+# Set by the incognito profile on its http:// requests: answer from the cache, never add to it
+PRIVATE_HEADER = 'X-Browser-Private'
+IDEMPOTENT = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE'}  # safe to send twice (RFC 9110 9.2.2)
+CONDITIONAL = {'if-none-match', 'if-modified-since', 'if-match', 'if-unmodified-since', 'if-range'}
+UPSTREAM_ERRORS = (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ValueError)
+
+
+async def socks5_connect(reader, writer, host, port):
+    """Have a SOCKS5 proxy (no authentication) connect to host:port; the proxy resolves the name."""
+    writer.write(b'\x05\x01\x00')
+    await writer.drain()
+    if await reader.readexactly(2) != b'\x05\x00':
+        raise ConnectionError('SOCKS5 proxy requires authentication')
+    name = host.encode('ascii')
+    writer.write(b'\x05\x01\x00\x03' + bytes([len(name)]) + name + port.to_bytes(2, 'big'))
+    await writer.drain()
+    reply = await reader.readexactly(4)
+    if reply[1] != 0:
+        raise ConnectionError(f'SOCKS5 proxy could not connect to {host}:{port} (error {reply[1]})')
+    address_length = {1: 4, 4: 16}.get(reply[3])
+    if address_length is None:
+        address_length = (await reader.readexactly(1))[0]
+    await reader.readexactly(address_length + 2)  # the bound address and port, unused
+
+
+async def http_connect(reader, writer, host, port):
+    """Open a tunnel to host:port through an HTTP proxy with CONNECT."""
+    writer.write(f'CONNECT {host}:{port} HTTP/1.1\r\nHost: {host}:{port}\r\n\r\n'.encode('ascii'))
+    await writer.drain()
+    start_line, _ = await read_head(reader)
+    if start_line.split(' ', 2)[1:2] != ['200']:
+        raise ConnectionError(f'HTTP proxy refused CONNECT to {host}:{port}: {start_line}')
+
+
+async def open_connection(host, port, route=None):
+    """Connect to host:port the way route says (see routing.Route); direct when route is None."""
+    if route is None or route.kind == 'direct':
+        return await asyncio.wait_for(asyncio.open_connection(host, port), TIMEOUT_S)
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(*route.address), TIMEOUT_S)
+    handshake = socks5_connect if route.kind == 'socks5' else http_connect
+    try:
+        await asyncio.wait_for(handshake(reader, writer, host, port), TIMEOUT_S)
+    except BaseException:
+        writer.close()
+        raise
+    return reader, writer
+
+
+async def read_head(reader):
+    """Start line and header list of the next message on reader."""
+    data = await reader.readuntil(b'\r\n\r\n')
+    lines = data.decode('latin-1').split('\r\n')
+    headers = []
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if sep:
+            headers.append((name.strip(), value.strip()))
+    return lines[0], headers
+
+
+async def iter_body(reader, headers, until_close=False):
+    """Yield the body of a message in chunks, with any chunked framing removed."""
+    if 'chunked' in header(headers, 'transfer-encoding').lower():
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            if size == 0:
+                while await reader.readuntil(b'\r\n') != b'\r\n':
+                    pass  # trailers
+                return
+            while size:
+                chunk = await reader.read(min(size, CHUNK_SIZE))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b'', size)
+                size -= len(chunk)
+                yield chunk
+            await reader.readexactly(2)
+    elif header(headers, 'content-length'):
+        remaining = int(header(headers, 'content-length'))
+        while remaining:
+            chunk = await reader.read(min(remaining, CHUNK_SIZE))
+            if not chunk:
+                raise asyncio.IncompleteReadError(b'', remaining)
+            remaining -= len(chunk)
+            yield chunk
+    elif until_close:
+        while True:
+            chunk = await reader.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def end_to_end(headers):
+    """headers without hop-by-hop fields, including those named in Connection."""
+    named = {name.strip().lower() for name in header(headers, 'connection').split(',')}
+    drop = HOP_BY_HOP | named
+    if 'chunked' in header(headers, 'transfer-encoding').lower():
+        drop = drop | {'content-length'}
+    return [(name, value) for name, value in headers if name.lower() not in drop]
+
+
+def format_head(start_line, headers):
+    return (start_line + '\r\n' + ''.join(f'{name}: {value}\r\n' for name, value in headers) + '\r\n').encode('latin-1')
+
+
+async def pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(CHUNK_SIZE)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+    except OSError:
+        pass
+
+
+class Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.reused = False
+        self.idle_since = time.monotonic()
+
+    def close(self):
+        self.writer.close()
+
+
+class ConnectionPool:
+    """Idle keep-alive connections to origin servers, at most per_host for each host and port."""
+
+    def __init__(self, routes, per_host=POOL_PER_HOST, idle_s=POOL_IDLE_S):
+        self.routes = routes
+        self.per_host = per_host
+        self.idle_s = idle_s
+        self.idle = {}  # (host, port) -> [Connection]
+        self.opened = 0
+        self.reused = 0
+
+    async def acquire(self, host, port):
+        idle = self.idle.get((host, port), [])
+        while idle:
+            connection = idle.pop()
+            if time.monotonic() - connection.idle_since < self.idle_s and not connection.reader.at_eof():
+                connection.reused = True
+                self.reused += 1
+                return connection
+            connection.close()
+        connection = Connection(*await open_connection(host, port, self.routes.route_for(host)))
+        self.opened += 1
+        return connection
+
+    def release(self, host, port, connection):
+        idle = self.idle.setdefault((host, port), [])
+        if len(idle) < self.per_host:
+            connection.idle_since = time.monotonic()
+            idle.append(connection)
+        else:
+            connection.close()
+
+    def close(self):
+        for idle in self.idle.values():
+            for connection in idle:
+                connection.close()
+        self.idle = {}
+
+
+class CachingProxy:
+    """HTTP forward proxy on 127.0.0.1 with a shared disk cache, run on its own asyncio thread.
+
+    Plain http:// requests are answered from an HttpCache when the stored
+    response is fresh, revalidated with ETag/Last-Modified when it is stale,
+    and otherwise sent over pooled keep-alive connections. https:// traffic
+    arrives as CONNECT tunnels, which are relayed untouched and so can't be
+    cached. Hosts that the ad blocker blocks entirely are refused before
+    any connection is made. Each outgoing connection takes the route that
+    routes (a routing.RouteTable) gives its host: direct, or through a
+    SOCKS5 proxy (which also resolves the name) or an HTTP proxy. Every
+    profile whose traffic goes through the proxy shares its cache and pool;
+    requests marked with PRIVATE_HEADER may read the cache but never change
+    it, and a read_only_cache is never written at all.
+    """
+
+    def __init__(self, port=0, cache_dir=CACHE_DIR, cache_max_bytes=MAX_CACHE_BYTES, routes=None, ad_blocker=None,
+                 host='127.0.0.1', read_only_cache=False):
+        self.host = host
+        self.port = port
+        self.cache = HttpCache(cache_dir, cache_max_bytes, read_only_cache)
+        self.routes = routes or RouteTable()
+        self.pool = ConnectionPool(self.routes)
+        self.ad_blocker = ad_blocker
+        self.stats = Counter()
+        self.loop = None
+        self.thread = None
+        self.error = None
+
+    def start(self):
+        """Start serving in a background thread; return the port once it is listening."""
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(ready,), name='proxy', daemon=True)
+        self.thread.start()
+        ready.wait()
+        if self.error is not None:
+            raise self.error
+        return self.port
+
+    def _run(self, ready):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            self.cache.load()
+            server = loop.run_until_complete(
+                asyncio.start_server(self.handle_client, self.host, self.port, limit=MAX_HEAD_BYTES))
+            self.port = server.sockets[0].getsockname()[1]
+        except OSError as e:
+            self.error = e
+            loop.close()
+            ready.set()
+            return
+        self.loop = loop
+        ready.set()
+        log.info('listening on %s:%d, cache of %d responses in %s',
+                 self.host, self.port, len(self.cache.lru), self.cache.dir)
+        loop.run_forever()
+        server.close()
+        self.pool.close()
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        loop.run_until_complete(loop.shutdown_default_executor())
+        loop.close()
+
+    def close(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=5)
+            self.loop = None
+            log.info('closed: %s', dict(self.stats, upstream_opened=self.pool.opened, upstream_reused=self.pool.reused))
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def blocked(self, url):
+        return self.ad_blocker is not None and self.ad_blocker.intercept_host(url)
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    start_line, headers = await asyncio.wait_for(read_head(reader), CLIENT_IDLE_S)
+                    method, target, _ = start_line.split(' ', 2)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ValueError):
+                    break
+                if method == 'CONNECT':
+                    await self.tunnel(target, reader, writer)
+                    break
+                if not await self.forward(method, target, headers, reader, writer):
+                    break
+        except (OSError, asyncio.CancelledError):
+            pass  # client went away, or the proxy is shutting down
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, reason, headers=(), body=b''):
+        headers = list(headers) + [('Content-Length', str(len(body)))]
+        writer.write(format_head(f'HTTP/1.1 {status} {reason}', headers) + body)
+        await writer.drain()
+
+    async def tunnel(self, target, reader, writer):
+        host, _, port = target.rpartition(':')
+        host = host.strip('[]')
+        self.stats['tunnels'] += 1
+        if self.blocked(f'https://{host}/'):
+            self.stats['blocked'] += 1
+            await self.respond(writer, 403, 'Forbidden')
+            return
+        try:
+            upstream_reader, upstream_writer = await open_connection(host, int(port), self.routes.route_for(host))
+        except UPSTREAM_ERRORS as e:
+            await self.respond(writer, 502, 'Bad Gateway', body=str(e).encode())
+            return
+        writer.write(b'HTTP/1.1 200 Connection Established\r\n\r\n')
+        await writer.drain()
+        try:
+            await asyncio.gather(pipe(reader, upstream_writer), pipe(upstream_reader, writer))
+        finally:
+            upstream_writer.close()
+
+    async def forward(self, method, target, headers, reader, writer):
+        """Answer one request; return whether the client connection can take another."""
+        keep_alive = 'close' not in header(headers, 'connection').lower() + header(headers, 'proxy-connection').lower()
+        body = b''.join([chunk async for chunk in iter_body(reader, headers)])
+        parts = urlsplit(target)
+        if parts.scheme != 'http' or not parts.hostname:
+            await self.respond(writer, 400, 'Bad Request')
+            return keep_alive
+        self.stats['requests'] += 1
+        if self.blocked(target):
+            self.stats['blocked'] += 1
+            await self.respond(writer, 403, 'Forbidden')
+            return keep_alive
+
+        loop = asyncio.get_running_loop()
+        private = bool(header(headers, PRIVATE_HEADER))
+        request_headers = [h for h in end_to_end(headers) if h[0].lower() != PRIVATE_HEADER.lower()]
+        entry = None
+        # Range requests (e.g. segmented downloads) always go to the origin; the cache holds whole responses
+        if method in ('GET', 'HEAD') and 'no-store' not in cache_control(request_headers) \
+                and not header(request_headers, 'range'):
+            entry = await loop.run_in_executor(None, self.cache.lookup, target, request_headers)
+        if entry is not None:
+            if entry.is_fresh() and 'no-cache' not in cache_control(request_headers):
+                self.stats['hits'] += 1
+                await self.send_cached(entry, method, request_headers, writer)
+                return keep_alive
+            # Revalidate our copy; the client's own conditions are checked against it afterwards
+            request_headers = [h for h in request_headers if h[0].lower() not in CONDITIONAL] + entry.validators()
+
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        outgoing = [h for h in request_headers if h[0].lower() not in ('host', 'content-length')]
+        outgoing = [('Host', parts.netloc)] + outgoing
+        if body or method in ('POST', 'PUT', 'PATCH'):
+            outgoing.append(('Content-Length', str(len(body))))
+        request = format_head(f'{method} {path} HTTP/1.1', outgoing) + body
+        host, port = parts.hostname, parts.port or 80
+        try:
+            connection, status, reason, version, response_headers = await self.exchange(host, port, method, request)
+        except UPSTREAM_ERRORS as e:
+            await self.respond(writer, 502, 'Bad Gateway', body=str(e).encode())
+            return keep_alive
+
+        has_body = method != 'HEAD' and status >= 200 and status not in (204, 304)
+        framed = bool(header(response_headers, 'content-length') or header(response_headers, 'transfer-encoding'))
+        reusable = (version == 'HTTP/1.1' and 'close' not in header(response_headers, 'connection').lower()
+                    and (framed or not has_body))
+
+        if status == 304 and entry is not None:
+            self.pool.release(host, port, connection)
+            self.stats['revalidated'] += 1
+            entry.refresh(end_to_end(response_headers))
+            if not private:
+                await loop.run_in_executor(None, self.cache.store, entry)
+            await self.send_cached(entry, method, headers, writer)
+            return keep_alive
+        if method not in ('GET', 'HEAD') and status < 400 and not private:
+            await loop.run_in_executor(None, self.cache.remove, target)  # RFC 9111, section 4.4
+        self.stats['misses'] += 1
+
+        out_headers = end_to_end(response_headers)
+        chunked = has_body and 'content-length' not in {name.lower() for name, _ in out_headers}
+        if chunked:
+            out_headers.append(('Transfer-Encoding', 'chunked'))
+        writer.write(format_head(f'HTTP/1.1 {status} {reason}', out_headers))
+        keep = not private and storable(method, status, request_headers, response_headers)
+        stored = []
+        stored_size = 0
+        try:
+            if has_body:
+                async for chunk in iter_body(connection.reader, response_headers, until_close=True):
+                    writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk) if chunked else chunk)
+                    await writer.drain()
+                    if keep:
+                        stored.append(chunk)
+                        stored_size += len(chunk)
+                        keep = stored_size <= MAX_ENTRY_BYTES
+                if chunked:
+                    writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            connection.close()
+            return False  # the client can't tell where the body ended
+        except OSError:
+            connection.close()
+            raise
+        if reusable:
+            self.pool.release(host, port, connection)
+        else:
+            connection.close()
+        if keep:
+            self.stats['stored'] += 1
+            entry = CacheEntry.for_response(target, status, reason, request_headers, end_to_end(response_headers))
+            await loop.run_in_executor(None, self.cache.store, entry, b''.join(stored))
+        return keep_alive
+
+    async def exchange(self, host, port, method, request):
+        """Send request over a pooled connection and read the response head.
+
+        If a pooled connection turns out to have been closed by the server,
+        an idempotent request is retried on a fresh one. Anything else may
+        already have taken effect, so the error is passed on.
+        """
+        while True:
+            connection = await self.pool.acquire(host, port)
+            try:
+                connection.writer.write(request)
+                await connection.writer.drain()
+                start_line, response_headers = await asyncio.wait_for(read_head(connection.reader), TIMEOUT_S)
+                version, status, reason = (start_line.split(' ', 2) + [''])[:3]
+                while 100 <= int(status) < 200:
+                    start_line, response_headers = await asyncio.wait_for(read_head(connection.reader), TIMEOUT_S)
+                    version, status, reason = (start_line.split(' ', 2) + [''])[:3]
+                return connection, int(status), reason, version, response_headers
+            except (OSError, asyncio.IncompleteReadError):
+                connection.close()
+                if not connection.reused or method not in IDEMPOTENT:
+                    raise
+            except BaseException:
+                connection.close()
+                raise
+
+    async def send_cached(self, entry, method, request_headers, writer):
+        """Answer from entry, with a 304 if the client's own validators still match it."""
+        etag = header(entry.headers, 'etag')
+        if_none_match = header(request_headers, 'if-none-match')
+        since = header(request_headers, 'if-modified-since')
+        if if_none_match:
+            not_modified = etag and (if_none_match.strip() == '*' or etag in [t.strip() for t in if_none_match.split(',')])
+        else:
+            not_modified = since and since == header(entry.headers, 'last-modified')
+        headers = [h for h in entry.headers if h[0].lower() not in ('age', 'content-length')]
+        headers.append(('Age', str(int(entry.age()))))
+        if not_modified and entry.status == 200:
+            writer.write(format_head('HTTP/1.1 304 Not Modified', headers))
+            await writer.drain()
+            return
+        body = await asyncio.get_running_loop().run_in_executor(None, self.cache.read_body, entry)
+        headers.append(('Content-Length', str(len(body))))
+        writer.write(format_head(f'HTTP/1.1 {entry.status} {entry.reason}', headers) + (b'' if method == 'HEAD' else body))
+        await writer.drain()
@@ -0,0 +1,80 @@
+import urllib.request
+from urllib.parse import urlsplit
+
+from filterlist import host_suffixes
+
+ROUTE_KINDS = {'socks5': 'socks5', 'socks5h': 'socks5', 'http': 'http'}
+
+
+class Route:
+    """How connections to a site are made: direct, or through a SOCKS5 or HTTP proxy at address."""
+
+    __slots__ = ('name', 'kind', 'address')
+
+    def __init__(self, name, url='direct'):
+        self.name = name
+        self.kind, self.address = parse_route(url)
+
+    def __repr__(self):
+        return f'Route({self.name!r}, {self.kind}{"" if self.address is None else " %s:%d" % self.address})'
+
+
+def parse_route(url):
+    """(kind, (host, port)) for socks5://host:port or http://host:port, ('direct', None) for 'direct' or ''."""
+    if not url or url == 'direct':
+        return 'direct', None
+    parts = urlsplit(url if '://' in url else 'socks5://' + url)
+    if parts.scheme not in ROUTE_KINDS or not parts.hostname or not parts.port:
+        raise ValueError(f'unsupported proxy {url!r}, expected direct, socks5://host:port or http://host:port')
+    return ROUTE_KINDS[parts.scheme], (parts.hostname, parts.port)
+
+
+def url_opener(proxy_url=None):
+    """A urllib opener for fetches made outside the browser profile.
+
+    With proxy_url, the local CachingProxy, http and https requests go
+    through it and so take the same per-site routes as page loads.
+    """
+    if proxy_url is None:
+        return urllib.request.build_opener()
+    return urllib.request.build_opener(urllib.request.ProxyHandler({'http': proxy_url, 'https': proxy_url}))
+
+
+class RouteTable:
+    """Per-site routes compiled into a suffix index.
+
+    routes names each proxy ({"tor": "socks5://127.0.0.1:9050"}), rules
+    maps domains to route names ({"onion": "tor"}). A domain covers its
+    subdomains and the most specific one wins, so route_for costs one
+    dictionary lookup per label of the host. Hosts no rule covers take the
+    default route; "*" in rules overrides default.
+    """
+
+    def __init__(self, routes=None, rules=None, default='direct'):
+        self.routes = {'direct': Route('direct')}
+        for name, url in (routes or {}).items():
+            self.routes[name] = Route(name, url)
+        if default not in self.routes:
+            self.routes['default'] = Route('default', default)  # a proxy URL rather than a route name
+            default = 'default'
+        self.default = self.routes[default]
+        self.suffixes = {}
+        for domain, name in (rules or {}).items():
+            if name not in self.routes:
+                raise ValueError(f'rule for {domain!r} names unknown route {name!r}')
+            domain = domain.strip().lower().lstrip('*').strip('.')
+            if domain:
+                self.suffixes[domain] = self.routes[name]
+            else:
+                self.default = self.routes[name]
+
+    def route_for(self, host):
+        for suffix in host_suffixes((host or '').lower().rstrip('.')):
+            route = self.suffixes.get(suffix)
+            if route is not None:
+                return route
+        return self.default
+
+    @property
+    def all_direct(self):
+        return self.default.kind == 'direct' and all(route.kind == 'direct' for route in self.suffixes.values())
@@ -0,0 +1,50 @@
+import json
+
+SETTINGS_FILE = 'settings.json'
+
+# Every setting the browser reads, with its default. settings.json only
+# needs to contain the ones being changed.
+DEFAULTS = {
+    # Total renderer memory allowed before background tabs get discarded
+    "tab_memory_budget_mb": 2048,
+    "tab_memory_check_interval_s": 10,
+    # Background tabs are frozen this long after they were last shown
+    "tab_freeze_grace_s": 60,
+    # Filter list URLs kept up to date in the background, and how often they are checked
+    "filter_subscriptions": [],
+    "filter_update_interval_h": 24,
+    # Downloads at least this big are fetched in parallel Range segments (0 leaves them all to Chromium)
+    "download_takeover_mb": 16,
+    "download_segments": 4,
+    "download_max_active": 3,
+    "download_bandwidth_kbps": 0,  # shared by all downloads; 0 for no limit
+    "download_dir": "",  # empty for the system download folder
+    # Send page traffic through the local caching proxy in proxy.py (cached http:// responses
+    # are shared by all profiles), optionally chained to a SOCKS5 proxy such as Tor
+    "proxy_enabled": False,
+    "proxy_cache_mb": 256,
+    "proxy_upstream": "",  # e.g. "socks5://127.0.0.1:9050"
+    # Per-site routing through the local proxy: named routes (socks5://host:port, http://host:port
+    # or direct) and the domains that take them, e.g. {"tor": "socks5://127.0.0.1:9050"} and
+    # {"onion": "tor"}. A domain covers its subdomains; "*" sets the route for everything else.
+    # Each proxied route gets its own browser profile, so its cookies and storage stay separate.
+    "proxy_routes": {},
+    "proxy_route_rules": {},
+    # HTTP cache, cookies and storage of the browser profiles, applied by webprofile.py.
+    # A tmpfs web_cache_path (e.g. /dev/shm/custom-browser) keeps the disk cache in RAM.
+    "web_cache_type": "disk",  # disk, memory or none
+    "web_cache_mb": 0,  # 0 lets Chromium choose
+    "web_cache_path": "",  # empty for Qt's default location
+    "web_storage_path": "",  # cookies and local storage; empty for Qt's default location
+    "web_cookies": "persistent",  # persistent, session (dropped on exit) or force (session cookies kept too)
+}
+
+
+def load_settings(path=SETTINGS_FILE):
+    settings = dict(DEFAULTS)
+    try:
+        with open(path, 'r') as f:
+            settings.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    return settings
@@ -0,0 +1,86 @@
+import getpass
+
+from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtNetwork import QLocalServer, QLocalSocket
+
+CONNECT_TIMEOUT_MS = 300
+COMMAND_PREFIX = '--'  # lines like --clear-cache are commands, not URLs
+
+
+def server_name():
+    """Local socket name shared by every launch of the browser for this user."""
+    return f"custom-browser-{getpass.getuser()}"
+
+
+def send_to_running_instance(urls, name=None, timeout_ms=CONNECT_TIMEOUT_MS, commands=()):
+    """Hand urls and command-line commands to an already running browser. Returns False if none is running.
+
+    The message is the commands and URLs separated by newlines; an empty
+    message just asks the running window to open a tab and come to the
+    front.
+    """
+    socket = QLocalSocket()
+    socket.connectToServer(name or server_name())
+    if not socket.waitForConnected(timeout_ms):
+        return False
+    socket.write('\n'.join(list(commands) + list(urls)).encode('utf-8'))
+    socket.flush()
+    socket.waitForBytesWritten(timeout_ms)
+    socket.disconnectFromServer()
+    if socket.state() != QLocalSocket.UnconnectedState:
+        socket.waitForDisconnected(timeout_ms)
+    return True
+
+
+class InstanceServer(QObject):
+    """Listens for later launches and emits the URLs and commands each of them was given.
+
+    A launch that only sent commands doesn't emit urls_received, so it
+    doesn't open a tab.
+    """
+
+    urls_received = pyqtSignal(list)
+    commands_received = pyqtSignal(list)
+
+    def __init__(self, name=None, parent=None):
+        super(InstanceServer, self).__init__(parent)
+        self.name = name or server_name()
+        self.server = QLocalServer(self)
+        self.server.setSocketOptions(QLocalServer.UserAccessOption)
+        self.server.newConnection.connect(self.accept)
+
+    def listen(self, urls=(), commands=()):
+        """Listen for later launches. Returns False if another instance already does; it was handed urls and commands.
+
+        Two copies launched together can both miss each other in
+        send_to_running_instance, so the name may be taken by now. Only a
+        socket nothing answers on, left behind by a crashed instance, is
+        removed.
+        """
+        if self.server.listen(self.name):
+            return True
+        if send_to_running_instance(urls, self.name, commands=commands):
+            return False
+        QLocalServer.removeServer(self.name)
+        return self.server.listen(self.name)
+
+    def accept(self):
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            buffer = bytearray()
+            socket.readyRead.connect(lambda socket=socket, buffer=buffer: buffer.extend(bytes(socket.readAll())))
+            socket.disconnected.connect(lambda socket=socket, buffer=buffer: self.received(socket, buffer))
+
+    def received(self, socket, buffer):
+        buffer.extend(bytes(socket.readAll()))
+        socket.deleteLater()
+        lines = [line.strip() for line in buffer.decode('utf-8', errors='replace').split('\n') if line.strip()]
+        commands = [line for line in lines if line.startswith(COMMAND_PREFIX)]
+        urls = [line for line in lines if not line.startswith(COMMAND_PREFIX)]
+        if commands:
+            self.commands_received.emit(commands)
+        if urls or not commands:
+            self.urls_received.emit(urls)
+
+    def close(self):
+        self.server.close()
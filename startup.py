@@ -0,0 +1,87 @@
+import json
+import logging
+import os
+import sys
+import time
+
+from PyQt5.QtCore import QEvent, QObject
+
+log = logging.getLogger('startup')
+
+PROFILE_FLAG = '--profile-startup'
+
+
+def process_age():
+    """Seconds since this process was started, from /proc (None if unavailable).
+
+    For a PyInstaller build this includes unpacking and interpreter start,
+    which happen before any of our code runs.
+    """
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime', 'r') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+
+
+class StartupProfiler(QObject):
+    """Records how long each startup phase took when --profile-startup is given.
+
+    Phases are marked in order; the report lists each one with the time
+    since the first mark and since the previous one, and is written to
+    stdout as a single JSON line once the first page has loaded. When
+    disabled every method returns immediately.
+    """
+
+    def __init__(self, enabled, start=None, parent=None):
+        super(StartupProfiler, self).__init__(parent)
+        self.enabled = enabled
+        self.start = start if start is not None else time.perf_counter()
+        self.marks = []
+        self.before_start = process_age() if enabled else None
+        if self.before_start is not None:
+            self.before_start -= time.perf_counter() - self.start
+        self.reported = False
+
+    def mark(self, phase):
+        if self.enabled and not self.reported:
+            self.marks.append((phase, time.perf_counter() - self.start))
+
+    def watch_first_paint(self, widget, callback):
+        """Call callback once widget has painted for the first time."""
+        self.paint_target = widget
+        self.paint_callback = callback
+        widget.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if obj is self.paint_target and event.type() == QEvent.Paint:
+            obj.removeEventFilter(self)
+            self.mark('first paint')
+            self.paint_callback()
+        return False
+
+    def watch_first_load(self, view):
+        def finished(ok):
+            view.loadFinished.disconnect(finished)
+            self.mark('first loadFinished')
+            self.report()
+        view.loadFinished.connect(finished)
+
+    def report(self):
+        if not self.enabled or self.reported:
+            return
+        self.reported = True
+        phases = []
+        previous = 0.0
+        for phase, at in self.marks:
+            phases.append({'phase': phase, 'at_ms': round(at * 1000, 1), 'took_ms': round((at - previous) * 1000, 1)})
+            log.info('%-24s %8.1f ms  (+%.1f ms)', phase, at * 1000, (at - previous) * 1000)
+            previous = at
+        result = {'phases': phases}
+        if self.before_start is not None:
+            result['before_python_ms'] = round(self.before_start * 1000, 1)
+            log.info('%-24s %8.1f ms before the first mark', 'process start', self.before_start * 1000)
+        print(json.dumps(result), file=sys.stdout, flush=True)
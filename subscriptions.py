@@ -0,0 +1,146 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from cosmetic import parse_cosmetic
+from filterlist import parse_filter
+from routing import url_opener
+
+log = logging.getLogger('subscriptions')
+
+FILTERS_DIR = 'filters'
+STATE_FILE = os.path.join('adblock_cache', 'subscriptions.json')
+RETRY_S = 3600  # after a failed fetch
+FETCH_TIMEOUT_S = 30
+
+
+def list_path_for(url, filters_dir=FILTERS_DIR):
+    """Where a subscription's list is kept; inside filters/ so AdBlocker picks it up."""
+    return os.path.join(filters_dir, 'sub-' + hashlib.sha1(url.encode()).hexdigest()[:12] + '.txt')
+
+
+def rule_lines(path):
+    """The set of network and element hiding rule lines in a list file (empty if it doesn't exist)."""
+    try:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            return {line.strip() for line in f if parse_filter(line) is not None or parse_cosmetic(line) is not None}
+    except FileNotFoundError:
+        return set()
+
+
+class SubscriptionUpdater:
+    """Keeps subscribed filter lists up to date from a background thread.
+
+    Each URL is fetched at most every interval_s seconds with the ETag and
+    Last-Modified from the previous response, so an unchanged list costs a
+    304. A changed list replaces its file under filters/ atomically and
+    on_updated is called; AdBlocker.reload then recompiles only the index
+    shards whose rules changed and swaps the new rules in. Validators and
+    next-check times are kept in state_path across restarts. With
+    proxy_url, lists are fetched through the local CachingProxy and so
+    take its per-site routes.
+    """
+
+    def __init__(self, urls, interval_s=24 * 3600, on_updated=None,
+                 filters_dir=FILTERS_DIR, state_path=STATE_FILE, check_every_s=60, proxy_url=None):
+        self.urls = list(urls)
+        self.opener = url_opener(proxy_url)
+        self.interval = interval_s
+        self.on_updated = on_updated
+        self.filters_dir = filters_dir
+        self.state_path = state_path
+        self.check_every = check_every_s
+        self.state = self._load_state()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(tmp_path, self.state_path)
+
+    def start(self):
+        if self.urls and self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='subscription-updater', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.update_due()
+            self.stopped.wait(self.check_every)
+
+    def update_due(self, now=None):
+        """Refresh every subscription whose next check has come; return the URLs that changed."""
+        now = now or time.time()
+        changed = [url for url in self.urls
+                   if self.state.get(url, {}).get('next_check', 0) <= now and self.refresh(url)]
+        if changed and self.on_updated is not None:
+            self.on_updated(changed)
+        return changed
+
+    def refresh(self, url):
+        """Conditionally fetch one list; return True if its rules changed."""
+        with self.lock:
+            entry = self.state.setdefault(url, {})
+            path = list_path_for(url, self.filters_dir)
+            request = urllib.request.Request(url, headers={'User-Agent': 'Custom Browser filter updater'})
+            if entry.get('etag') and os.path.exists(path):
+                request.add_header('If-None-Match', entry['etag'])
+            if entry.get('last_modified') and os.path.exists(path):
+                request.add_header('If-Modified-Since', entry['last_modified'])
+            try:
+                with self.opener.open(request, timeout=FETCH_TIMEOUT_S) as response:
+                    body = response.read()
+                    etag = response.headers.get('ETag')
+                    last_modified = response.headers.get('Last-Modified')
+            except urllib.error.HTTPError as e:
+                if e.code == 304:
+                    entry['next_check'] = time.time() + self.interval
+                    self._save_state()
+                    log.info('%s not modified', url)
+                    return False
+                return self._failed(url, entry, e)
+            except (urllib.error.URLError, OSError) as e:
+                return self._failed(url, entry, e)
+
+            entry.update(etag=etag, last_modified=last_modified, next_check=time.time() + self.interval)
+            old_rules = rule_lines(path)
+            os.makedirs(self.filters_dir, exist_ok=True)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            new_rules = rule_lines(tmp_path)
+            if new_rules == old_rules and os.path.exists(path):
+                os.remove(tmp_path)
+                self._save_state()
+                log.info('%s fetched, rules unchanged', url)
+                return False
+            os.replace(tmp_path, path)
+            self._save_state()
+            log.info('%s updated: %d rules added, %d removed', url,
+                     len(new_rules - old_rules), len(old_rules - new_rules))
+            return True
+
+    def _failed(self, url, entry, error):
+        entry['next_check'] = time.time() + min(RETRY_S, self.interval)
+        self._save_state()
+        log.warning('fetching %s failed: %s', url, error)
+        return False
+
+    def close(self):
+        self.stopped.set()
@@ -0,0 +1,276 @@
+import logging
+import os
+import time
+
+from PyQt5.QtCore import QByteArray, QDataStream, QIODevice, QObject, QTimer, QUrl
+from PyQt5.QtWebEngineWidgets import QWebEnginePage, QWebEngineView
+from PyQt5.QtWidgets import QWidget
+
+log = logging.getLogger('tabs')
+
+
+class TabStub(QWidget):
+    """Stand-in for a tab whose QWebEngineView has not been created.
+
+    It keeps only what is needed to bring the page back: URL, title,
+    serialized navigation history and scroll position. No renderer
+    process exists for a stub.
+    """
+
+    def __init__(self, url, title, state=None, scroll=(0.0, 0.0), discarded=False, parent=None):
+        super(TabStub, self).__init__(parent)
+        self._url = QUrl(url)
+        self.title = title
+        self.state = state
+        self.scroll = scroll
+        self.discarded = discarded  # True when this replaced a live view to save memory
+
+    def url(self):
+        return self._url
+
+
+def save_history(view):
+    """Serialize a view's back/forward history, or return None if Qt can't."""
+    data = QByteArray()
+    stream = QDataStream(data, QIODevice.WriteOnly)
+    try:
+        stream << view.history()
+    except TypeError:
+        return None
+    return bytes(data)
+
+
+def restore_history(view, state):
+    """Load serialized history into view; this also navigates to its current entry."""
+    if not state:
+        return False
+    stream = QDataStream(QByteArray(state))
+    try:
+        stream >> view.history()
+    except TypeError:
+        return False
+    return stream.status() == QDataStream.Ok
+
+
+def tab_state(widget, title):
+    """Session tuple (url, title, state, scroll_x, scroll_y) for a view or a stub."""
+    if isinstance(widget, TabStub):
+        return (widget.url().toString(), widget.title, widget.state) + tuple(widget.scroll)
+    position = widget.page().scrollPosition()
+    return (widget.url().toString(), title, save_history(widget), position.x(), position.y())
+
+
+def build_view(stub, new_page=None):
+    """Create the real QWebEngineView for a stub and start loading it, in the page new_page(view) gives if set."""
+    view = QWebEngineView()
+    if new_page is not None:
+        view.setPage(new_page(view))
+    if not restore_history(view, stub.state):
+        view.setUrl(stub.url())
+    x, y = stub.scroll
+    if x or y:
+        def restore_scroll(ok):
+            view.loadFinished.disconnect(restore_scroll)
+            view.page().runJavaScript(f"window.scrollTo({x}, {y});")
+        view.loadFinished.connect(restore_scroll)
+    return view
+
+
+def replace_tab(tabs, index, widget, title):
+    """Swap the widget at index without emitting currentChanged."""
+    old = tabs.widget(index)
+    current = tabs.currentIndex()
+    tabs.blockSignals(True)
+    tabs.removeTab(index)
+    tabs.insertTab(index, widget, title)
+    tabs.setCurrentIndex(current)
+    tabs.blockSignals(False)
+    old.deleteLater()
+
+
+def process_rss(pid):
+    """Resident set size of a process in bytes, from /proc (0 if unavailable)."""
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+class TabMemoryManager(QObject):
+    """Keeps renderer memory under a budget by discarding background tabs.
+
+    Every interval it reads the RSS of each tab's renderer process from
+    /proc; a renderer shared by several tabs is split evenly between them.
+    While the total is over budget, the least recently selected background
+    tab is replaced by a TabStub holding its URL, title and history. The
+    browser turns the stub back into a view when the tab is selected again.
+    """
+
+    def __init__(self, tabs, budget_mb, interval_s=10, parent=None):
+        super(TabMemoryManager, self).__init__(parent)
+        self.tabs = tabs
+        self.budget = budget_mb * 1024 * 1024
+        self.last_active = {}
+        self.tabs.currentChanged.connect(self.note_active)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.enforce_budget)
+        self.timer.start(int(interval_s * 1000))
+
+    def note_active(self, index):
+        widget = self.tabs.widget(index)
+        if widget is not None:
+            self.last_active[widget] = time.monotonic()
+
+    def usage(self):
+        """Return ({view: estimated bytes}, total bytes) for the live tabs."""
+        by_pid = {}
+        for i in range(self.tabs.count()):
+            view = self.tabs.widget(i)
+            if isinstance(view, QWebEngineView):
+                pid = view.page().renderProcessPid() if hasattr(view.page(), 'renderProcessPid') else 0
+                if pid:
+                    by_pid.setdefault(pid, []).append(view)
+        estimates = {}
+        total = 0
+        for pid, views in by_pid.items():
+            rss = process_rss(pid)
+            total += rss
+            for view in views:
+                estimates[view] = rss // len(views)
+        return estimates, total
+
+    def enforce_budget(self):
+        live = {self.tabs.widget(i) for i in range(self.tabs.count())}
+        self.last_active = {w: t for w, t in self.last_active.items() if w in live}  # forget closed tabs
+        estimates, total = self.usage()
+        if total <= self.budget:
+            return
+        current = self.tabs.currentWidget()
+        candidates = sorted(
+            (view for view in estimates if view is not current and not view.page().recentlyAudible()),
+            key=lambda view: self.last_active.get(view, 0),
+        )
+        for view in candidates:
+            if total <= self.budget:
+                break
+            total -= estimates[view]
+            self.discard(view, estimates[view], total)
+
+    def discard(self, view, estimate=0, total_after=0):
+        index = self.tabs.indexOf(view)
+        title = self.tabs.tabText(index)
+        url, title, state, scroll_x, scroll_y = tab_state(view, title)
+        stub = TabStub(url, title, state, (scroll_x, scroll_y), discarded=True)
+        self.last_active[stub] = self.last_active.pop(view, 0)
+        replace_tab(self.tabs, index, stub, title)
+        log.info('discarded tab %d %s (~%d MB); renderers now ~%d of %d MB',
+                 index, url, estimate // 2**20, total_after // 2**20, self.budget // 2**20)
+
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def process_cpu_time(pid):
+    """User + system CPU seconds used by a process, from /proc (0 if unavailable)."""
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class TabFreezer(QObject):
+    """Moves background tabs to the Frozen lifecycle state after a grace period.
+
+    Frozen pages stop running timers, animations and JavaScript until the
+    tab is selected again. Tabs that are playing audio or own a download in
+    progress are left running. For each freeze it compares the renderer's
+    CPU rate while hidden but active against its rate while frozen, and logs
+    the CPU time saved when the tab is thawed.
+    """
+
+    def __init__(self, tabs, grace_s=60, parent=None):
+        super(TabFreezer, self).__init__(parent)
+        self.tabs = tabs
+        self.grace = grace_s
+        self.supported = hasattr(QWebEnginePage, 'LifecycleState')
+        self.hidden_since = {}  # view -> (time hidden, renderer CPU seconds then)
+        self.frozen = {}  # view -> (time frozen, CPU seconds then, CPU rate while hidden)
+        self.cpu_saved = {}  # view -> CPU seconds saved by freezing so far
+        self.downloads = {}  # page -> downloads in progress
+        self.previous = tabs.currentWidget()
+        tabs.currentChanged.connect(self.on_current_changed)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.freeze_idle)
+        if self.supported:
+            self.timer.start(5000)
+
+    def live_views(self):
+        return [w for w in (self.tabs.widget(i) for i in range(self.tabs.count())) if isinstance(w, QWebEngineView)]
+
+    def cpu_share(self, view, live):
+        pid = view.page().renderProcessPid() if hasattr(view.page(), 'renderProcessPid') else 0
+        if not pid:
+            return 0.0
+        sharing = sum(1 for other in live if other.page().renderProcessPid() == pid)
+        return process_cpu_time(pid) / max(1, sharing)
+
+    def on_current_changed(self, index):
+        live = self.live_views()
+        current = self.tabs.widget(index)
+        if self.previous in live and self.previous is not current:
+            self.hidden_since[self.previous] = (time.monotonic(), self.cpu_share(self.previous, live))
+        self.hidden_since.pop(current, None)
+        if current in self.frozen:
+            self.thaw(current, live)
+        self.previous = current
+
+    def track_download(self, download):
+        page = download.page() if hasattr(download, 'page') else None
+        if page is None:
+            return
+        self.downloads[page] = self.downloads.get(page, 0) + 1
+
+        def finished():
+            self.downloads[page] -= 1
+            if not self.downloads[page]:
+                del self.downloads[page]
+        download.finished.connect(finished)
+
+    def freeze_idle(self):
+        live = self.live_views()
+        for table in (self.hidden_since, self.frozen, self.cpu_saved):
+            for view in [v for v in table if v not in live]:
+                del table[view]
+        now = time.monotonic()
+        for view, (since, cpu) in list(self.hidden_since.items()):
+            page = view.page()
+            if now - since < self.grace or page.recentlyAudible() or page in self.downloads:
+                continue
+            cpu_now = self.cpu_share(view, live)
+            page.setLifecycleState(QWebEnginePage.LifecycleState.Frozen)
+            del self.hidden_since[view]
+            self.frozen[view] = (now, cpu_now, (cpu_now - cpu) / max(now - since, 1e-6))
+            log.info('froze tab %s after %.0fs hidden', view.url().toString(), now - since)
+
+    def thaw(self, view, live):
+        since, cpu, active_rate = self.frozen.pop(view)
+        view.page().setLifecycleState(QWebEnginePage.LifecycleState.Active)
+        elapsed = max(time.monotonic() - since, 1e-6)
+        frozen_rate = (self.cpu_share(view, live) - cpu) / elapsed
+        saved = max(0.0, (active_rate - frozen_rate) * elapsed)
+        self.cpu_saved[view] = self.cpu_saved.get(view, 0.0) + saved
+        log.info('thawed tab %s after %.0fs frozen: CPU %.1f%% hidden vs %.1f%% frozen, ~%.1fs CPU saved',
+                 view.url().toString(), elapsed, active_rate * 100, frozen_rate * 100, saved)
+
+    def report(self):
+        """Per live tab: URL, whether it is frozen and CPU seconds saved so far."""
+        return [
+            {'url': view.url().toString(), 'frozen': view in self.frozen, 'cpu_saved_s': self.cpu_saved.get(view, 0.0)}
+            for view in self.live_views()
+        ]
@@ -0,0 +1,141 @@
+"""Segmented downloads must reassemble the file exactly, however they are fetched.
+
+    python -m unittest discover tests
+
+A local HTTP server serves a pseudo-random file, with or without Range
+support. The tests check the downloaded file's hash after a segmented
+download, after pausing and resuming half way, from a server that ignores
+Range, and with a bandwidth limit below the read chunk size.
+"""
+import hashlib
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+from downloads import CHUNK_SIZE, MIN_SEGMENT, DownloadManager  # noqa: E402
+
+BODY = random.Random(0).randbytes(MIN_SEGMENT * 5 // 2)  # splits into two segments
+TIMEOUT_S = 60
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = self.server.body
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match and self.server.ranges:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(body) - 1
+            self.server.served.append((start, end))
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(body)}')
+            body = body[start:end + 1]
+        else:
+            self.server.served.append(None)
+            self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except ConnectionError:
+            pass  # a paused download closes its connections
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory(prefix='downloads-')
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'file.bin')
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+        self.server.body = BODY
+        self.server.ranges = True
+        self.server.served = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/file.bin'
+        self.finished = []
+        self.changed = threading.Event()
+
+    def manager(self, bandwidth=0):
+        def on_finished(download):
+            self.finished.append(download.state)
+            self.changed.set()
+        manager = DownloadManager(max_active=1, max_segments=4, bandwidth=bandwidth, on_finished=on_finished)
+        self.addCleanup(manager.close)
+        return manager
+
+    def wait(self):
+        self.assertTrue(self.changed.wait(TIMEOUT_S), 'download did not stop in time')
+        self.changed.clear()
+        return self.finished[-1]
+
+    def assertDownloaded(self, download):
+        self.assertEqual(download.state, 'finished', download.error)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(hashlib.sha256(f.read()).hexdigest(), hashlib.sha256(self.server.body).hexdigest())
+        self.assertFalse(os.path.exists(download.part_path))
+        self.assertFalse(os.path.exists(download.map_path))
+
+    def test_segmented(self):
+        download = self.manager().add(self.url, self.path)
+        self.wait()
+        self.assertDownloaded(download)
+        self.assertEqual(len(download.segments), 2)
+        self.assertEqual(sorted(self.server.served[1:]), [(0, MIN_SEGMENT * 5 // 4 - 1),
+                                                          (MIN_SEGMENT * 5 // 4, len(BODY) - 1)])
+
+    def test_pause_and_resume(self):
+        manager = self.manager(bandwidth=len(BODY) // 4)  # a quarter at once, then about three seconds
+        download = manager.add(self.url, self.path)
+        deadline = time.monotonic() + TIMEOUT_S
+        while download.received < len(BODY) // 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        download.cancel()
+        self.assertEqual(self.wait(), 'paused')
+        paused_at = [done for _, _, done in download.segments]
+        self.assertLess(sum(paused_at), len(BODY))
+        self.assertTrue(os.path.exists(download.map_path))
+
+        manager.resume(download)
+        self.wait()
+        self.assertDownloaded(download)
+        resumed = self.server.served[-len(download.segments):]
+        for (start, end, _), done, served in zip(sorted(download.segments), paused_at, sorted(resumed)):
+            self.assertEqual(served, (start + done, end))  # continued where the pause left it
+
+    def test_server_without_ranges(self):
+        self.server.ranges = False
+        download = self.manager().add(self.url, self.path)
+        self.wait()
+        self.assertDownloaded(download)
+        self.assertEqual(len(download.segments), 1)
+        self.assertEqual(self.server.served, [None, None])  # the probe, then one plain GET
+
+    def test_bandwidth_below_chunk_size(self):
+        self.server.body = BODY[:CHUNK_SIZE * 2]
+        rate = CHUNK_SIZE // 2
+        started = time.monotonic()
+        download = self.manager(bandwidth=rate).add(self.url, self.path)
+        self.wait()
+        self.assertDownloaded(download)
+        # The bucket starts full with one second's worth, the rest comes at rate
+        self.assertGreaterEqual(time.monotonic() - started, (len(self.server.body) - rate) / rate * 0.9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+"""Network filters must parse and match the way Adblock Plus lists expect.
+
+    python -m unittest discover tests
+
+The parser tests look at single Rules. The matcher tests compile a small
+list into a temporary cache directory and ask AdBlocker about requests,
+so they go through the same sharded index, Bloom filters and decision
+cache as the browser.
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+from adblock import AdBlocker  # noqa: E402
+from filterlist import (DEFAULT_TYPES, DOMAIN_ANCHOR, EXCEPTION, RESOURCE_TYPES, THIRD_PARTY,  # noqa: E402
+                        parse_filter)
+
+FILTERS = """\
+! network rules only; the element hiding rule is ignored
+||ads.example^
+||tracker.example^$third-party
+||foo.example^$domain=bar.com
+||widget.example^$domain=~safe.com
+||cdn.example/ads/
+/banner/*$image
+@@||ads.example/allowed/
+@@||cdn.example/ads/ok.js$domain=trusted.com
+@@/banner/keep$image
+example.com##.ad
+"""
+
+
+class ParseFilterTest(unittest.TestCase):
+    def test_domain_anchor(self):
+        rule = parse_filter('||cdn.example/ads/')
+        self.assertEqual((rule.key, rule.pattern), ('cdn.example', '/ads/'))
+        self.assertTrue(rule.flags & DOMAIN_ANCHOR)
+        self.assertFalse(rule.is_host_level)
+        self.assertTrue(parse_filter('||ads.example^').is_host_level)
+
+    def test_options(self):
+        rule = parse_filter('@@||tracker.example^$third-party,script,domain=a.com|~b.a.com')
+        self.assertTrue(rule.is_exception)
+        self.assertEqual(rule.flags & (EXCEPTION | THIRD_PARTY), EXCEPTION | THIRD_PARTY)
+        self.assertEqual(rule.types, RESOURCE_TYPES['script'])
+        self.assertEqual(rule.domains, 'a.com|~b.a.com')
+        self.assertFalse(rule.is_host_level)  # depends on the page
+        self.assertEqual(parse_filter('||x.example^$~image').types, DEFAULT_TYPES & ~RESOURCE_TYPES['image'])
+
+    def test_not_network_rules(self):
+        for line in ('', '! comment', '[Adblock Plus 2.0]', 'example.com##.ad', '||x.example^$popup', '*'):
+            self.assertIsNone(parse_filter(line), line)
+
+    def test_domain_option_applies_to(self):
+        include = parse_filter('||foo.example^$domain=bar.com')
+        self.assertTrue(include.applies_to(DEFAULT_TYPES, True, 'bar.com'))
+        self.assertTrue(include.applies_to(DEFAULT_TYPES, True, 'www.bar.com'))
+        self.assertFalse(include.applies_to(DEFAULT_TYPES, True, 'baz.com'))
+        self.assertFalse(include.applies_to(DEFAULT_TYPES, True, ''))
+        mixed = parse_filter('||foo.example^$domain=bar.com|~sub.bar.com')
+        self.assertTrue(mixed.applies_to(DEFAULT_TYPES, True, 'bar.com'))
+        self.assertFalse(mixed.applies_to(DEFAULT_TYPES, True, 'x.sub.bar.com'))
+
+
+class MatchTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory(prefix='filterlist-')
+        self.addCleanup(tmp.cleanup)
+        os.makedirs(os.path.join(tmp.name, 'filters'))
+        with open(os.path.join(tmp.name, 'filters', 'test.txt'), 'w') as f:
+            f.write(FILTERS)
+        self.blocker = AdBlocker(domains=(), filter_lists=os.path.join(tmp.name, 'filters', '*.txt'),
+                                 cache_dir=os.path.join(tmp.name, 'cache'))
+        self.addCleanup(lambda: [index.close() for index in self.blocker.rules.indexes])
+
+    def assertMatches(self, cases):
+        for url, resource_type, page, blocked in cases:
+            # Twice, so an answer served from the decision cache is checked too
+            for _ in range(2):
+                self.assertEqual(self.blocker.rules.match(url, resource_type, page), blocked, (url, resource_type, page))
+
+    def test_host_rules(self):
+        self.assertMatches([
+            ('https://ads.example/x.js', 'script', 'https://news.test/', True),
+            ('https://sub.ads.example/x.js', 'script', 'https://news.test/', True),
+            ('https://notads.example/x.js', 'script', 'https://news.test/', False),
+            ('https://ads.example/', 'document', None, False),  # not without $document
+        ])
+
+    def test_exception(self):
+        self.assertMatches([
+            ('https://ads.example/allowed/x.js', 'script', 'https://news.test/', False),
+            ('https://ads.example/other/x.js', 'script', 'https://news.test/', True),
+        ])
+
+    def test_third_party(self):
+        self.assertMatches([
+            ('https://tracker.example/t.gif', 'image', 'https://news.test/', True),
+            ('https://tracker.example/t.gif', 'image', 'https://www.tracker.example/', False),
+        ])
+
+    def test_domain_include(self):
+        self.assertMatches([
+            ('https://foo.example/x', 'script', 'https://bar.com/', True),
+            ('https://foo.example/x', 'script', 'https://www.bar.com/', True),
+            ('https://foo.example/x', 'script', 'https://other.com/', False),
+            ('https://foo.example/x', 'script', None, False),
+        ])
+
+    def test_domain_exclude(self):
+        self.assertMatches([
+            ('https://widget.example/w.js', 'script', 'https://news.test/', True),
+            ('https://widget.example/w.js', 'script', 'https://safe.com/', False),
+            ('https://widget.example/w.js', 'script', 'https://m.safe.com/', False),
+        ])
+
+    def test_path_rules(self):
+        self.assertMatches([
+            ('https://cdn.example/ads/a.js', 'script', 'https://news.test/', True),
+            ('https://cdn.example/lib/a.js', 'script', 'https://news.test/', False),
+            ('https://cdn.example/ads/ok.js', 'script', 'https://trusted.com/', False),  # excepted on trusted.com
+            ('https://cdn.example/ads/ok.js', 'script', 'https://news.test/', True),
+            ('https://img.test/banner/top.png', 'image', 'https://news.test/', True),
+            ('https://img.test/banner/top.png', 'script', 'https://news.test/', False),  # $image only
+            ('https://img.test/banner/keep.png', 'image', 'https://news.test/', False),
+            ('https://img.test/photos/top.png', 'image', 'https://news.test/', False),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
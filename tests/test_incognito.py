@@ -0,0 +1,163 @@
+"""An incognito window must not write a single file.
+
+    python -m unittest discover tests
+
+The browser runs in a child process with QT_QPA_PLATFORM=offscreen, inside
+a temporary working directory and HOME. The child records every write the
+Python side attempts (through an audit hook); the parent compares the file
+trees before and after, which also catches anything Chromium writes.
+"""
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+HAVE_WEBENGINE = importlib.util.find_spec('PyQt5') is not None and \
+    importlib.util.find_spec('PyQt5.QtWebEngineWidgets') is not None
+# Toolkit caches that Qt and Mesa fill on first use, whatever the browser does
+IGNORED = {'fontconfig', 'mesa_shader_cache'}
+TIMEOUT_S = 120
+
+PAGE = b"""<!doctype html>
+<title>incognito</title>
+<script>
+    document.cookie = 'visited=1; max-age=3600';
+    localStorage.setItem('visited', '1');
+</script>
+<div class="ad">ad</div>
+"""
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Cache-Control', 'max-age=3600')
+        self.send_header('Content-Length', str(len(PAGE)))
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def snapshot(root):
+    """Every file and directory under root with its size and modification time."""
+    tree = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in IGNORED]
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            tree[os.path.relpath(path, root)] = (st.st_size, st.st_mtime_ns)
+    return tree
+
+
+def record_writes():
+    """Collect every file write the interpreter attempts from now on."""
+    writes = []
+    write_flags = os.O_WRONLY | os.O_RDWR | os.O_CREAT | os.O_APPEND | os.O_TRUNC
+
+    def audit(event, args):
+        if event == 'open':
+            path, mode, flags = args
+            if isinstance(path, int) or str(path).startswith(('/dev/', '/proc/', '/sys/')):
+                return
+            if (mode and any(c in mode for c in 'wax+')) or (mode is None and flags & write_flags):
+                writes.append(['open', str(path)])
+        elif event in ('os.rename', 'os.remove', 'os.mkdir', 'os.rmdir', 'os.truncate', 'os.symlink', 'os.link'):
+            writes.append([event, str(args[0])])
+        elif event == 'sqlite3.connect' and 'mode=memory' not in str(args[0]) and args[0] != ':memory:':
+            writes.append([event, str(args[0])])
+    sys.addaudithook(audit)
+    return writes
+
+
+def wait_until(predicate, timeout=TIMEOUT_S):
+    from PyQt5.QtCore import QEventLoop, QTimer
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError('incognito window did not get there in time')
+        loop = QEventLoop()
+        QTimer.singleShot(20, loop.quit)
+        loop.exec_()
+
+
+def run_child(workdir):
+    """Child process: browse in an incognito window, then print the writes seen as JSON."""
+    os.chdir(workdir)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://localhost:{server.server_address[1]}/'
+    writes = record_writes()
+
+    from PyQt5.QtCore import QUrl
+    from PyQt5.QtWidgets import QApplication
+    import v5
+
+    app = QApplication([sys.argv[0]])
+    QApplication.setApplicationName('Custom Browser')
+    window = v5.Browser(incognito=True)
+    window.open_urls([url])
+    window.show()
+    wait_until(lambda: window.profile is not None)
+    loads = []
+    window.create_new_tab(QUrl(url + 'second'), 'Second')
+    window.tabs.currentWidget().loadFinished.connect(loads.append)
+    wait_until(lambda: loads)
+
+    # Everything that writes to disk in a normal window
+    window.bookmarks.add('Incognito page', url)
+    window.history.record_visit(url + 'third')
+    window.history.flush()
+    window.save_session()
+    window.reload_filters()
+    window.block_log.flush()
+    window.close()
+    app.processEvents()
+    app.quit()
+    print(json.dumps({'loaded': loads, 'python_writes': writes}))
+
+
+@unittest.skipUnless(HAVE_WEBENGINE, 'PyQt5.QtWebEngineWidgets is not installed')
+class IncognitoWritesTest(unittest.TestCase):
+    def test_incognito_session_writes_no_files(self):
+        with tempfile.TemporaryDirectory(prefix='incognito-') as tmp:
+            workdir = os.path.join(tmp, 'work')
+            home = os.path.join(tmp, 'home')
+            os.makedirs(os.path.join(workdir, 'filters'))
+            os.makedirs(home)
+            # Uncompiled on purpose: a normal window would compile it into adblock_cache/
+            with open(os.path.join(workdir, 'filters', 'test.txt'), 'w') as f:
+                f.write('||ads.example^\n##.ad\n')
+            env = dict(os.environ, HOME=home, XDG_DATA_HOME=os.path.join(home, '.local', 'share'),
+                       XDG_CACHE_HOME=os.path.join(home, '.cache'), XDG_CONFIG_HOME=os.path.join(home, '.config'),
+                       QT_QPA_PLATFORM='offscreen', PYTHONDONTWRITEBYTECODE='1',
+                       PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])))
+            if hasattr(os, 'geteuid') and os.geteuid() == 0:
+                env.setdefault('QTWEBENGINE_DISABLE_SANDBOX', '1')  # Chromium refuses to sandbox as root
+            before = snapshot(tmp)
+
+            child = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', workdir], env=env,
+                                   stdout=subprocess.PIPE, timeout=TIMEOUT_S * 2, check=True, text=True)
+            report = json.loads(child.stdout.strip().splitlines()[-1])
+
+            self.assertEqual(report['loaded'], [True])
+            self.assertEqual(report['python_writes'], [])
+            self.assertEqual(snapshot(tmp), before)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--child':
+        run_child(sys.argv[2])
+    else:
+        unittest.main()
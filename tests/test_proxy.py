@@ -0,0 +1,182 @@
+"""The caching proxy must follow RFC 9111 and keep its pooled connections safe.
+
+    python -m unittest discover tests
+
+A CachingProxy with a cache in a temporary directory forwards requests to
+a local HTTP/1.1 server that counts what reaches it. The tests check a
+fresh hit with Age, ETag revalidation, responses that must not be
+stored, and that a request sent on a pooled connection the server has
+dropped is retried only when it is idempotent. The HttpCache tests fill
+a small cache directly and check which responses are evicted.
+"""
+import http.client
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+from httpcache import CacheEntry, HttpCache  # noqa: E402
+from proxy import CachingProxy  # noqa: E402
+
+BODY = b'cacheable body\n'
+TIMEOUT_S = 10
+HEADERS = {
+    '/fresh': [('Cache-Control', 'max-age=3600')],
+    '/etag': [('Cache-Control', 'no-cache'), ('ETag', '"v1"')],
+    '/no-store': [('Cache-Control', 'no-store, max-age=3600')],
+    '/cookie': [('Cache-Control', 'max-age=3600'), ('Set-Cookie', 'session=1')],
+    '/page': [],
+}
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so the proxy pools its connections
+
+    def setup(self):
+        super(OriginHandler, self).setup()
+        self.served = 0  # requests seen on this connection
+
+    def respond(self):
+        server = self.server
+        server.hits[(self.command, self.path)] += 1
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.served += 1
+        if server.drop_reused and self.served > 1:
+            # As if the keep-alive timeout struck just as the request arrived
+            self.close_connection = True
+            return
+        if self.path == '/etag' and self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('ETag', '"v1"')
+            self.end_headers()
+            return
+        body = body or BODY
+        self.send_response(200)
+        for name, value in HEADERS.get(self.path, []):
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CachingProxyTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory(prefix='proxy-')
+        self.addCleanup(tmp.cleanup)
+        self.origin = ThreadingHTTPServer(('127.0.0.1', 0), OriginHandler)
+        self.origin.hits = Counter()
+        self.origin.drop_reused = False
+        self.origin.daemon_threads = True
+        threading.Thread(target=self.origin.serve_forever, daemon=True).start()
+        self.addCleanup(self.origin.server_close)
+        self.addCleanup(self.origin.shutdown)
+        self.proxy = CachingProxy(cache_dir=os.path.join(tmp.name, 'cache'))
+        self.proxy.start()
+        self.addCleanup(self.proxy.close)
+        self.base = f'http://127.0.0.1:{self.origin.server_address[1]}'
+
+    def fetch(self, path, method='GET', body=None):
+        """(status, headers, body) of one request through the proxy, on a new client connection."""
+        conn = http.client.HTTPConnection('127.0.0.1', self.proxy.port, timeout=TIMEOUT_S)
+        try:
+            conn.request(method, self.base + path, body=body)
+            response = conn.getresponse()
+            return response.status, dict(response.getheaders()), response.read()
+        finally:
+            conn.close()
+
+    def wait_stored(self, count):
+        """Wait for the proxy to finish storing, which it does after answering the client."""
+        deadline = time.monotonic() + TIMEOUT_S
+        while len(self.proxy.cache.lru) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.proxy.cache.lru), count)
+
+    def test_fresh_hit_has_age(self):
+        self.assertEqual(self.fetch('/fresh')[0], 200)
+        self.wait_stored(1)
+        status, headers, body = self.fetch('/fresh')
+        self.assertEqual((status, body), (200, BODY))
+        self.assertIn('Age', headers)
+        self.assertEqual(self.origin.hits[('GET', '/fresh')], 1)
+        self.assertEqual(self.proxy.stats['hits'], 1)
+
+    def test_etag_revalidation(self):
+        self.fetch('/etag')
+        self.wait_stored(1)
+        status, headers, body = self.fetch('/etag')
+        self.assertEqual((status, body), (200, BODY))  # the client sent no validator, so it gets the body
+        self.assertEqual(self.origin.hits[('GET', '/etag')], 2)
+        self.assertEqual(self.proxy.stats['revalidated'], 1)
+
+    def test_not_stored(self):
+        for path in ('/no-store', '/cookie'):
+            self.fetch(path)
+            self.assertEqual(self.fetch(path)[2], BODY)
+            self.assertEqual(self.origin.hits[('GET', path)], 2, path)
+        self.assertEqual(len(self.proxy.cache.lru), 0)
+
+    def test_idempotent_request_retried_on_stale_connection(self):
+        self.fetch('/page')  # leaves a pooled connection
+        self.origin.drop_reused = True
+        status, _, body = self.fetch('/page')
+        self.assertEqual((status, body), (200, BODY))
+        self.assertEqual(self.origin.hits[('GET', '/page')], 3)  # first, dropped, retried
+
+    def test_post_not_retried_on_stale_connection(self):
+        self.fetch('/page')
+        self.origin.drop_reused = True
+        status, _, _ = self.fetch('/page', 'POST', b'order=1')
+        self.assertEqual(status, 502)
+        self.assertEqual(self.origin.hits[('POST', '/page')], 1)  # never sent twice
+
+
+class HttpCacheTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory(prefix='httpcache-')
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.body = b'x' * 1000
+
+    def store(self, cache, url):
+        cache.store(CacheEntry(url, 200, 'OK', [('Cache-Control', 'max-age=3600')]), self.body)
+
+    def test_evicts_least_recently_used(self):
+        cache = HttpCache(self.dir, max_bytes=3000)
+        cache.load()
+        self.store(cache, 'http://a.test/')
+        self.store(cache, 'http://b.test/')
+        self.assertIsNotNone(cache.lookup('http://a.test/', []))  # now b is the oldest
+        self.store(cache, 'http://c.test/')
+        self.assertLessEqual(cache.total, cache.max_bytes)
+        self.assertIsNone(cache.lookup('http://b.test/', []))
+        for url in ('http://a.test/', 'http://c.test/'):
+            self.assertEqual(cache.read_body(cache.lookup(url, [])), self.body)
+        self.assertEqual(len(os.listdir(self.dir)), 4)  # .json and .body of a and c
+
+    def test_load_keeps_order_and_limit(self):
+        cache = HttpCache(self.dir, max_bytes=10 ** 6)
+        cache.load()
+        for url in ('http://a.test/', 'http://b.test/', 'http://c.test/'):
+            self.store(cache, url)
+            time.sleep(0.01)  # distinct mtimes
+        reloaded = HttpCache(self.dir, max_bytes=cache.total - 1)
+        reloaded.load()
+        self.assertIsNone(reloaded.lookup('http://a.test/', []))
+        self.assertEqual(len(reloaded.lru), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
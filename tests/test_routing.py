@@ -0,0 +1,106 @@
+"""Per-site routing rules must pick the most specific route for each host.
+
+    python -m unittest discover tests
+
+Each table lists (host, expected route name) for one RouteTable, so the
+precedence between suffix rules, "*" and the default is spelled out case
+by case.
+"""
+import os
+import sys
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+from routing import RouteTable, parse_route  # noqa: E402
+
+ROUTES = {'tor': 'socks5://127.0.0.1:9050', 'work': 'http://proxy.corp.test:3128'}
+
+
+class RouteForTest(unittest.TestCase):
+    def assertRoutes(self, table, cases):
+        for host, name in cases:
+            self.assertEqual(table.route_for(host).name, name, host)
+
+    def test_suffix_rules(self):
+        table = RouteTable(ROUTES, {'onion': 'tor', 'corp.test': 'work', 'public.corp.test': 'direct'})
+        self.assertRoutes(table, [
+            ('abc.onion', 'tor'),
+            ('a.b.onion', 'tor'),
+            ('onion', 'tor'),
+            ('corp.test', 'work'),
+            ('wiki.corp.test', 'work'),
+            ('public.corp.test', 'direct'),  # the most specific rule wins
+            ('www.public.corp.test', 'direct'),
+            ('notcorp.test', 'direct'),  # whole labels only
+            ('example.com', 'direct'),
+            ('', 'direct'),
+            (None, 'direct'),
+        ])
+
+    def test_case_and_trailing_dot(self):
+        table = RouteTable(ROUTES, {'*.Corp.Test.': 'work'})
+        self.assertRoutes(table, [
+            ('WIKI.corp.test', 'work'),
+            ('wiki.corp.test.', 'work'),
+            ('corp.test', 'work'),
+            ('example.com', 'direct'),
+        ])
+
+    def test_default(self):
+        self.assertRoutes(RouteTable(ROUTES, {'corp.test': 'direct'}, default='tor'), [
+            ('example.com', 'tor'),
+            ('corp.test', 'direct'),
+        ])
+        # A default given as a proxy URL rather than a route name
+        table = RouteTable(ROUTES, {}, default='socks5://127.0.0.1:1080')
+        self.assertEqual((table.default.kind, table.default.address), ('socks5', ('127.0.0.1', 1080)))
+        self.assertRoutes(table, [('example.com', 'default')])
+
+    def test_star_overrides_default(self):
+        table = RouteTable(ROUTES, {'*': 'tor', 'corp.test': 'work'}, default='direct')
+        self.assertRoutes(table, [
+            ('example.com', 'tor'),
+            ('wiki.corp.test', 'work'),
+        ])
+
+    def test_unknown_route(self):
+        with self.assertRaises(ValueError):
+            RouteTable(ROUTES, {'example.com': 'vpn'})
+
+    def test_all_direct(self):
+        cases = [
+            (RouteTable(), True),
+            (RouteTable(ROUTES, {}), True),  # routes nothing uses don't count
+            (RouteTable(ROUTES, {'example.com': 'direct'}), True),
+            (RouteTable(ROUTES, {'onion': 'tor'}), False),
+            (RouteTable(ROUTES, {}, default='work'), False),
+            (RouteTable(ROUTES, {'*': 'tor'}), False),
+        ]
+        for table, expected in cases:
+            self.assertEqual(table.all_direct, expected, table.suffixes)
+
+
+class ParseRouteTest(unittest.TestCase):
+    def test_valid(self):
+        cases = [
+            ('direct', ('direct', None)),
+            ('', ('direct', None)),
+            (None, ('direct', None)),
+            ('socks5://127.0.0.1:9050', ('socks5', ('127.0.0.1', 9050))),
+            ('socks5h://tor.local:9050', ('socks5', ('tor.local', 9050))),
+            ('http://proxy.test:3128', ('http', ('proxy.test', 3128))),
+            ('127.0.0.1:9050', ('socks5', ('127.0.0.1', 9050))),  # no scheme means SOCKS5
+        ]
+        for url, expected in cases:
+            self.assertEqual(parse_route(url), expected, url)
+
+    def test_invalid(self):
+        for url in ('https://proxy.test:3128', 'socks4://127.0.0.1:1080', 'socks5://127.0.0.1', 'http://:3128'):
+            with self.assertRaises(ValueError, msg=url):
+                parse_route(url)
+
+
+if __name__ == '__main__':
+    unittest.main()
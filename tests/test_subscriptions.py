@@ -0,0 +1,96 @@
+"""A subscription keeps its last good list until the server sends a new one.
+
+    python -m unittest discover tests
+
+Each test serves a filter list from a local HTTP server whose next
+responses are scripted: a 200 replaces the stored list, a 304 answers the
+ETag sent with the request and keeps it, and a server error keeps it too.
+A list counts as changed when its network or element hiding rules do.
+"""
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+from subscriptions import SubscriptionUpdater, list_path_for  # noqa: E402
+
+OLD_LIST = b'! old\n||ads.example^\n'
+NEW_LIST = b'! new\n||ads.example^\n||tracker.example^\n'
+
+
+class ListHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        status, body = server.responses.pop(0)
+        self.send_response(status)
+        if status == 200:
+            self.send_header('ETag', f'"{len(server.requests)}"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SubscriptionRefreshTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory(prefix='subscriptions-')
+        self.addCleanup(tmp.cleanup)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ListHandler)
+        self.server.responses = [(200, OLD_LIST)]
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/list.txt'
+        self.filters_dir = os.path.join(tmp.name, 'filters')
+        self.updater = SubscriptionUpdater([self.url], filters_dir=self.filters_dir,
+                                           state_path=os.path.join(tmp.name, 'subscriptions.json'))
+        self.path = list_path_for(self.url, self.filters_dir)
+        self.assertTrue(self.updater.refresh(self.url))  # the first fetch stores OLD_LIST
+
+    def stored(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_changed_list_is_stored(self):
+        self.server.responses.append((200, NEW_LIST))
+        self.assertTrue(self.updater.refresh(self.url))
+        self.assertEqual(self.stored(), NEW_LIST)
+        self.assertEqual(self.updater.state[self.url]['etag'], '"2"')
+
+    def test_changed_cosmetic_rules_are_stored(self):
+        cosmetic = OLD_LIST + b'example.com##.old-ad\n'
+        self.server.responses += [(200, cosmetic), (200, cosmetic.replace(b'.old-ad', b'.new-ad'))]
+        self.assertTrue(self.updater.refresh(self.url))
+        self.assertTrue(self.updater.refresh(self.url))
+        self.assertIn(b'example.com##.new-ad', self.stored())
+
+    def test_unchanged_rules_keep_file(self):
+        self.server.responses.append((200, b'! comments only differ\n' + OLD_LIST))
+        self.assertFalse(self.updater.refresh(self.url))
+        self.assertEqual(self.stored(), OLD_LIST)
+
+    def test_not_modified_keeps_list(self):
+        self.server.responses.append((304, b''))
+        self.assertFalse(self.updater.refresh(self.url))
+        self.assertEqual(self.server.requests[-1].get('If-None-Match'), '"1"')
+        self.assertEqual(self.stored(), OLD_LIST)
+
+    def test_error_keeps_list(self):
+        self.server.responses.append((500, b'oops'))
+        self.assertFalse(self.updater.refresh(self.url))
+        self.assertEqual(self.stored(), OLD_LIST)
+        self.assertEqual(self.updater.state[self.url]['etag'], '"1"')
+        self.assertEqual(os.listdir(self.filters_dir), [os.path.basename(self.path)])
+
+
+if __name__ == '__main__':
+    unittest.main()
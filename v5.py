@@ -1,28 +1,198 @@
+import time
+STARTED = time.perf_counter()  # before the Qt imports, for --profile-startup
+
+import os
 import sys
-import json
-from PyQt5.QtCore import *
-from PyQt5.QtWidgets import *
-from PyQt5.QtWebEngineWidgets import QWebEngineView, QWebEngineProfile
-from PyQt5.QtGui import QPalette, QColor, QIcon
 
-class AdBlocker:
-    def __init__(self):
-        self.blocked_domains = set([
-            "doubleclick.net", "adservice.google.com", "googlesyndication.com",
-            "ads.yahoo.com", "adnxs.com", "adsfacebook.com"
-        ])
+# Only QtCore and QtNetwork, so a second launch can hand off before the QtWebEngine imports below
+from single_instance import InstanceServer, send_to_running_instance
+from startup import PROFILE_FLAG, StartupProfiler
+
+INCOGNITO_FLAG = '--incognito'
+CLEAR_CACHE_FLAG = '--clear-cache'
+
+
+def launch_arguments(argv):
+    """The URLs and the commands for a running instance given on a command line."""
+    args = argv[1:]
+    urls = [arg for arg in args if not arg.startswith('-')]
+    return urls, [CLEAR_CACHE_FLAG] if CLEAR_CACHE_FLAG in args else []
+
+
+if __name__ == "__main__" and INCOGNITO_FLAG not in sys.argv:
+    # A browser is already running: let it open the URLs instead of starting another Chromium
+    launch_urls, launch_commands = launch_arguments(sys.argv)
+    if send_to_running_instance(launch_urls, commands=launch_commands):
+        sys.exit(0)
+
+import glob
+import itertools
+import logging
+import threading
+from PyQt5.QtCore import QDir, QFileSystemWatcher, QStandardPaths, Qt, QTimer, QUrl, pyqtSignal
+from PyQt5.QtWidgets import (QAction, QApplication, QDialog, QFileDialog, QHeaderView, QInputDialog, QLabel, QLineEdit,
+                             QListView, QListWidget, QMainWindow, QMessageBox, QPushButton, QTableWidget,
+                             QTableWidgetItem, QTabWidget, QToolBar, QVBoxLayout)
+from PyQt5.QtWebEngineCore import QWebEngineUrlRequestInterceptor, QWebEngineUrlRequestInfo
+from PyQt5.QtWebEngineWidgets import QWebEnginePage, QWebEngineView, QWebEngineProfile, QWebEngineScript
+from PyQt5.QtGui import QPalette, QColor, QIcon
+from PyQt5.QtNetwork import QNetworkProxy
+
+from adblock import AdBlocker
+from blocklog import BLOCK_LOG, BlockLog
+from cosmetic import page_script
+from downloads import CookieJar, DownloadManager, download_path
+from omnibox import OmniboxCompleter
+from profile_models import BookmarkModel, HistoryModel, connect_filter
+from profile_store import MEMORY_PROFILE, ProfileStore
+from proxy import PRIVATE_HEADER, CachingProxy
+from routing import RouteTable
+from settings import load_settings
+from subscriptions import SubscriptionUpdater
+from tabs import TabFreezer, TabMemoryManager, TabStub, build_view, replace_tab, tab_state
+from waterfall import WaterfallCapture
+from webprofile import cache_usage, configure_profile
+
+INCOGNITO_CACHE_BYTES = 64 * 2**20  # memory cache of each off-the-record profile
+COSMETIC_SCRIPT = 'cosmetic'
+
+# Qt resource types mapped to the names used in filter list options
+RESOURCE_TYPE_NAMES = {
+    getattr(QWebEngineUrlRequestInfo, qt_name): name
+    for qt_name, name in (
+        ("ResourceTypeMainFrame", "document"), ("ResourceTypeSubFrame", "subdocument"),
+        ("ResourceTypeStylesheet", "stylesheet"), ("ResourceTypeScript", "script"),
+        ("ResourceTypeImage", "image"), ("ResourceTypeFontResource", "font"),
+        ("ResourceTypeSubResource", "other"), ("ResourceTypeObject", "object"),
+        ("ResourceTypeMedia", "media"), ("ResourceTypeWorker", "script"),
+        ("ResourceTypeSharedWorker", "script"), ("ResourceTypePrefetch", "other"),
+        ("ResourceTypeFavicon", "image"), ("ResourceTypeXhr", "xmlhttprequest"),
+        ("ResourceTypePing", "ping"), ("ResourceTypeServiceWorker", "script"),
+        ("ResourceTypeCspReport", "other"), ("ResourceTypePluginResource", "object"),
+    )
+    if hasattr(QWebEngineUrlRequestInfo, qt_name)
+}
+
+
+class AdBlockInterceptor(QWebEngineUrlRequestInterceptor):
+    """Blocks requests on Qt's IO thread.
+
+    interceptRequest never takes a lock: it reads the ad blocker's current
+    rule snapshot once, and reloads replace that snapshot wholesale. For
+    private profiles it also marks http:// requests so the local proxy
+    doesn't add them to its disk cache.
+    """
+
+    def __init__(self, ad_blocker, parent=None, private=False):
+        super(AdBlockInterceptor, self).__init__(parent)
+        self.ad_blocker = ad_blocker
+        self.private = private
+
+    def interceptRequest(self, info):
+        url = info.requestUrl().toString()
+        resource_type = RESOURCE_TYPE_NAMES.get(info.resourceType())
+        if self.ad_blocker.intercept_request(url, resource_type, info.firstPartyUrl().toString()):
+            info.block(True)
+        elif self.private and url.startswith('http:'):
+            info.setHttpHeader(PRIVATE_HEADER.encode('ascii'), b'1')
+
+
+class FilteredPage(QWebEnginePage):
+    """A page that gets the element hiding stylesheet of each site it navigates to.
+
+    The stylesheet is looked up in the ad blocker's cosmetic index when a
+    main-frame navigation is requested, and set as a page script before the
+    new document is created. Only the page's own host is rendered, so the
+    cost doesn't grow with the number of domains the lists name.
+
+    Each main-frame navigation also opens a new block_key in the block log,
+    so the page's blocked-request count starts from zero. Blocking itself
+    stays in the profile's interceptor on Qt's IO thread; the block log
+    finds the page from each blocked request's first-party host.
+    """
+    block_keys = itertools.count(1)
+
+    def __init__(self, profile, parent, ad_blocker):
+        super(FilteredPage, self).__init__(profile, parent)
+        self.ad_blocker = ad_blocker
+        self.cosmetic_host = None
+        self.block_log = ad_blocker.block_log
+        self.block_key = None
+        if self.block_log is not None:
+            # The wrapper may be gone by the time destroyed is emitted, so only the key is captured
+            current_key = self.current_block_key = [None]
+            block_log = self.block_log
+            self.destroyed.connect(lambda: block_log.forget_page(current_key[0]))
+        self.urlChanged.connect(self.on_url_changed)
+
+    def on_url_changed(self, url):
+        self.install_cosmetic_filters(url.host())  # e.g. restored history
+        if self.block_log is None:
+            return
+        if self.block_key is None:
+            self.start_block_count(url.host())
+        else:
+            self.block_log.open_page(self.block_key, url.host())  # redirected, or a same-document change
+
+    def start_block_count(self, host):
+        """Count blocked requests from zero under a new key; the old key's counts are dropped."""
+        old, self.block_key = self.block_key, next(self.block_keys)
+        self.current_block_key[0] = self.block_key
+        self.block_log.open_page(self.block_key, host)
+        if old is not None:
+            self.block_log.forget_page(old)
+
+    def acceptNavigationRequest(self, url, navigation_type, is_main_frame):
+        accepted = super(FilteredPage, self).acceptNavigationRequest(url, navigation_type, is_main_frame)
+        if is_main_frame and accepted:
+            self.install_cosmetic_filters(url.host())
+            if self.block_log is not None:
+                self.start_block_count(url.host())
+        return accepted
+
+    def install_cosmetic_filters(self, host, force=False):
+        if host == self.cosmetic_host and not force:
+            return
+        self.cosmetic_host = host
+        scripts = self.scripts()
+        for script in scripts.findScripts(COSMETIC_SCRIPT):
+            scripts.remove(script)
+        source = page_script(self.ad_blocker.cosmetic, host)
+        if source is None:
+            return
+        script = QWebEngineScript()
+        script.setName(COSMETIC_SCRIPT)
+        script.setSourceCode(source)
+        script.setInjectionPoint(QWebEngineScript.DocumentCreation)
+        # Main world: a stylesheet adopted from an isolated world may not apply to the page
+        script.setWorldId(QWebEngineScript.MainWorld)
+        script.setRunsOnSubFrames(True)
+        scripts.insert(script)
+
+
+def incognito_profile(parent=None):
+    """An off-the-record profile: cookies, storage and a capped HTTP cache kept in memory only."""
+    profile = QWebEngineProfile(parent)  # no storage name, so off the record
+    profile.setHttpCacheType(QWebEngineProfile.MemoryHttpCache)
+    profile.setHttpCacheMaximumSize(INCOGNITO_CACHE_BYTES)
+    profile.setPersistentCookiesPolicy(QWebEngineProfile.NoPersistentCookies)
+    return profile
 
-    def intercept_request(self, url):
-        for domain in self.blocked_domains:
-            if domain in url:
-                print(f'Blocked ad: {url}')
-                return True  # Indicates the request should be blocked
-        return False  # Indicates the request can proceed
 
 class Browser(QMainWindow):
-    def __init__(self, incognito=False):
+    filters_reloaded = pyqtSignal()
+    subscriptions_updated = pyqtSignal(list)
+    download_changed = pyqtSignal(object)
+
+    def __init__(self, incognito=False, profiler=None, opener=None):
         super(Browser, self).__init__()
+        # An incognito window never writes a file: its web profile, history, bookmarks and
+        # block log live in memory, and the ad blocker only reads already compiled lists
         self.incognito = incognito
+        self.opener = opener  # the window this one was opened from; its proxy is shared
+        self.profiler = profiler or StartupProfiler(False)
+        self.profile = None  # opened by finish_startup
+        self.pending_urls = []
         self.tabs = QTabWidget()
         self.tabs.setDocumentMode(True)
         self.tabs.setTabsClosable(True)
@@ -30,43 +200,283 @@ class Browser(QMainWindow):
         self.tabs.tabBarDoubleClicked.connect(self.open_new_tab)
         self.setCentralWidget(self.tabs)
 
-        self.history = self.load_history()
-        self.bookmarks = self.load_bookmarks()
-
-        self.create_new_tab(QUrl("https://duckduckgo.com"), "Home")
-        self.showMaximized()
-        self.setWindowTitle('Custom Browser')
-
         self.create_navigation_bar()
         self.create_shortcuts()
         self.setup_styles()
-
-        # Set up ad blocker
-        self.ad_blocker = AdBlocker()
-        profile = QWebEngineProfile.defaultProfile()
-        profile.setRequestInterceptor(self)
-
-    def load_bookmarks(self):
+        self.tabs.currentChanged.connect(self.activate_tab)
+        self.tabs.currentChanged.connect(self.update_url_bar)
+        # Nothing to navigate until finish_startup has opened the profile and the first tab
+        self.nav_bar.setEnabled(False)
+        for action in self.actions():
+            action.setEnabled(False)
+
+        # The interceptor is in place before any page exists; it starts with the
+        # built-in domains and gets the filter lists in finish_startup
+        self.block_log = BlockLog(None if incognito else BLOCK_LOG)
+        self.ad_blocker = AdBlocker(load=False, block_log=self.block_log, read_only=incognito)
+        self.interceptor = AdBlockInterceptor(self.ad_blocker, self, private=incognito)
+        self.settings = load_settings()
+        if opener is not None:
+            self.routes, self.proxy = opener.routes, opener.proxy
+        else:
+            try:
+                self.routes = RouteTable(self.settings['proxy_routes'], self.settings['proxy_route_rules'],
+                                         self.settings['proxy_upstream'] or 'direct')
+            except ValueError as e:
+                logging.getLogger('proxy').warning('ignoring proxy routes: %s', e)
+                self.routes = RouteTable()
+            # Chromium reads the application proxy when the profile is created, so this comes first.
+            # Only the proxy can route per site, so routes turn it on too.
+            self.proxy = None
+            if self.settings['proxy_enabled'] or not self.routes.all_direct:
+                self.proxy = self.start_proxy()
+        self.route_profiles = {}  # route name -> QWebEngineProfile, created on first use
+        profile = self.web_profile = incognito_profile(self) if incognito else QWebEngineProfile.defaultProfile()
+        if not incognito:
+            self.configure_web_profile(profile)
+        profile.setRequestInterceptor(self.interceptor)
+
+        # Discard least recently used background tabs when renderers exceed the memory budget
+        self.tab_memory = TabMemoryManager(self.tabs, self.settings['tab_memory_budget_mb'],
+                                           self.settings['tab_memory_check_interval_s'], self)
+        # Freeze background tabs (timers, animations, JS) once they have been hidden for a while
+        self.tab_freezer = TabFreezer(self.tabs, self.settings['tab_freeze_grace_s'], self)
+        profile.downloadRequested.connect(self.tab_freezer.track_download)
+
+        # Large downloads are taken over by a segmented downloader sharing one bandwidth budget
+        self.downloads = DownloadManager(self.settings['download_max_active'], self.settings['download_segments'],
+                                         self.settings['download_bandwidth_kbps'] * 1024,
+                                         on_finished=self.download_changed.emit,
+                                         proxy_url=self.proxy.url if self.proxy is not None else None)
+        self.download_changed.connect(self.show_download_state)
+        self.cookie_jar = CookieJar()  # lets taken-over downloads send the page's cookies
+        profile.cookieStore().cookieAdded.connect(
+            lambda c: self.cookie_jar.set(c.domain(), c.path(), bytes(c.name()).decode(), bytes(c.value()).decode(), c.isSecure()))
+        profile.cookieStore().cookieRemoved.connect(
+            lambda c: self.cookie_jar.remove(c.domain(), c.path(), bytes(c.name()).decode()))
+        profile.cookieStore().loadAllCookies()
+        profile.downloadRequested.connect(self.on_download_requested)
+
+        # Per-tab request waterfall, off until toggled from the keyboard
+        self.waterfall = WaterfallCapture(RESOURCE_TYPE_NAMES, parent=self)
+
+        self.setWindowTitle('Custom Browser (Incognito)' if incognito else 'Custom Browser')
+        # Paint the empty window first, then do the slow part
+        self.profiler.watch_first_paint(self, lambda: QTimer.singleShot(0, self.finish_startup))
+        QTimer.singleShot(1000, self.finish_startup)  # in case the window is never exposed
+        self.profiler.mark('window built')
+
+    def finish_startup(self):
+        """Load everything the first paint doesn't need, then open the first tab."""
+        if self.profile is not None:
+            return
+        # Filter lists are memory-mapped from adblock_cache/ (compiled on first use)
+        # before any page is created, so the first page load is filtered too
+        self.ad_blocker.reload()
+        self.filters_reloaded.connect(self.install_cosmetic_filters)
+        self.filter_watcher = QFileSystemWatcher(self)
+        if self.opener is not None:
+            # Read the lists again once the opener has recompiled them
+            self.opener.filters_reloaded.connect(self.reload_filters)
+        else:
+            self.watch_filters()
+            self.filter_watcher.directoryChanged.connect(self.reload_filters)
+            self.filter_watcher.fileChanged.connect(self.reload_filters)
+        # Subscribed lists are downloaded into filters/ and trigger a reload when their rules change
+        self.subscriptions = SubscriptionUpdater([] if self.incognito else self.settings['filter_subscriptions'],
+                                                 self.settings['filter_update_interval_h'] * 3600,
+                                                 on_updated=self.subscriptions_updated.emit,
+                                                 proxy_url=self.proxy.url if self.proxy is not None else None)
+        self.subscriptions_updated.connect(self.reload_filters)
+        self.subscriptions.start()
+        self.profiler.mark('ad-block rules')
+
+        # History, bookmarks and session state all live in profile.db
+        self.profile = ProfileStore(MEMORY_PROFILE) if self.incognito else ProfileStore()
+        self.history = self.profile.history
+        self.bookmarks = self.profile.bookmarks
+        # Frecency-ranked suggestions from history and bookmarks
+        self.omnibox = OmniboxCompleter(self.url_bar, self.profile, self)
+        self.omnibox.url_chosen.connect(lambda url: self.navigate_to_url())
+        self.profiler.mark('profile')
+
+        self.load_icons()
+        self.profiler.mark('icons')
+
+        # Restored tabs are placeholders until selected; only the current one gets a renderer
+        self.restoring = False
+        if (self.incognito or not self.restore_session()) and not self.pending_urls:
+            self.create_new_tab(QUrl("https://duckduckgo.com"), "Home")
+        if self.pending_urls:
+            self.open_urls(self.pending_urls)
+            self.pending_urls = []
+        self.nav_bar.setEnabled(True)
+        for action in self.actions():
+            action.setEnabled(True)
+        self.profiler.watch_first_load(self.tabs.currentWidget())
+        self.profiler.mark('first tab created')
+
+        if not self.incognito:
+            self.session_timer = QTimer(self)
+            self.session_timer.timeout.connect(self.save_session)
+            self.session_timer.start(30000)
+            self.downloads.resume_interrupted(self.download_dir(), self.download_headers())
+
+    def start_proxy(self):
+        """Send all page traffic through a local CachingProxy; returns None if it can't start."""
+        try:
+            proxy = CachingProxy(cache_max_bytes=self.settings['proxy_cache_mb'] * 2**20, routes=self.routes,
+                                 ad_blocker=self.ad_blocker, read_only_cache=self.incognito)
+            port = proxy.start()
+        except OSError as e:
+            logging.getLogger('proxy').warning('not using the local proxy: %s', e)
+            return None
+        QNetworkProxy.setApplicationProxy(QNetworkProxy(QNetworkProxy.HttpProxy, '127.0.0.1', port))
+        QApplication.instance().aboutToQuit.connect(proxy.close)  # incognito windows may outlive this one
+        return proxy
+
+    def profile_for(self, url):
+        """The web profile for url's route, so each proxied route keeps its own cookies and storage.
+
+        Requests are routed by host in the proxy whatever profile they come
+        from; the profile only keeps sessions apart. Direct sites, and all
+        sites when the proxy isn't running, use the window's main profile.
+        """
+        route = self.routes.route_for(QUrl(url).host())
+        if self.proxy is None or route.kind == 'direct':
+            return self.web_profile
+        profile = self.route_profiles.get(route.name)
+        if profile is None:
+            if self.incognito:
+                profile = incognito_profile(self)
+            else:
+                profile = QWebEngineProfile('route-' + route.name, self)
+                self.configure_web_profile(profile, paths=False)  # keeps its own storage per route
+            self.route_profiles[route.name] = profile
+            profile.setRequestInterceptor(self.interceptor)
+            profile.downloadRequested.connect(self.tab_freezer.track_download)
+            profile.downloadRequested.connect(self.on_download_requested)
+        return profile
+
+    def configure_web_profile(self, profile, paths=True):
         try:
-            with open('bookmarks.json', 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return []
+            configure_profile(profile, self.settings, paths)
+        except (OSError, ValueError) as e:
+            logging.getLogger('webprofile').warning('keeping the default cache and storage settings: %s', e)
+
+    def clear_cache(self):
+        """Empty the HTTP cache of every profile in this window and the local proxy's cache."""
+        profiles = self.web_profiles()
+        used = sum(cache_usage(profile) for profile in profiles)
+        for profile in profiles:
+            profile.clearHttpCache()  # asynchronous; Chromium deletes the entries in the background
+        if self.proxy is not None and not self.incognito:
+            used += self.proxy.cache.total
+            threading.Thread(target=self.proxy.cache.purge, daemon=True).start()
+
+        def report():
+            freed = used - sum(cache_usage(profile) for profile in profiles)
+            self.statusBar().showMessage(f"Cache cleared, {max(freed, 0) / 2**20:.1f} MB freed", 5000)
+        QTimer.singleShot(2000, report)
+
+    def web_profiles(self):
+        return [self.web_profile] + list(self.route_profiles.values())
+
+    def watch_filters(self):
+        paths = glob.glob(self.ad_blocker.filter_lists)
+        if QDir('filters').exists():
+            paths.append('filters')
+        if paths:
+            self.filter_watcher.addPaths(paths)
+
+    def reload_filters(self, path=None):
+        # Recompiling a changed list can take a while; the interceptor keeps
+        # using the old snapshot until the new one is swapped in
+        self.watch_filters()  # editors often replace the file, dropping the watch
+
+        def reload():
+            self.ad_blocker.reload()
+            self.filters_reloaded.emit()  # queued to the GUI thread
+        threading.Thread(target=reload, daemon=True).start()
+
+    def install_cosmetic_filters(self):
+        """Give every open page the element hiding stylesheet from the current lists; the next load applies it."""
+        for i in range(self.tabs.count()):
+            view = self.tabs.widget(i)
+            if isinstance(view, QWebEngineView) and isinstance(view.page(), FilteredPage):
+                view.page().install_cosmetic_filters(view.url().host(), force=True)
+
+    def new_page(self, url, view):
+        return FilteredPage(self.profile_for(url), view, self.ad_blocker)
 
-    def save_bookmarks(self):
-        with open('bookmarks.json', 'w') as f:
-            json.dump(self.bookmarks, f, indent=4)
+    def create_new_tab(self, url, title):
+        """Create a new tab with the given URL and title."""
+        browser_view = QWebEngineView()
+        browser_view.setPage(self.new_page(url, browser_view))
+        browser_view.setUrl(url)
+        self.setup_view(browser_view, title)
 
-    def load_history(self):
-        try:
-            with open('history.json', 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return []
+        # Add the new tab to the tab widget
+        self.tabs.addTab(browser_view, title)
+        self.tabs.setCurrentWidget(browser_view)
+
+        # Add the URL to history; the store writes it out in the background
+        self.history.record_visit(url.toString())
+        self.omnibox.note_visit(url.toString())
+
+    def run_commands(self, commands):
+        """Carry out command-line flags handed over by a later launch."""
+        if CLEAR_CACHE_FLAG in commands:
+            self.clear_cache()
+
+    def open_urls(self, urls):
+        """Open URLs handed over by a later launch and bring the window forward."""
+        urls = urls or ["https://duckduckgo.com"]
+        if self.profile is None:
+            self.pending_urls.extend(urls)  # finish_startup opens them
+            return
+        for url in urls:
+            qurl = QUrl.fromUserInput(url)
+            self.create_new_tab(qurl, qurl.host() or url)
+        if self.isMinimized():
+            self.showMaximized()
+        self.raise_()
+        self.activateWindow()
+
+    def setup_view(self, browser_view, title):
+        self.waterfall.attach(browser_view)
+        # Connect signals to handle URL changes and history
+        browser_view.urlChanged.connect(self.update_url_bar)
+        browser_view.loadFinished.connect(lambda _, title=title: self.tabs.setTabText(self.tabs.indexOf(browser_view), title))
 
-    def save_history(self):
-        with open('history.json', 'w') as f:
-            json.dump(self.history, f, indent=4)
+    def restore_session(self):
+        saved_tabs, current = self.profile.load_session()
+        if not saved_tabs:
+            return False
+        self.restoring = True
+        for url, title, state, scroll_x, scroll_y in saved_tabs:
+            self.tabs.addTab(TabStub(url, title, state, (scroll_x, scroll_y)), title)
+        self.restoring = False
+        self.tabs.setCurrentIndex(min(current, len(saved_tabs) - 1))
+        self.activate_tab(self.tabs.currentIndex())
+        return True
+
+    def activate_tab(self, index):
+        stub = self.tabs.widget(index)
+        if self.restoring or not isinstance(stub, TabStub):
+            return
+        browser_view = build_view(stub, lambda view: self.new_page(stub.url(), view))
+        self.setup_view(browser_view, stub.title)
+        replace_tab(self.tabs, index, browser_view, stub.title)
+        self.tab_memory.last_active[browser_view] = self.tab_memory.last_active.pop(stub, time.monotonic())
+        if stub.discarded:
+            logging.getLogger('tabs').info('reloaded discarded tab %d %s', index, stub.url().toString())
+
+    def save_session(self):
+        if self.incognito:
+            return
+        tabs = [tab_state(self.tabs.widget(i), self.tabs.tabText(i)) for i in range(self.tabs.count())]
+        self.profile.save_session(tabs, self.tabs.currentIndex())
 
     def open_new_tab(self):
         self.create_new_tab(QUrl("https://duckduckgo.com"), "New Tab")
@@ -80,25 +490,34 @@ class Browser(QMainWindow):
                 else:
                     self.tabs.setCurrentIndex(0)
             self.tabs.removeTab(index)
+            self.waterfall.forget(current_browser)
             current_browser.deleteLater()
 
+    def close_current_tab(self):
+        self.close_tab(self.tabs.currentIndex())
+
     def create_navigation_bar(self):
-        nav_bar = QToolBar()
+        nav_bar = self.nav_bar = QToolBar()
         self.addToolBar(nav_bar)
+        self.nav_icons = []  # (action, icon file), loaded after the first paint
 
-        back_btn = QAction(QIcon('icons/back.png'), 'Back', self)
+        back_btn = QAction('Back', self)
+        self.nav_icons.append((back_btn, 'icons/back.png'))
         back_btn.triggered.connect(self.navigate_back)
         nav_bar.addAction(back_btn)
 
-        forward_btn = QAction(QIcon('icons/forward.png'), 'Forward', self)
+        forward_btn = QAction('Forward', self)
+        self.nav_icons.append((forward_btn, 'icons/forward.png'))
         forward_btn.triggered.connect(self.navigate_forward)
         nav_bar.addAction(forward_btn)
 
-        reload_btn = QAction(QIcon('icons/reload.png'), 'Reload', self)
+        reload_btn = QAction('Reload', self)
+        self.nav_icons.append((reload_btn, 'icons/reload.png'))
         reload_btn.triggered.connect(self.reload_page)
         nav_bar.addAction(reload_btn)
 
-        home_btn = QAction(QIcon('icons/home.png'), 'Home', self)
+        home_btn = QAction('Home', self)
+        self.nav_icons.append((home_btn, 'icons/home.png'))
         home_btn.triggered.connect(self.navigate_home)
         nav_bar.addAction(home_btn)
 
@@ -106,25 +525,36 @@ class Browser(QMainWindow):
         self.url_bar.returnPressed.connect(self.navigate_to_url)
         nav_bar.addWidget(self.url_bar)
 
-        bookmark_btn = QAction(QIcon('icons/bookmark.png'), 'Bookmark', self)
+        bookmark_btn = QAction('Bookmark', self)
+        self.nav_icons.append((bookmark_btn, 'icons/bookmark.png'))
         bookmark_btn.triggered.connect(self.add_bookmark)
         nav_bar.addAction(bookmark_btn)
 
-        bookmarks_btn = QAction(QIcon('icons/bookmarks.png'), 'Bookmarks', self)
+        bookmarks_btn = QAction('Bookmarks', self)
+        self.nav_icons.append((bookmarks_btn, 'icons/bookmarks.png'))
         bookmarks_btn.triggered.connect(self.view_bookmarks)
         nav_bar.addAction(bookmarks_btn)
 
-        history_btn = QAction(QIcon('icons/history.png'), 'History', self)
+        history_btn = QAction('History', self)
+        self.nav_icons.append((history_btn, 'icons/history.png'))
         history_btn.triggered.connect(self.view_history)
         nav_bar.addAction(history_btn)
 
+        blocked_btn = QAction('Blocked', self)
+        self.nav_icons.append((blocked_btn, 'icons/blocked.png'))
+        blocked_btn.triggered.connect(self.view_block_stats)
+        nav_bar.addAction(blocked_btn)
+
+    def load_icons(self):
+        for action, path in self.nav_icons:
+            action.setIcon(QIcon(path))
+
     def add_bookmark(self):
         current_url = self.tabs.currentWidget().url().toString()
         title, ok = QInputDialog.getText(self, "Bookmark Title", "Enter a title for the bookmark:", text=current_url)
         if ok and title:
-            if {"title": title, "url": current_url} not in self.bookmarks:
-                self.bookmarks.append({"title": title, "url": current_url})
-                self.save_bookmarks()
+            if not self.bookmarks.contains(current_url):
+                self.bookmarks.add(title, current_url)
                 QMessageBox.information(self, "Bookmark Added", f"Bookmarked {title}")
             else:
                 QMessageBox.warning(self, "Already Bookmarked", "This page is already bookmarked.")
@@ -136,32 +566,79 @@ class Browser(QMainWindow):
         dialog.resize(400, 300)
         layout = QVBoxLayout()
 
-        list_widget = QListWidget()
-        for bm in self.bookmarks:
-            item = QListWidgetItem(f"{bm['title']} - {bm['url']}")
-            list_widget.addItem(item)
+        model = BookmarkModel(self.bookmarks, dialog)
+        search = QLineEdit()
+        search.setPlaceholderText("Search bookmarks")
+        connect_filter(search, model)
+        layout.addWidget(search)
+
+        view = QListView()
+        view.setModel(model)
+        view.setUniformItemSizes(True)
+        view.doubleClicked.connect(lambda index: self.activate_bookmark(view, index))
+        layout.addWidget(view)
 
-        layout.addWidget(list_widget)
+        up_btn = QPushButton("Up")
+        up_btn.clicked.connect(lambda: self.open_parent_folder(view))
+        layout.addWidget(up_btn)
 
         edit_btn = QPushButton("Edit")
-        edit_btn.clicked.connect(lambda: self.edit_bookmark(list_widget))
+        edit_btn.clicked.connect(lambda: self.edit_bookmark(view))
         layout.addWidget(edit_btn)
 
         add_btn = QPushButton("Add New Bookmark")
-        add_btn.clicked.connect(self.add_new_bookmark)
+        add_btn.clicked.connect(lambda: self.add_new_bookmark(view))
         layout.addWidget(add_btn)
 
+        folder_btn = QPushButton("New Folder")
+        folder_btn.clicked.connect(lambda: self.add_bookmark_folder(view))
+        layout.addWidget(folder_btn)
+
+        delete_btn = QPushButton("Delete")
+        delete_btn.clicked.connect(lambda: self.delete_bookmark(view))
+        layout.addWidget(delete_btn)
+
         dialog.setLayout(layout)
         dialog.exec_()
 
-    def edit_bookmark(self, list_widget):
-        selected_item = list_widget.currentItem()
-        if selected_item:
-            title, url = self.extract_title_url(selected_item.text())
-            self.show_bookmark_dialog(title, url, "Edit Bookmark", lambda t, u: self.update_bookmark(selected_item, t, u))
+    def activate_bookmark(self, view, index):
+        bm = view.model().row_at(index)
+        if bm is None:
+            return
+        if bm.is_folder:
+            view.model().open_folder(bm.id)
+        else:
+            self.create_new_tab(QUrl(bm.url), bm.title)
+
+    def open_parent_folder(self, view):
+        model = view.model()
+        if model.folder_id is not None:
+            folder = self.bookmarks.get(model.folder_id)
+            model.open_folder(folder.parent_id if folder else None)
+
+    def edit_bookmark(self, view):
+        bm = view.model().row_at(view.currentIndex())
+        if bm:
+            self.show_bookmark_dialog(bm.title, bm.url, "Edit Bookmark",
+                                      lambda t, u: self.update_bookmark(view.model(), bm.id, t, u))
+
+    def add_new_bookmark(self, view):
+        model = view.model()
+        self.show_bookmark_dialog("", "", "Add Bookmark",
+                                  lambda t, u: self.add_bookmark_from_dialog(t, u, model.folder_id, model))
+
+    def add_bookmark_folder(self, view):
+        model = view.model()
+        title, ok = QInputDialog.getText(self, "New Folder", "Folder name:")
+        if ok and title:
+            self.bookmarks.add_folder(title, model.folder_id)
+            model.refresh()
 
-    def add_new_bookmark(self):
-        self.show_bookmark_dialog("", "", "Add Bookmark", self.add_bookmark_from_dialog)
+    def delete_bookmark(self, view):
+        bm = view.model().row_at(view.currentIndex())
+        if bm:
+            self.bookmarks.remove(bm.id)
+            view.model().refresh()
 
     def show_bookmark_dialog(self, title, url, dialog_title, callback):
         dialog = QDialog(self)
@@ -182,25 +659,20 @@ class Browser(QMainWindow):
         dialog.setLayout(layout)
         dialog.exec_()
 
-    def update_bookmark(self, list_widget_item, new_title, new_url):
-        index = self.bookmarks.index(next(bm for bm in self.bookmarks if bm["title"] == list_widget_item.text().split(" - ")[0]))
-        self.bookmarks[index] = {"title": new_title, "url": new_url}
-        self.save_bookmarks()
-        list_widget_item.setText(f"{new_title} - {new_url}")
+    def update_bookmark(self, model, bookmark_id, new_title, new_url):
+        self.bookmarks.update(bookmark_id, new_title, new_url)
+        model.refresh()
         QMessageBox.information(self, "Bookmark Updated", "Bookmark updated successfully.")
 
-    def add_bookmark_from_dialog(self, title, url):
-        if {"title": title, "url": url} not in self.bookmarks and title and url:
-            self.bookmarks.append({"title": title, "url": url})
-            self.save_bookmarks()
+    def add_bookmark_from_dialog(self, title, url, parent_id=None, model=None):
+        if title and url and not self.bookmarks.contains(url):
+            self.bookmarks.add(title, url, parent_id)
+            if model is not None:
+                model.refresh()
             QMessageBox.information(self, "Bookmark Added", f"Bookmarked {title}")
         else:
             QMessageBox.information(self, "Already Bookmarked", "This page is already bookmarked or invalid.")
 
-    def extract_title_url(self, bookmark_str):
-        title, url = bookmark_str.split(' - ')
-        return title, url
-
     def view_history(self):
         dialog = QDialog(self)
         dialog.setWindowTitle("History")
@@ -208,79 +680,227 @@ class Browser(QMainWindow):
         dialog.resize(400, 300)
         layout = QVBoxLayout()
 
-        list_widget = QListWidget()
-        for url in self.history[::-1]:
-            item = QListWidgetItem(url)
-            list_widget.addItem(item)
+        model = HistoryModel(self.history, dialog)
+        search = QLineEdit()
+        search.setPlaceholderText("Search history")
+        connect_filter(search, model)
+        layout.addWidget(search)
 
-        layout.addWidget(list_widget)
+        view = QListView()
+        view.setModel(model)
+        view.setUniformItemSizes(True)
+        view.doubleClicked.connect(lambda index: self.open_history_page(view))
+        layout.addWidget(view)
 
         clear_btn = QPushButton("Clear History")
-        clear_btn.clicked.connect(self.clear_history)
+        clear_btn.clicked.connect(lambda: self.clear_history(model))
         layout.addWidget(clear_btn)
 
         open_btn = QPushButton("Open")
-        open_btn.clicked.connect(lambda: self.open_history_page(list_widget))
+        open_btn.clicked.connect(lambda: self.open_history_page(view))
         layout.addWidget(open_btn)
 
         dialog.setLayout(layout)
         dialog.exec_()
 
-    def clear_history(self):
+    def clear_history(self, model=None):
         self.history.clear()
-        self.save_history()
+        # Its lines name the blocked URLs, which say where you have been
+        threading.Thread(target=self.block_log.clear, daemon=True).start()
+        self.omnibox.executor.submit(self.omnibox.rebuild)  # drops the visits it was still suggesting
+        if model is not None:
+            model.refresh()
         QMessageBox.information(self, "History Cleared", "Browser history has been cleared.")
-class Browser(QMainWindow):
-    def __init__(self, incognito=False):
-        super(Browser, self).__init__()
-        self.incognito = incognito
-        self.tabs = QTabWidget()
-        self.tabs.setDocumentMode(True)
-        self.tabs.setTabsClosable(True)
-        self.tabs.tabCloseRequested.connect(self.close_tab)
-        self.tabs.tabBarDoubleClicked.connect(self.open_new_tab)
-        self.setCentralWidget(self.tabs)
-
-        self.history = self.load_history()
-        self.bookmarks = self.load_bookmarks()
-
-        # Create the home tab
-        self.create_new_tab(QUrl("https://duckduckgo.com"), "Home")
-        self.showMaximized()
-        self.setWindowTitle('Custom Browser')
-
-        self.create_navigation_bar()
-        self.create_shortcuts()
-        self.setup_styles()
-
-        # Set up ad blocker
-        self.ad_blocker = AdBlocker()
-        profile = QWebEngineProfile.defaultProfile()
-        profile.setRequestInterceptor(self)
 
-    def create_new_tab(self, url, title):
-        """Create a new tab with the given URL and title."""
-        browser_view = QWebEngineView()
-        browser_view.setUrl(url)
+    def download_dir(self):
+        return self.settings['download_dir'] or QStandardPaths.writableLocation(QStandardPaths.DownloadLocation)
+
+    def download_headers(self, url=None):
+        headers = {'User-Agent': self.web_profile.httpUserAgent()}
+        cookie = self.cookie_jar.header(url) if url else ''
+        if cookie:
+            headers['Cookie'] = cookie
+        if self.incognito:
+            headers[PRIVATE_HEADER] = '1'  # kept out of the proxy's disk cache, like the window's pages
+        return headers
+
+    def on_download_requested(self, item):
+        """Save to the download folder without asking; big HTTP downloads go to the segmented downloader."""
+        url = item.url().toString()
+        name = item.suggestedFileName() if hasattr(item, 'suggestedFileName') else os.path.basename(item.path())
+        path = download_path(self.download_dir(), name, url)
+        takeover = self.settings['download_takeover_mb'] * 2**20
+        save_page = getattr(item, 'isSavePageDownload', lambda: False)()
+        if takeover and item.totalBytes() >= takeover and url.startswith(('http://', 'https://')) and not save_page:
+            item.cancel()
+            self.downloads.add(url, path, self.download_headers(url))
+            self.statusBar().showMessage(f"Downloading {os.path.basename(path)} in {self.settings['download_segments']} segments", 5000)
+            return
+        item.setPath(path)
+        item.accept()
+        self.statusBar().showMessage(f"Downloading {os.path.basename(path)}", 5000)
+
+    def show_download_state(self, download):
+        name = os.path.basename(download.path)
+        if download.state == 'finished':
+            self.statusBar().showMessage(f"Downloaded {name}", 5000)
+        elif download.state == 'failed':
+            self.statusBar().showMessage(f"Download of {name} failed: {download.error}", 10000)
+
+    def view_block_stats(self):
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Blocked Requests")
+        dialog.resize(500, 400)
+        layout = QVBoxLayout()
 
-        # Connect signals to handle URL changes and history
-        browser_view.urlChanged.connect(self.update_url_bar)
-        browser_view.loadFinished.connect(lambda _, title=title: self.tabs.setTabText(self.tabs.indexOf(browser_view), title))
+        table = QTableWidget(self.tabs.count(), 3)
+        table.setHorizontalHeaderLabels(["Tab", "Blocked", "Est. saved"])
+        table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        for i in range(self.tabs.count()):
+            page = getattr(self.tabs.widget(i), 'page', lambda: None)()  # stubs have no page
+            blocked, saved = self.block_log.page_stats(getattr(page, 'block_key', None))
+            table.setItem(i, 0, QTableWidgetItem(self.tabs.tabText(i)))
+            table.setItem(i, 1, QTableWidgetItem(str(blocked)))
+            table.setItem(i, 2, QTableWidgetItem(f"{saved / 1024:.0f} KB"))
+        layout.addWidget(table)
+
+        layout.addWidget(QLabel(f"Total: {self.block_log.blocked} requests blocked, "
+                                f"about {self.block_log.bytes_saved / 2**20:.1f} MB saved"))
+        domains = QListWidget()
+        for host, count in self.block_log.top_domains():
+            domains.addItem(f"{host}  ({count})")
+        layout.addWidget(QLabel("Most blocked domains:"))
+        layout.addWidget(domains)
 
-        # Add the new tab to the tab widget
-        self.tabs.addTab(browser_view, title)
-        self.tabs.setCurrentWidget(browser_view)
+        dialog.setLayout(layout)
+        dialog.exec_()
 
-        # Add the URL to history
-        self.history.append(url.toString())
-        self.save_history()
+    def closeEvent(self, event):
+        if self.profile is not None:
+            self.subscriptions.close()
+            self.save_session()
+            self.omnibox.close()
+            self.profile.close()
+        self.block_log.close()
+        self.downloads.close()  # interrupted downloads keep their segment maps and resume next time
+        super(Browser, self).closeEvent(event)
+
+    def open_history_page(self, view):
+        url = view.model().url_at(view.currentIndex())
+        if url:
+            self.create_new_tab(QUrl(url), "History")
+
+    def create_shortcuts(self):
+        new_tab_action = QAction('New Tab', self)
+        new_tab_action.setShortcut('Ctrl+T')
+        new_tab_action.triggered.connect(self.open_new_tab)
+        self.addAction(new_tab_action)
+
+        close_tab_action = QAction('Close Tab', self)
+        close_tab_action.setShortcut('Ctrl+W')
+        close_tab_action.triggered.connect(self.close_current_tab)
+        self.addAction(close_tab_action)
+
+        capture_action = QAction('Record Network', self)
+        capture_action.setShortcut('Ctrl+Shift+E')
+        capture_action.setCheckable(True)
+        capture_action.toggled.connect(self.toggle_network_capture)
+        self.addAction(capture_action)
+
+        clear_cache_action = QAction('Clear Cache', self)
+        clear_cache_action.setShortcut('Ctrl+Shift+Delete')
+        clear_cache_action.triggered.connect(self.clear_cache)
+        self.addAction(clear_cache_action)
+
+        incognito_action = QAction('New Incognito Window', self)
+        incognito_action.setShortcut('Ctrl+Shift+N')
+        incognito_action.triggered.connect(self.open_incognito_window)
+        self.addAction(incognito_action)
+
+        export_har_action = QAction('Export HAR', self)
+        export_har_action.setShortcut('Ctrl+Shift+H')
+        export_har_action.triggered.connect(self.export_har)
+        self.addAction(export_har_action)
+
+    def open_incognito_window(self):
+        window = Browser(incognito=True, opener=self)
+        window.setAttribute(Qt.WA_DeleteOnClose)
+        window.showMaximized()
+
+    def toggle_network_capture(self, enabled):
+        views = [w for w in (self.tabs.widget(i) for i in range(self.tabs.count())) if isinstance(w, QWebEngineView)]
+        self.waterfall.set_enabled(enabled, views)
+        self.statusBar().showMessage("Recording network requests" if enabled else "Network recording stopped", 3000)
+
+    def export_har(self):
+        view = self.tabs.currentWidget()
+        if view not in self.waterfall.captures:
+            QMessageBox.information(self, "Export HAR", "Nothing recorded for this tab. Start recording with Ctrl+Shift+E and reload.")
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Export HAR", "capture.har", "HAR files (*.har)")
+        if path:
+            self.waterfall.export_har(view, path, lambda path: self.statusBar().showMessage(f"Saved {path}", 3000))
+
+    def setup_styles(self):
+        palette = QPalette()
+        palette.setColor(QPalette.Window, QColor("#222"))
+        palette.setColor(QPalette.WindowText, QColor("white"))
+        self.setPalette(palette)
+        self.url_bar.setStyleSheet("border: 1px solid #555; border-radius: 5px; padding: 5px;")
+
+    def navigate_back(self):
+        self.tabs.currentWidget().back()
+
+    def navigate_forward(self):
+        self.tabs.currentWidget().forward()
+
+    def reload_page(self):
+        self.tabs.currentWidget().reload()
+
+    def navigate_home(self):
+        self.tabs.currentWidget().setUrl(QUrl("https://duckduckgo.com"))
+
+    def navigate_to_url(self):
+        url = self.url_bar.text()
+        # Check if it's a valid URL
+        if url.startswith("http://") or url.startswith("https://"):
+            qurl = QUrl(url)
+        else:
+            qurl = QUrl(f"https://duckduckgo.com/?q={url}")  # Redirect to DuckDuckGo for search
+        current = self.tabs.currentWidget()
+        if isinstance(current, QWebEngineView) and current.page().profile() is not self.profile_for(qurl):
+            # A site on another route gets a tab in that route's profile, leaving this tab's session alone
+            self.create_new_tab(qurl, qurl.host())
+        else:
+            current.setUrl(qurl)
 
-    # ... rest of your methods here ...
+    def update_url_bar(self, *args):
+        current_browser = self.tabs.currentWidget()
+        if current_browser:
+            self.url_bar.setText(current_browser.url().toString())
 
-# Add the rest of your browser methods here...
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    profiler = StartupProfiler(PROFILE_FLAG in sys.argv, STARTED)
+    profiler.mark('imports')
     app = QApplication(sys.argv)
     QApplication.setApplicationName("Custom Browser")
-    window = Browser()
+    urls, commands = launch_arguments(app.arguments())
+    incognito = INCOGNITO_FLAG in app.arguments()
+    instance_server = InstanceServer()
+    # Another launch may have started listening since the check above
+    if not incognito and not instance_server.listen(urls, commands):
+        sys.exit(0)
+    window = Browser(incognito=incognito, profiler=profiler)
+    if CLEAR_CACHE_FLAG in app.arguments():
+        window.clear_cache()  # before any page has been loaded
+    instance_server.urls_received.connect(window.open_urls)
+    instance_server.commands_received.connect(window.run_commands)
+    if urls:
+        window.open_urls(urls)
+    window.showMaximized()
+    profiler.mark('window shown')
     app.exec_()
+    instance_server.close()
@@ -0,0 +1,230 @@
+import json
+import time
+from collections import deque
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl, urlsplit
+
+from PyQt5.QtCore import QObject
+from PyQt5.QtWebEngineCore import QWebEngineUrlRequestInterceptor, QWebEngineUrlRequestInfo
+from PyQt5.QtWebEngineWidgets import QWebEnginePage
+
+MAX_ENTRIES = 2000  # per tab; older requests fall off the front
+
+# Runs in the page: the navigation entry plus every resource entry the browser kept
+RESOURCE_TIMING_JS = """
+(function () {
+    var fields = ['name', 'initiatorType', 'startTime', 'duration', 'domainLookupStart', 'domainLookupEnd',
+                  'connectStart', 'secureConnectionStart', 'connectEnd', 'requestStart', 'responseStart',
+                  'responseEnd', 'transferSize', 'encodedBodySize', 'decodedBodySize'];
+    var entries = performance.getEntriesByType('navigation').concat(performance.getEntriesByType('resource'));
+    var nav = performance.getEntriesByType('navigation')[0];
+    return JSON.stringify({
+        timeOrigin: performance.timeOrigin,
+        onContentLoad: nav ? nav.domContentLoadedEventEnd : -1,
+        onLoad: nav ? nav.loadEventEnd : -1,
+        entries: entries.map(function (e) {
+            var out = {};
+            fields.forEach(function (f) { out[f] = e[f]; });
+            return out;
+        })
+    });
+})();
+"""
+
+
+def iso_time(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def phase(start, end):
+    """Length of a Resource Timing phase in ms, or -1 when the browser didn't expose it."""
+    return round(end - start, 3) if start and end and end >= start else -1
+
+
+class TabCapture(QWebEngineUrlRequestInterceptor):
+    """Records the requests of one page into a bounded ring buffer.
+
+    Installed with QWebEnginePage.setUrlRequestInterceptor, so it only sees
+    this page's requests and runs on the GUI thread after the profile's
+    ad-block interceptor. Completion timing is merged in later from the
+    page's Resource Timing entries.
+    """
+
+    def __init__(self, view, type_names, max_entries=MAX_ENTRIES, parent=None):
+        super(TabCapture, self).__init__(parent)
+        self.view = view
+        self.type_names = type_names
+        self.entries = deque(maxlen=max_entries)
+        self.pages = deque(maxlen=64)  # one per main-frame navigation
+
+    def interceptRequest(self, info):
+        now = time.time()
+        url = info.requestUrl().toString()
+        resource_type = info.resourceType()
+        if resource_type == QWebEngineUrlRequestInfo.ResourceTypeMainFrame:
+            self.pages.append({'id': f'page_{len(self.pages) + 1}_{int(now * 1000)}', 'url': url,
+                               'started': now, 'title': url, 'onContentLoad': -1, 'onLoad': -1})
+        initiator = info.initiator() if hasattr(info, 'initiator') else info.firstPartyUrl()
+        self.entries.append({
+            'time': now,
+            'url': url,
+            'method': bytes(info.requestMethod()).decode('ascii', 'replace') or 'GET',
+            'type': self.type_names.get(resource_type, 'other'),
+            'initiator': initiator.toString(),
+            'page': self.pages[-1]['id'] if self.pages else None,
+            'timing': None,
+        })
+
+    def on_load_finished(self, ok):
+        self.collect_timing()
+
+    def collect_timing(self, callback=None):
+        """Fetch Resource Timing from the page and attach it to the recorded requests."""
+        page_id = self.pages[-1]['id'] if self.pages else None
+
+        def merge(result):
+            if result:
+                self.merge_timing(page_id, json.loads(result))
+            if callback is not None:
+                callback()
+        self.view.page().runJavaScript(RESOURCE_TIMING_JS, merge)
+
+    def merge_timing(self, page_id, timing):
+        if page_id is None:
+            return
+        page = next((p for p in self.pages if p['id'] == page_id), None)
+        if page is not None:
+            page['title'] = self.view.title() or page['url']
+            page['onContentLoad'] = timing['onContentLoad']
+            page['onLoad'] = timing['onLoad']
+        waiting = {}
+        for entry in self.entries:
+            if entry['page'] == page_id and entry['timing'] is None:
+                waiting.setdefault(entry['url'], deque()).append(entry)
+        for resource in timing['entries']:
+            queue = waiting.get(resource['name'])
+            if queue:
+                entry = queue.popleft()
+                entry['timing'] = resource
+                entry['time_origin'] = timing['timeOrigin']
+
+    def har_entry(self, entry):
+        timing = entry['timing']
+        request = {
+            'method': entry['method'], 'url': entry['url'], 'httpVersion': '', 'cookies': [], 'headers': [],
+            'queryString': [{'name': k, 'value': v} for k, v in parse_qsl(urlsplit(entry['url']).query)],
+            'headersSize': -1, 'bodySize': -1,
+        }
+        response = {
+            'status': 0, 'statusText': '', 'httpVersion': '', 'cookies': [], 'headers': [],
+            'content': {'size': 0, 'mimeType': ''}, 'redirectURL': '', 'headersSize': -1, 'bodySize': -1,
+        }
+        har = {
+            'startedDateTime': iso_time(entry['time']), 'time': 0,
+            'request': request, 'response': response, 'cache': {},
+            'timings': {'blocked': -1, 'dns': -1, 'connect': -1, 'ssl': -1, 'send': 0, 'wait': 0, 'receive': 0},
+            '_resourceType': entry['type'], '_initiator': entry['initiator'],
+        }
+        if entry['page'] is not None:
+            har['pageref'] = entry['page']
+        if timing is None:
+            har['_error'] = 'no Resource Timing entry (blocked, failed or still loading)'
+            return har
+        har['startedDateTime'] = iso_time((entry['time_origin'] + timing['startTime']) / 1000)
+        har['time'] = round(timing['duration'], 3)
+        response['content']['size'] = timing['decodedBodySize'] or 0
+        response['bodySize'] = timing['encodedBodySize'] or -1
+        response['_transferSize'] = timing['transferSize']
+        if timing['requestStart'] and timing['responseStart']:
+            har['timings'].update(
+                blocked=phase(timing['startTime'], timing['domainLookupStart'] or timing['requestStart']),
+                dns=phase(timing['domainLookupStart'], timing['domainLookupEnd']),
+                connect=phase(timing['connectStart'], timing['connectEnd']),
+                ssl=phase(timing['secureConnectionStart'], timing['connectEnd']),
+                wait=round(timing['responseStart'] - timing['requestStart'], 3),
+                receive=round(timing['responseEnd'] - timing['responseStart'], 3),
+            )
+        else:
+            # Cross-origin resources without Timing-Allow-Origin only expose the total
+            har['timings']['wait'] = har['time']
+        return har
+
+    def to_har(self, creator_version=''):
+        """The captured requests as a HAR 1.2 document (a dict ready for json.dump)."""
+        return {'log': {
+            'version': '1.2',
+            'creator': {'name': 'Custom Browser', 'version': creator_version},
+            'pages': [
+                {'startedDateTime': iso_time(page['started']), 'id': page['id'], 'title': page['title'],
+                 'pageTimings': {'onContentLoad': page['onContentLoad'], 'onLoad': page['onLoad']}}
+                for page in self.pages
+            ],
+            'entries': [self.har_entry(entry) for entry in self.entries],
+        }}
+
+
+class WaterfallCapture(QObject):
+    """Turns per-tab request capture on and off for every tab.
+
+    While disabled no page has an interceptor and nothing is connected, so
+    capture costs nothing on the request path. Enabling it installs a
+    TabCapture on each live page and on every page created afterwards.
+    Disabling removes the interceptors but keeps what was recorded until
+    capture is enabled again, so it can still be exported.
+    """
+
+    def __init__(self, type_names, max_entries=MAX_ENTRIES, parent=None):
+        super(WaterfallCapture, self).__init__(parent)
+        self.type_names = type_names
+        self.max_entries = max_entries
+        self.supported = hasattr(QWebEnginePage, 'setUrlRequestInterceptor')
+        self.enabled = False
+        self.captures = {}  # view -> TabCapture
+
+    def set_enabled(self, enabled, views):
+        if enabled == self.enabled or not self.supported:
+            return
+        self.enabled = enabled
+        if enabled:
+            for capture in self.captures.values():
+                capture.deleteLater()
+            self.captures = {}
+            for view in views:
+                self.attach(view)
+        else:
+            views = set(views)
+            for view in [v for v in self.captures if v not in views]:
+                self.forget(view)  # closed or discarded tabs
+            for view, capture in self.captures.items():
+                view.page().setUrlRequestInterceptor(None)
+                view.loadFinished.disconnect(capture.on_load_finished)
+
+    def attach(self, view):
+        """Start capturing view's requests if capture is on."""
+        if not self.enabled or view in self.captures:
+            return
+        capture = self.captures[view] = TabCapture(view, self.type_names, self.max_entries, self)
+        view.page().setUrlRequestInterceptor(capture)
+        view.loadFinished.connect(capture.on_load_finished)
+
+    def forget(self, view):
+        capture = self.captures.pop(view, None)
+        if capture is not None:
+            capture.deleteLater()
+
+    def export_har(self, view, path, callback=None):
+        """Write view's capture to path as HAR once fresh Resource Timing is in."""
+        capture = self.captures.get(view)
+        if capture is None:
+            return False
+
+        def write():
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(capture.to_har(), f, indent=1)
+            if callback is not None:
+                callback(path)
+        if self.enabled:
+            capture.collect_timing(write)
+        else:
+            write()
+        return True
@@ -0,0 +1,55 @@
+import os
+
+from PyQt5.QtWebEngineWidgets import QWebEngineProfile
+
+# Setting values mapped to QWebEngineProfile enum names
+CACHE_TYPES = {'disk': 'DiskHttpCache', 'memory': 'MemoryHttpCache', 'none': 'NoCache'}
+COOKIE_POLICIES = {
+    'persistent': 'AllowPersistentCookies',  # session cookies stay in memory, the rest go to disk
+    'session': 'NoPersistentCookies',  # every cookie is dropped on exit
+    'force': 'ForcePersistentCookies',  # session cookies are kept across restarts too
+}
+
+
+def configure_profile(profile, settings, paths=True):
+    """Apply the web_* settings to a persistent profile before it loads any page.
+
+    web_cache_type picks a disk, memory or no HTTP cache, web_cache_mb caps
+    it (0 lets Chromium size it), and web_cookies sets how cookies persist.
+    With paths, web_cache_path and web_storage_path move the cache and the
+    cookies/local storage, e.g. the cache onto a tmpfs. Every value is
+    checked before any is applied, so a ValueError leaves profile as it was.
+    """
+    cache_type = settings['web_cache_type']
+    cookies = settings['web_cookies']
+    if cache_type not in CACHE_TYPES:
+        raise ValueError(f'web_cache_type must be one of {", ".join(CACHE_TYPES)}, not {cache_type!r}')
+    if cookies not in COOKIE_POLICIES:
+        raise ValueError(f'web_cookies must be one of {", ".join(COOKIE_POLICIES)}, not {cookies!r}')
+    if settings['web_cache_mb'] < 0:
+        raise ValueError('web_cache_mb must not be negative')
+
+    if paths:
+        if settings['web_cache_path']:
+            os.makedirs(settings['web_cache_path'], exist_ok=True)
+            profile.setCachePath(os.path.abspath(settings['web_cache_path']))
+        if settings['web_storage_path']:
+            os.makedirs(settings['web_storage_path'], exist_ok=True)
+            profile.setPersistentStoragePath(os.path.abspath(settings['web_storage_path']))
+    profile.setHttpCacheType(getattr(QWebEngineProfile, CACHE_TYPES[cache_type]))
+    profile.setHttpCacheMaximumSize(settings['web_cache_mb'] * 2**20)
+    profile.setPersistentCookiesPolicy(getattr(QWebEngineProfile, COOKIE_POLICIES[cookies]))
+
+
+def cache_usage(profile):
+    """Bytes the profile's HTTP cache takes on disk (0 unless it is a disk cache)."""
+    if profile.httpCacheType() != QWebEngineProfile.DiskHttpCache:
+        return 0
+    total = 0
+    for dirpath, _, filenames in os.walk(profile.cachePath()):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass  # Chromium may delete entries while we walk
+    return total